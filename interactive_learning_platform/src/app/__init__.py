@@ -4,6 +4,14 @@ from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_cors import CORS
 from app.models import db as models_db # Import the SQLAlchemy instance from models.py
+from app.password_hashing import hasher
+from app.identity_cache import user_cache, load_cached_user, register_invalidation
+from app.ingest import ingestor
+from app.activity_cache import activity_cache, register_versioning
+from app.sqlite_profile import sqlite_profile
+from app.genai_jobs import genai_jobs
+from app.genai_cache import genai_cache
+from app.genai_client import genai_client
 
 # Initialize extensions outside of create_app
 db = models_db # Use the imported db instance
@@ -16,10 +24,20 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     # Initialize extensions
+    sqlite_profile.init_app(app) # Adds the read-only 'reports' bind, so it goes before db
     db.init_app(app)
+    sqlite_profile.configure_engines(app) # Per-connection PRAGMAs and the maintenance thread
+    app.teardown_appcontext(sqlite_profile.remove_read_session)
     migrate.init_app(app, db)
     login.init_app(app)
     CORS(app) # Enable CORS for all routes
+    hasher.init_app(app) # Bounded worker pool for password hashing
+    user_cache.init_app(app) # LRU/TTL cache consulted by load_user
+    activity_cache.init_app(app) # Parsed activity content, keyed by content version
+    ingestor.init_app(app) # Optional write-behind path for submit_response
+    genai_jobs.init_app(app) # Background workers for GenAI tasks
+    genai_cache.init_app(app) # Persistent cache of GenAI outputs
+    genai_client.init_app(app) # Pooled provider client: timeouts, retries, concurrency limit
 
     # Import and register blueprints
     from app.routes import main as main_bp
@@ -29,7 +47,27 @@ def create_app(config_class=Config):
     from app.models import User
     @login.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        return load_cached_user(db.session, User, int(id))
+    register_invalidation(User)
+    from app.models import Activity
+    register_versioning(Activity)
+
+    # CLI commands
+    from app.aggregates import reconcile_aggregates_command, backfill_response_columns_command
+    app.cli.add_command(reconcile_aggregates_command)
+    app.cli.add_command(backfill_response_columns_command)
+    from app.submissions import dedupe_responses_command
+    app.cli.add_command(dedupe_responses_command)
+    from app.leaderboard import rebuild_leaderboards_command
+    app.cli.add_command(rebuild_leaderboards_command)
+    from app.grading import regrade_activity_command
+    app.cli.add_command(regrade_activity_command)
+    from app.ingest import ingest_replay_command
+    app.cli.add_command(ingest_replay_command)
+    from app.genai_jobs import genai_worker_command
+    app.cli.add_command(genai_worker_command)
+    from app.sqlite_profile import sqlite_maintenance_command
+    app.cli.add_command(sqlite_maintenance_command)
 
     return app
 
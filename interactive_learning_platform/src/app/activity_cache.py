@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+
+from app.aggregates import parse_activity_content, quiz_answer_key, quiz_answer_keys
+
+
+class CompiledActivity(object):
+    """
+    An activity's content, parsed and normalized once. Shared between requests: treat as read-only.
+
+    Attributes:
+        content (dict): The parsed content ({} if it was not valid JSON).
+        questions (list): The questions as dicts; a single-question quiz stored flat becomes a list of one.
+        options (list): The options of a poll, or of a quiz's first question, as strings.
+        answer_key (str): A quiz's correct answer, or None.
+        answer_keys (list): A quiz's correct answer per question (None where a question has none).
+    """
+
+    __slots__ = ('activity_id', 'version', 'content', 'questions', 'options', 'answer_key', 'answer_keys')
+
+    def __init__(self, activity):
+        self.activity_id = activity.id
+        self.version = activity.content_version
+        content = parse_activity_content(activity)
+        self.content = content if isinstance(content, dict) else {}
+
+        questions = self.content.get('questions')
+        if isinstance(questions, list):
+            self.questions = [q for q in questions if isinstance(q, dict)]
+        elif 'question' in self.content:
+            self.questions = [self.content]
+        else:
+            self.questions = []
+
+        options = self.content.get('options')
+        if options is None and self.questions:
+            options = self.questions[0].get('options')
+        self.options = [str(option) for option in options] if isinstance(options, list) else []
+
+        answer_key = quiz_answer_key(self.content)
+        self.answer_key = str(answer_key) if answer_key is not None else None
+        self.answer_keys = quiz_answer_keys(self.content)
+
+    @property
+    def multi_question(self):
+        """Whether answers are submitted as an 'answers' list (one per question) rather than one 'answer'."""
+        return len(self.questions) > 1
+
+
+class ActivityContentCache(object):
+    """
+    A bounded LRU cache of CompiledActivity, keyed by (activity id, content_version).
+
+    Activity.content_version is bumped whenever an activity's content or active state
+    changes, so a request that has loaded the activity row always looks up the current
+    version: other worker processes can never serve a stale compile, and entries for
+    older versions simply age out. Local entries are also dropped on update and delete.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config['ACTIVITY_CACHE_SIZE']
+        self.clear()
+
+    def get(self, activity):
+        """Returns the CompiledActivity for a loaded Activity, compiling it on a miss."""
+        key = (activity.id, activity.content_version)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        compiled = CompiledActivity(activity)
+        if self.maxsize > 0 and activity.id is not None:
+            with self._lock:
+                self._entries[key] = compiled
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, activity_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == activity_id]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+activity_cache = ActivityContentCache()
+_versioning_registered = False
+
+
+def register_versioning(activity_model):
+    """
+    Bumps Activity.content_version when an activity is edited or toggled, and drops its cache entries.
+
+    Bulk query.update() calls bypass these events and must bump content_version themselves.
+    """
+    global _versioning_registered
+    if _versioning_registered:
+        return
+    _versioning_registered = True
+
+    @event.listens_for(activity_model, 'before_update')
+    def _bump(mapper, connection, target):
+        changed = any(attributes.get_history(target, name).has_changes() for name in ('content', 'is_active', 'type'))
+        if changed:
+            target.content_version = (target.content_version or 0) + 1
+
+    def _forget(mapper, connection, target):
+        activity_cache.invalidate(target.id)
+
+    event.listen(activity_model, 'after_update', _forget)
+    event.listen(activity_model, 'after_delete', _forget)
@@ -0,0 +1,339 @@
+import json
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import db, Activity, ActivityTally, Response
+
+KEY_LENGTH = 255
+
+
+def quiz_answer_key(content):
+    """Returns the correct answer of a (single-question) quiz's content, or None."""
+    if not isinstance(content, dict):
+        return None
+    if content.get('correct_answer') is not None:
+        return content['correct_answer']
+    questions = content.get('questions') or []
+    if questions and isinstance(questions[0], dict):
+        return questions[0].get('correct_answer')
+    return None
+
+
+def quiz_answer_keys(content):
+    """Returns the correct answer of each question of a quiz's content (None for ungraded questions)."""
+    if not isinstance(content, dict):
+        return []
+    questions = content.get('questions')
+    if isinstance(questions, list):
+        return [str(q['correct_answer']) if isinstance(q, dict) and q.get('correct_answer') is not None else None
+                for q in questions]
+    if 'question' in content or content.get('correct_answer') is not None:
+        return [str(content['correct_answer']) if content.get('correct_answer') is not None else None]
+    return []
+
+
+def grade_answers(answers, answer_keys):
+    """
+    Marks a multi-question quiz submission against the answer keys in one pass.
+
+    Args:
+        answers (list): The submitted answers by question position (None for skipped questions).
+        answer_keys (list): The correct answers by question position, from quiz_answer_keys.
+
+    Returns:
+        list: Per question True / False, or None where the question has no key.
+    """
+    marks = []
+    for position, key in enumerate(answer_keys):
+        if key is None:
+            marks.append(None)
+        else:
+            answer = answers[position] if position < len(answers) else None
+            marks.append(answer is not None and str(answer) == key)
+    return marks
+
+
+def _submitted_answers(response_data):
+    answers = response_data.get('answers')
+    return answers if isinstance(answers, list) else None
+
+
+def response_contributions(activity_type, content, response_data, group_id=None):
+    """
+    Lists the tally rows a single response counts towards.
+
+    Args:
+        activity_type (str): The activity's type ('poll', 'quiz', 'short_answer', ...).
+        content (dict): The activity's parsed content (used for the quiz answer key).
+        response_data (dict): The parsed response payload.
+        group_id (int): The response's answer group, for short answers.
+
+    Returns:
+        list: (metric, key) pairs, each to be counted once.
+    """
+    contributions = [('responses', '')]
+    if not isinstance(response_data, dict):
+        return contributions
+
+    if activity_type == 'poll' and response_data.get('selected_option') is not None:
+        contributions.append(('option', str(response_data['selected_option'])[:KEY_LENGTH]))
+    elif activity_type == 'quiz' and _submitted_answers(response_data) is not None:
+        # Multi-question quiz: per-question option counts and correct counts, plus whole-quiz correctness
+        answers = _submitted_answers(response_data)
+        marks = grade_answers(answers, quiz_answer_keys(content))
+        for position, answer in enumerate(answers):
+            if answer is not None:
+                contributions.append(('question_option', f'{position}:{answer}'[:KEY_LENGTH]))
+        contributions.extend(('question_correct', str(position)) for position, mark in enumerate(marks) if mark)
+        if any(mark is not None for mark in marks):
+            contributions.append(('quiz', 'correct' if all(mark is not False for mark in marks) else 'incorrect'))
+    elif activity_type == 'quiz' and response_data.get('answer') is not None:
+        answer = str(response_data['answer'])
+        contributions.append(('option', answer[:KEY_LENGTH]))
+        correct_answer = quiz_answer_key(content)
+        if correct_answer is not None:
+            contributions.append(('quiz', 'correct' if answer == str(correct_answer) else 'incorrect'))
+    elif activity_type == 'short_answer' and group_id is not None:
+        contributions.append(('group', str(group_id)))
+    return contributions
+
+
+def response_columns(activity_type, content, response_data):
+    """
+    Extracts the typed Response columns from an answer payload.
+
+    Args:
+        activity_type (str): The activity's type.
+        content (dict): The activity's parsed content (used for the quiz answer key).
+        response_data (dict): The parsed response payload.
+
+    Returns:
+        dict: Values for selected_option, answer_text, is_correct and score (the number of correct questions).
+    """
+    columns = {'selected_option': None, 'answer_text': None, 'is_correct': None, 'score': None}
+    if not isinstance(response_data, dict):
+        return columns
+
+    if activity_type == 'poll' and response_data.get('selected_option') is not None:
+        columns['selected_option'] = str(response_data['selected_option'])[:KEY_LENGTH]
+    elif activity_type == 'quiz' and _submitted_answers(response_data) is not None:
+        # score counts the correct questions; is_correct means every graded question is right
+        marks = [mark for mark in grade_answers(_submitted_answers(response_data), quiz_answer_keys(content))
+                 if mark is not None]
+        if marks:
+            columns['score'] = float(sum(marks))
+            columns['is_correct'] = all(marks)
+    elif activity_type == 'quiz' and response_data.get('answer') is not None:
+        answer = str(response_data['answer'])
+        columns['selected_option'] = answer[:KEY_LENGTH]
+        correct_answer = quiz_answer_key(content)
+        if correct_answer is not None:
+            columns['is_correct'] = answer == str(correct_answer)
+            columns['score'] = 1.0 if columns['is_correct'] else 0.0
+    elif activity_type == 'short_answer' and response_data.get('answer') is not None:
+        columns['answer_text'] = str(response_data['answer'])
+    elif activity_type == 'word_cloud' and response_data.get('words') is not None:
+        columns['answer_text'] = str(response_data['words'])
+    return columns
+
+
+def parse_activity_content(activity):
+    """Returns an activity's content as a dict ({} if it is not valid JSON)."""
+    try:
+        return json.loads(activity.content)
+    except (TypeError, json.JSONDecodeError):
+        return {}
+
+
+def add_response_deltas(deltas, activity, content, response_data, previous_data=None):
+    """Accumulates the tally changes of one new or replaced response into deltas (a dict)."""
+    if previous_data is not None:
+        for metric, key in response_contributions(activity.type, content, previous_data):
+            deltas[(activity.id, metric, key)] = deltas.get((activity.id, metric, key), 0) - 1
+    for metric, key in response_contributions(activity.type, content, response_data):
+        deltas[(activity.id, metric, key)] = deltas.get((activity.id, metric, key), 0) + 1
+    return deltas
+
+
+def add_group_delta(deltas, activity_id, group_id, delta):
+    """Accumulates a change in one answer group's count into deltas."""
+    key = (activity_id, 'group', str(group_id))
+    deltas[key] = deltas.get(key, 0) + delta
+    return deltas
+
+
+def apply_deltas(deltas):
+    """Adds accumulated {(activity_id, metric, key): delta} changes with one executemany upsert."""
+    rows = [{'activity_id': activity_id, 'metric': metric, 'key': key, 'count': delta}
+            for (activity_id, metric, key), delta in deltas.items() if delta]
+    if not rows:
+        return
+    stmt = sqlite_insert(ActivityTally)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['activity_id', 'metric', 'key'],
+        set_={'count': ActivityTally.count + stmt.excluded.count}
+    )
+    db.session.execute(stmt, rows)
+
+
+def read_results(activity_id):
+    """
+    Returns an activity's results from its tallies, in O(options) rather than O(responses).
+
+    Returns:
+        dict: {'responses': int, 'options': {option: count}, 'quiz': {'correct': int, 'incorrect': int},
+               'groups': {group_id: count},
+               'questions': {position: {'options': {option: count}, 'correct': int}}}
+    """
+    results = {'responses': 0, 'options': {}, 'quiz': {'correct': 0, 'incorrect': 0}, 'groups': {}, 'questions': {}}
+    rows = db.session.query(ActivityTally.metric, ActivityTally.key, ActivityTally.count).\
+        filter(ActivityTally.activity_id == activity_id, ActivityTally.count != 0)
+    for metric, key, count in rows:
+        if metric == 'responses':
+            results['responses'] = count
+        elif metric == 'option':
+            results['options'][key] = count
+        elif metric == 'quiz':
+            results['quiz'][key] = count
+        elif metric == 'group':
+            results['groups'][int(key)] = count
+        elif metric == 'question_option':
+            position, option = key.split(':', 1)
+            question = results['questions'].setdefault(int(position), {'options': {}, 'correct': 0})
+            question['options'][option] = count
+        elif metric == 'question_correct':
+            results['questions'].setdefault(int(key), {'options': {}, 'correct': 0})['correct'] = count
+    return results
+
+
+def _valid_json(column):
+    # json_each raises on malformed JSON; NULL expands to no rows
+    return db.case((db.func.json_valid(column), column), else_=db.null())
+
+
+def rebuild_tallies(activity_ids=None):
+    """
+    Recomputes tallies from the responses' typed columns, replacing whatever is stored (without committing).
+
+    Each metric is one INSERT ... SELECT ... GROUP BY, so nothing is loaded into Python.
+
+    Args:
+        activity_ids (list): Activities to rebuild; all activities when None.
+
+    Returns:
+        int: The number of activities rebuilt.
+    """
+    tally_query = ActivityTally.query
+    activity_query = Activity.query
+    response_filter = db.true()
+    if activity_ids is not None:
+        tally_query = tally_query.filter(ActivityTally.activity_id.in_(activity_ids))
+        activity_query = activity_query.filter(Activity.id.in_(activity_ids))
+        response_filter = Response.activity_id.in_(activity_ids)
+    tally_query.delete(synchronize_session=False)
+
+    count = db.func.count()
+    # Multi-question answers are expanded in SQL with json_each (0-based positions)
+    answers = db.func.json_each(_valid_json(Response.response_data), '$.answers').table_valued('key', 'value')
+    answer_keys = db.func.json_each(_valid_json(Activity.content), '$.questions').table_valued('key', 'value')
+    question_option = db.func.substr(db.cast(answers.c.key, db.String) + ':' + db.cast(answers.c.value, db.String),
+                                     1, KEY_LENGTH)
+    selects = [
+        db.select(Response.activity_id, db.literal('responses'), db.literal(''), count).
+            where(response_filter).group_by(Response.activity_id),
+        db.select(Response.activity_id, db.literal('option'), Response.selected_option, count).
+            where(response_filter, Response.selected_option.is_not(None)).
+            group_by(Response.activity_id, Response.selected_option),
+        db.select(Response.activity_id, db.literal('quiz'),
+                  db.case((Response.is_correct, 'correct'), else_='incorrect'), count).
+            where(response_filter, Response.is_correct.is_not(None)).
+            group_by(Response.activity_id, Response.is_correct),
+        db.select(Response.activity_id, db.literal('group'), db.cast(Response.group_id, db.String), count).
+            join(Activity, Activity.id == Response.activity_id).
+            where(response_filter, Activity.type == 'short_answer', Response.group_id.is_not(None)).
+            group_by(Response.activity_id, Response.group_id),
+        db.select(Response.activity_id, db.literal('question_option'), question_option, count).
+            select_from(Response).join(answers, db.true()).
+            where(response_filter, answers.c.value.is_not(None)).
+            group_by(Response.activity_id, question_option),
+        db.select(Response.activity_id, db.literal('question_correct'), db.cast(answers.c.key, db.String), count).
+            select_from(Response).join(Activity, Activity.id == Response.activity_id).join(answers, db.true()).
+            join(answer_keys, (answer_keys.c.key == answers.c.key) &
+                 (db.cast(db.func.json_extract(answer_keys.c.value, '$.correct_answer'), db.String) ==
+                  db.cast(answers.c.value, db.String))).
+            where(response_filter).
+            group_by(Response.activity_id, answers.c.key),
+    ]
+    for select in selects:
+        db.session.execute(db.insert(ActivityTally).from_select(['activity_id', 'metric', 'key', 'count'], select))
+    return activity_query.count()
+
+
+def backfill_response_columns(batch_size=1000):
+    """
+    Fills the typed Response columns from response_data for rows written before they existed.
+
+    Also drops the redundant 'timestamp' key from payloads (submitted_at already records it).
+    Commits after each batch; safe to re-run.
+
+    Returns:
+        int: The number of responses updated.
+    """
+    activities = {activity.id: (activity.type, parse_activity_content(activity)) for activity in Activity.query}
+    updated = 0
+    last_id = 0
+    while True:
+        batch = db.session.query(Response.id, Response.activity_id, Response.response_data, Response.submitted_at).\
+            filter(Response.id > last_id).order_by(Response.id).limit(batch_size).all()
+        if not batch:
+            return updated
+        rows = []
+        for response_id, activity_id, raw_data, submitted_at in batch:
+            try:
+                data = json.loads(raw_data)
+            except (TypeError, json.JSONDecodeError):
+                continue
+            activity_type, content = activities.get(activity_id, (None, {}))
+            row = {'id': response_id, **response_columns(activity_type, content, data)}
+            if isinstance(data, dict) and 'timestamp' in data:
+                timestamp = data.pop('timestamp')
+                row['response_data'] = json.dumps(data)
+                if submitted_at is None and timestamp:
+                    try:
+                        row['submitted_at'] = datetime.fromisoformat(timestamp)
+                    except (TypeError, ValueError):
+                        pass
+            rows.append(row)
+        # Rows differ in which columns they set; group them so each executemany is uniform
+        by_keys = {}
+        for row in rows:
+            by_keys.setdefault(tuple(sorted(row)), []).append(row)
+        for same_keys in by_keys.values():
+            db.session.execute(db.update(Response), same_keys)
+        db.session.commit()
+        updated += len(rows)
+        last_id = batch[-1][0]
+
+
+@click.command('reconcile-aggregates')
+@click.option('--activity-id', type=int, multiple=True, help='Only rebuild these activities (repeatable).')
+@with_appcontext
+def reconcile_aggregates_command(activity_id):
+    """Rebuild per-activity result tallies from the raw responses."""
+    rebuilt = rebuild_tallies(list(activity_id) or None)
+    db.session.commit()
+    click.echo(f'Rebuilt result tallies for {rebuilt} activities.')
+
+
+@click.command('backfill-response-columns')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@with_appcontext
+def backfill_response_columns_command(batch_size):
+    """Fill typed response columns from the JSON payloads, then rebuild tallies from them."""
+    updated = backfill_response_columns(batch_size)
+    rebuilt = rebuild_tallies()
+    db.session.commit()
+    click.echo(f'Backfilled {updated} responses; rebuilt result tallies for {rebuilt} activities.')
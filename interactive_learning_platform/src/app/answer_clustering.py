@@ -0,0 +1,317 @@
+import re
+import unicodedata
+
+try:
+    import numpy as np
+    from scipy import sparse
+    CLUSTERING_AVAILABLE = True
+except ImportError:
+    CLUSTERING_AVAILABLE = False
+    np = None
+    sparse = None
+
+# Character n-grams (inside word boundaries) compare answers robustly to typos, inflections and
+# languages written without spaces; whole words (or CJK character pairs) make the group labels
+_NGRAM_SIZES = (2, 3)
+_TOKEN = re.compile(r'\w+')
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+_STOP_WORDS = frozenset('''
+    a an and are as at be because been but by can do does for from had has have how i if in into is it its
+    of on or so than that the their them then there these they this to too was we were what when which
+    who why will with would you your not no yes very more most also just
+'''.split())
+
+KMEANS_MAX_ITERATIONS = 15
+ASSIGN_SIMILARITY = 0.3 # A new answer joins an existing group only if at least this similar to its examples
+OVERCLUSTER = 2 # k-means looks for this many times max_groups clusters before merging
+MERGE_SIMILARITY = 0.5 # Centroids at least this similar (cosine) are merged into one group
+LABEL_TERMS = 3
+OTHER_LABEL = 'Other'
+BLANK_LABEL = '(No answer)'
+
+
+def _normalize(text):
+    return ' '.join(unicodedata.normalize('NFKC', text or '').lower().split())
+
+
+def _ngrams(text):
+    grams = []
+    for token in _TOKEN.findall(text):
+        padded = f' {token} '
+        for size in _NGRAM_SIZES:
+            grams.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return grams
+
+
+def _terms(text):
+    terms = []
+    for token in _TOKEN.findall(text):
+        if _CJK.search(token):
+            terms.extend(token[i:i + 2] for i in range(max(len(token) - 1, 1)))
+        elif len(token) > 1 and not token.isdigit() and token not in _STOP_WORDS:
+            terms.append(token)
+    return terms
+
+
+def _tfidf(documents, analyzer):
+    """Rows of L2-normalized sublinear TF-IDF weights (CSR), and the vocabulary in column order."""
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    for document in documents:
+        for feature in analyzer(document):
+            indices.append(vocabulary.setdefault(feature, len(vocabulary)))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.float64), np.array(indices, dtype=np.int64),
+                                np.array(indptr, dtype=np.int64)), shape=(len(documents), max(len(vocabulary), 1)))
+    matrix.sum_duplicates()
+    matrix.data = 1.0 + np.log(matrix.data)
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1.0 + len(documents)) / (1.0 + document_frequency)) + 1.0
+    matrix = matrix @ sparse.diags(idf)
+    return _normalize_rows(matrix.tocsr()), list(vocabulary)
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def _membership(assignment, clusters):
+    # clusters x rows indicator matrix
+    rows = len(assignment)
+    return sparse.csr_matrix((np.ones(rows), (assignment, np.arange(rows))), shape=(clusters, rows))
+
+
+def _kmeans(vectors, clusters, rng):
+    """
+    Spherical k-means (cosine similarity) with k-means++ seeding; centroids stay sparse.
+
+    Returns:
+        tuple: (assignment, similarity): each row's cluster, and its similarity to that centroid.
+    """
+    rows = vectors.shape[0]
+    # Seeding: each next centre is drawn with probability proportional to (1 - best similarity)^2
+    centres = [int(rng.integers(rows))]
+    best = (vectors @ vectors[centres[0]].T).toarray().ravel()
+    for _ in range(1, clusters):
+        weights = np.clip(1.0 - best, 0.0, None) ** 2
+        total = weights.sum()
+        if total <= 1e-12:
+            break # Fewer distinct answers than clusters
+        centre = int(rng.choice(rows, p=weights / total))
+        centres.append(centre)
+        np.maximum(best, (vectors @ vectors[centre].T).toarray().ravel(), out=best)
+
+    centroids = vectors[centres]
+    assignment = None
+    for _ in range(KMEANS_MAX_ITERATIONS):
+        similarity = (vectors @ centroids.T).toarray()
+        new_assignment = similarity.argmax(axis=1)
+        if assignment is not None and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        # Empty clusters simply get an all-zero centroid and attract nothing
+        centroids = _normalize_rows((_membership(assignment, len(centres)) @ vectors).tocsr())
+    return assignment, similarity[np.arange(rows), assignment]
+
+
+def _merge_similar(assignment, vectors, clusters, max_groups):
+    """
+    Agglomerates clusters by centroid similarity: alike ones (MERGE_SIMILARITY or more) always,
+    then, while there are more than max_groups, the pair that shares anything at all and is
+    cheapest to merge in Ward's sense ((1 - similarity) weighted by the pair's sizes), so
+    small clusters are absorbed before large ones snowball.
+    """
+    members = [set(np.flatnonzero(assignment == cluster)) for cluster in range(clusters)]
+    members = [rows for rows in members if rows]
+    while len(members) > 1:
+        merged_assignment = np.empty(len(assignment), dtype=np.int64)
+        for cluster, rows in enumerate(members):
+            merged_assignment[list(rows)] = cluster
+        centroids = _normalize_rows((_membership(merged_assignment, len(members)) @ vectors).tocsr())
+        similarity = (centroids @ centroids.T).toarray()
+        np.fill_diagonal(similarity, -1.0)
+        first, second = np.unravel_index(similarity.argmax(), similarity.shape)
+        if similarity[first, second] < MERGE_SIMILARITY:
+            if len(members) <= max_groups or similarity[first, second] <= 0:
+                break
+            sizes = np.array([len(rows) for rows in members], dtype=np.float64)
+            cost = (1.0 - similarity) * (np.outer(sizes, sizes) / np.add.outer(sizes, sizes))
+            cost[similarity <= 0] = np.inf
+            first, second = np.unravel_index(cost.argmin(), cost.shape)
+        first, second = min(first, second), max(first, second)
+        members[first] |= members[second]
+        del members[second]
+    return members
+
+
+def _label(rows, terms, vocabulary, used):
+    weights = np.asarray(terms[rows].sum(axis=0)).ravel()
+    top = [vocabulary[i] for i in np.argsort(-weights, kind='stable')[:LABEL_TERMS] if weights[i] > 0]
+    label = ' / '.join(top) or OTHER_LABEL
+    candidate, suffix = label, 2
+    while candidate in used:
+        candidate, suffix = f'{label} ({suffix})', suffix + 1
+    used.add(candidate)
+    return candidate
+
+
+def cluster_answers(answers, max_groups=8, seed=0):
+    """
+    Groups short answers locally, without a model: TF-IDF over character n-grams, spherical
+    k-means for up to `max_groups` clusters, then similar clusters merged; each group is
+    labelled with its highest-weighted words.
+
+    Args:
+        answers (list): The answer strings.
+        max_groups (int): The most groups to return (blank answers get a group of their own).
+        seed (int): Seed of the k-means++ initialisation, so a grouping is reproducible.
+
+    Returns:
+        dict: {label: [answer indices]}, largest group first, like group_short_answers;
+              or None if NumPy/SciPy are not installed.
+    """
+    if not CLUSTERING_AVAILABLE:
+        print("NumPy/SciPy are not available. Local answer clustering is disabled.")
+        return None
+
+    texts = [_normalize(answer) for answer in answers]
+    blank = [index for index, text in enumerate(texts) if not _TOKEN.search(text)]
+    present = [index for index, text in enumerate(texts) if _TOKEN.search(text)]
+    groups = {}
+    if present:
+        vectors, _ = _tfidf([texts[index] for index in present], _ngrams)
+        terms, vocabulary = _tfidf([texts[index] for index in present], _terms)
+        # Over-cluster, then merge back the clusters that turn out to be alike
+        clusters = max(1, min(OVERCLUSTER * max_groups, len(present)))
+        assignment, _ = _kmeans(vectors, clusters, np.random.default_rng(seed))
+        members = sorted((sorted(rows) for rows in _merge_similar(assignment, vectors, clusters, max_groups)),
+                         key=lambda rows: (-len(rows), rows[0]))
+        if len(members) > max_groups:
+            # Themes with nothing in common remain: the smallest share one 'Other' group
+            members = members[:max_groups - 1] + [sorted(row for rows in members[max_groups - 1:] for row in rows)]
+            other = members.pop()
+        else:
+            other = []
+        used = {OTHER_LABEL}
+        for rows in members:
+            groups[_label(rows, terms, vocabulary, used)] = [present[row] for row in rows]
+        if other:
+            groups[OTHER_LABEL] = [present[row] for row in other]
+    if blank:
+        groups[BLANK_LABEL] = blank
+    return groups
+
+
+def assign_answers(answers, groups, max_groups=8, seed=0):
+    """
+    Places new answers into existing groups locally: each joins the group whose examples'
+    centroid it is most similar to, if at least ASSIGN_SIMILARITY; the rest are clustered
+    into new groups with cluster_answers. Only the examples and the new answers are
+    vectorized, so the cost does not grow with the answers already grouped.
+
+    Args:
+        answers (list): The new answer strings.
+        groups (list): (label, [example answers]) per existing group.
+        max_groups (int): The most new groups to propose.
+        seed (int): Seed of the k-means++ initialisation.
+
+    Returns:
+        dict: {label: [answer indices]} (existing labels, or new ones), or None if NumPy/SciPy are not installed.
+    """
+    if not CLUSTERING_AVAILABLE:
+        print("NumPy/SciPy are not available. Local answer clustering is disabled.")
+        return None
+
+    texts = [_normalize(answer) for answer in answers]
+    present = [index for index, text in enumerate(texts) if _TOKEN.search(text)]
+    examples = [(group, text) for group, (_, group_examples) in enumerate(groups)
+                for text in (_normalize(example) for example in group_examples) if _TOKEN.search(text)]
+    result = {}
+    leftovers = present
+    if present and examples:
+        vectors, _ = _tfidf([text for _, text in examples] + [texts[index] for index in present], _ngrams)
+        membership = _membership(np.array([group for group, _ in examples]), len(groups))
+        centroids = _normalize_rows((membership @ vectors[:len(examples)]).tocsr())
+        similarity = (vectors[len(examples):] @ centroids.T).toarray()
+        best = similarity.argmax(axis=1)
+        leftovers = []
+        for row, index in enumerate(present):
+            if similarity[row, best[row]] >= ASSIGN_SIMILARITY:
+                result.setdefault(groups[best[row]][0], []).append(index)
+            else:
+                leftovers.append(index)
+    if leftovers:
+        for label, positions in cluster_answers([answers[index] for index in leftovers], max_groups, seed).items():
+            result.setdefault(label, []).extend(leftovers[position] for position in positions)
+    blank = [index for index, text in enumerate(texts) if not _TOKEN.search(text)]
+    if blank:
+        result.setdefault(BLANK_LABEL, []).extend(blank)
+    return result
+
+
+def precluster_answers(answers, clusters, seed=0):
+    """
+    First pass before model grouping: splits answers into up to `clusters` tight clusters,
+    each represented by the answer nearest its centroid, so the model only has to read one
+    answer per cluster.
+
+    Args:
+        answers (list): The answer strings.
+        clusters (int): How many clusters to form at most.
+        seed (int): Seed of the k-means++ initialisation.
+
+    Returns:
+        list: (representative index, [member indices]) per cluster, or None if NumPy/SciPy are not installed.
+    """
+    if not CLUSTERING_AVAILABLE:
+        print("NumPy/SciPy are not available. Local answer clustering is disabled.")
+        return None
+
+    texts = [_normalize(answer) for answer in answers]
+    blank = [index for index, text in enumerate(texts) if not _TOKEN.search(text)]
+    present = [index for index, text in enumerate(texts) if _TOKEN.search(text)]
+    result = []
+    if present:
+        vectors, _ = _tfidf([texts[index] for index in present], _ngrams)
+        assignment, similarity = _kmeans(vectors, max(1, min(clusters, len(present))), np.random.default_rng(seed))
+        for cluster in np.unique(assignment):
+            rows = np.flatnonzero(assignment == cluster)
+            representative = rows[similarity[rows].argmax()]
+            result.append((present[representative], [present[row] for row in rows]))
+    if blank:
+        result.append((blank[0], blank))
+    return result
+
+
+def expand_preclusters(preclusters, grouping, other_label=OTHER_LABEL):
+    """
+    Maps a model's grouping of the representatives back onto every answer.
+
+    Args:
+        preclusters (list): precluster_answers' (representative, members) pairs, in the order sent.
+        grouping (dict): {label: [positions in the representative list]}.
+        other_label (str): The group for clusters the model left out.
+
+    Returns:
+        dict: {label: [answer indices]}.
+    """
+    groups = {}
+    placed = set()
+    for label, positions in grouping.items():
+        indices = []
+        for position in positions:
+            if isinstance(position, int) and 0 <= position < len(preclusters) and position not in placed:
+                placed.add(position)
+                indices.extend(preclusters[position][1])
+        if indices:
+            groups[label] = sorted(indices)
+    left_out = sorted(index for position, (_, members) in enumerate(preclusters) if position not in placed
+                      for index in members)
+    if left_out:
+        groups.setdefault(other_label, [])
+        groups[other_label] = sorted(groups[other_label] + left_out)
+    return groups
+
@@ -0,0 +1,433 @@
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g
+
+from app.models import db, Response, AnswerGroup
+from app.aggregates import add_group_delta, apply_deltas, rebuild_tallies
+from app.genai_cache import normalize_input
+from app.genai_utils import estimate_tokens, group_short_answers, assign_short_answers, merge_group_labels
+from app.answer_clustering import cluster_answers, assign_answers, precluster_answers, expand_preclusters, OTHER_LABEL
+
+_LABEL_WORD = re.compile(r'\w+')
+LABEL_MERGE_SIMILARITY = 0.75 # Labels whose word sets overlap this much (Jaccard) name the same group
+ANSWER_LINE_OVERHEAD = 4 # Tokens of the "[i]: " prefix and newline around each answer
+COUNT_OVERHEAD = 3 # Tokens of the " (×n)" after the index of an answer several students gave
+EXAMPLES_PER_GROUP = 3 # Answers shown to the model for each existing group when assigning new ones
+
+
+def group_answers(answers, bypass_cache=False):
+    """
+    Groups short answers with the configured GENAI_GROUPING_BACKEND.
+
+    'genai' asks the model for the whole list; 'precluster' first clusters the answers locally
+    into GROUPING_PRECLUSTERS tight clusters and asks the model to group one representative
+    per cluster; 'local' only clusters locally. When the model is unavailable or fails, the
+    local clustering is used instead.
+
+    Args:
+        answers (list): A list of student answer strings.
+        bypass_cache (bool): Passed on to the model calls.
+
+    Returns:
+        dict: {label: [answer indices]}, or None if no backend could group them.
+    """
+    backend = current_app.config['GENAI_GROUPING_BACKEND']
+    max_groups = current_app.config['GROUPING_MAX_GROUPS']
+    grouping = None
+    if backend == 'precluster' and len(answers) > current_app.config['GROUPING_PRECLUSTERS']:
+        preclusters = precluster_answers(answers, current_app.config['GROUPING_PRECLUSTERS'])
+        if preclusters is not None:
+            grouping = group_with_model([answers[representative] for representative, _ in preclusters],
+                                        bypass_cache=bypass_cache)
+            if grouping is not None:
+                grouping = expand_preclusters(preclusters, grouping)
+    elif backend != 'local':
+        grouping = group_with_model(answers, bypass_cache=bypass_cache)
+
+    if grouping is None:
+        if backend != 'local':
+            print("GenAI answer grouping unavailable; falling back to local clustering.")
+        grouping = cluster_answers(answers, max_groups)
+    return grouping
+
+
+def answer_key(answer):
+    """An answer compared loosely, for deduplication: NFKC, casefolded, punctuation dropped, whitespace collapsed."""
+    text = unicodedata.normalize('NFKC', answer or '').casefold()
+    return ' '.join(''.join(' ' if unicodedata.category(char).startswith('P') else char for char in text).split())
+
+
+def dedup_answers(answers):
+    """
+    Collapses answers that are the same up to case, whitespace and punctuation (see answer_key).
+
+    Returns:
+        list: Per distinct answer, in order of first appearance, the indices of the answers
+              that collapse into it; the first is the one sent to the model.
+    """
+    members = {}
+    for index, answer in enumerate(answers):
+        members.setdefault(answer_key(answer), []).append(index)
+    return list(members.values())
+
+
+def prompt_tokens(answers, counts=None):
+    """Estimated prompt tokens of the "[i] (×n): answer" lines for these answers."""
+    return sum(estimate_tokens(normalize_input(answer)) + ANSWER_LINE_OVERHEAD +
+               (COUNT_OVERHEAD if counts and counts[i] > 1 else 0) for i, answer in enumerate(answers))
+
+
+def _record_dedup(answers, distinct_answers, counts):
+    # What deduplication saved, for the task's log (see genai_jobs): answers and estimated prompt tokens
+    usage = g.setdefault('genai_usage', {'calls': 0, 'cache_hits': 0})
+    usage['answers'] = usage.get('answers', 0) + len(answers)
+    usage['distinct_answers'] = usage.get('distinct_answers', 0) + len(distinct_answers)
+    usage['tokens_saved'] = usage.get('tokens_saved', 0) + prompt_tokens(answers) - prompt_tokens(distinct_answers, counts)
+
+
+def expand_duplicates(members, grouping):
+    """Maps {label: [positions in the distinct answers]} back to {label: [original answer indices]}."""
+    expanded, placed = {}, set()
+    for label, positions in grouping.items():
+        indices = []
+        for position in positions:
+            if isinstance(position, int) and 0 <= position < len(members) and position not in placed:
+                placed.add(position)
+                indices.extend(members[position])
+        if indices:
+            expanded.setdefault(label, []).extend(sorted(indices))
+    return expanded
+
+
+def group_with_model(answers, bypass_cache=False):
+    """
+    Groups answers with the model: in one prompt, or map-reduce style when they exceed GROUPING_BATCH_TOKENS.
+
+    Duplicate answers are sent once, with how many students gave them (see dedup_answers), and
+    the grouping is expanded back to every answer.
+    """
+    members = dedup_answers(answers)
+    distinct_answers = [answers[indices[0]] for indices in members]
+    counts = [len(indices) for indices in members]
+    _record_dedup(answers, distinct_answers, counts)
+    batch_tokens = current_app.config['GROUPING_BATCH_TOKENS']
+    if batch_tokens <= 0 or prompt_tokens(distinct_answers, counts) <= batch_tokens:
+        grouping = group_short_answers(distinct_answers, counts=counts, bypass_cache=bypass_cache)
+        return expand_duplicates(members, grouping) if grouping is not None else None
+    return group_in_batches(distinct_answers, batch_tokens, members=members, bypass_cache=bypass_cache)
+
+
+def answer_batches(answers, batch_tokens, counts=None):
+    """Splits answer indices into consecutive batches of at most batch_tokens estimated prompt tokens."""
+    batches, batch, size = [], [], 0
+    for index, answer in enumerate(answers):
+        tokens = prompt_tokens([answer], counts and [counts[index]])
+        if batch and size + tokens > batch_tokens:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(index)
+        size += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _run_batch(app, call, answers, counts, deadline):
+    # Runs on a pool thread, in an application context (and so a g) of its own, under the task's deadline
+    with app.app_context():
+        g.genai_deadline = deadline
+        return call(answers, counts), g.get('genai_usage')
+
+
+def map_batches(call, answers, batches, members=None):
+    """
+    Runs call(batch's answers, their counts) for each batch, at most GROUPING_CONCURRENCY at a time.
+
+    Each call returns {label: [positions in its batch]}; the model calls' usage is added to
+    this task's.
+
+    Args:
+        members (list): For deduplicated answers, the original indices per answer (see
+            dedup_answers); the counts are their lengths, and the groupings are expanded to them.
+
+    Returns:
+        list: Per batch, {label: [positions in `answers`, or original indices]}; or None if any batch fails.
+    """
+    app = current_app._get_current_object()
+    counts = [len(indices) for indices in members] if members is not None else None
+    deadline = g.get('genai_deadline')
+    workers = max(1, min(current_app.config['GROUPING_CONCURRENCY'], len(batches)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='grouping-batch') as pool:
+        results = list(pool.map(
+            lambda batch: _run_batch(app, call, [answers[index] for index in batch],
+                                     [counts[index] for index in batch] if counts else None, deadline),
+            batches))
+
+    usage = g.setdefault('genai_usage', {'calls': 0, 'cache_hits': 0})
+    groupings = []
+    for batch, (grouping, batch_usage) in zip(batches, results):
+        for key, value in (batch_usage or {}).items():
+            usage[key] = usage.get(key, 0) + value
+        if grouping is None:
+            return None
+        # Batch positions back to positions in the whole answer list
+        grouping = {label: [batch[position] for position in positions
+                            if isinstance(position, int) and 0 <= position < len(batch)]
+                    for label, positions in grouping.items()}
+        groupings.append(expand_duplicates(members, grouping) if members is not None else grouping)
+    return groupings
+
+
+def group_in_batches(answers, batch_tokens, members=None, bypass_cache=False):
+    """
+    Map-reduce grouping for answer lists larger than one prompt.
+
+    Map: the answers are split into batches of at most batch_tokens estimated tokens, each
+    grouped by its own model call, at most GROUPING_CONCURRENCY at a time. Reduce: the
+    batches' labels are reconciled into one grouping (see reconcile_groupings).
+
+    Args:
+        members (list): For deduplicated answers, the original indices per answer (see dedup_answers).
+
+    Returns:
+        dict: {label: [answer indices, or original indices]}, or None if any batch fails.
+    """
+    counts = [len(indices) for indices in members] if members is not None else None
+    groupings = map_batches(lambda batch, batch_counts: group_short_answers(batch, counts=batch_counts,
+                                                                            bypass_cache=bypass_cache),
+                            answers, answer_batches(answers, batch_tokens, counts), members)
+    if groupings is None:
+        return None
+    return reconcile_groupings(groupings, current_app.config['GROUPING_MAX_GROUPS'], bypass_cache=bypass_cache)
+
+
+def _label_words(label):
+    return frozenset(word.lower() for word in _LABEL_WORD.findall(label))
+
+
+def reconcile_groupings(groupings, max_groups, bypass_cache=False):
+    """
+    Merges per-batch groupings into one.
+
+    Labels naming the same theme in different batches are merged first, locally: equal word
+    sets, or word sets overlapping at least LABEL_MERGE_SIMILARITY. If more than max_groups
+    remain, the model merges the labels (only the labels and their sizes are sent); should
+    that fail, the largest max_groups - 1 groups are kept and the rest become 'Other'.
+
+    Args:
+        groupings (list): {label: [answer indices]} per batch.
+        max_groups (int): The most groups to return.
+
+    Returns:
+        dict: {label: [answer indices]}, largest group first.
+    """
+    labels = [(label, indices) for grouping in groupings for label, indices in grouping.items() if indices]
+    words = [_label_words(label) for label, _ in labels]
+    parent = list(range(len(labels)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(labels)):
+        for j in range(i + 1, len(labels)):
+            if words[i] == words[j] or (words[i] and words[j] and
+                                         len(words[i] & words[j]) / len(words[i] | words[j]) >= LABEL_MERGE_SIMILARITY):
+                parent[find(j)] = find(i)
+
+    merged = {}
+    for i, (label, indices) in enumerate(labels):
+        merged.setdefault(find(i), []).append((label, indices))
+    groups = []
+    for members in merged.values():
+        # The merged group takes the label that covered the most answers
+        label = max(members, key=lambda member: len(member[1]))[0]
+        groups.append((label, sorted({index for _, indices in members for index in indices})))
+    groups.sort(key=lambda group: (-len(group[1]), group[0]))
+
+    if len(groups) > max_groups:
+        themes = merge_group_labels([(label, len(indices)) for label, indices in groups], max_groups,
+                                    bypass_cache=bypass_cache)
+        if themes is not None:
+            regrouped, placed = [], set()
+            for theme, positions in themes.items():
+                indices = set()
+                for position in positions:
+                    if isinstance(position, int) and 0 <= position < len(groups) and position not in placed:
+                        placed.add(position)
+                        indices.update(groups[position][1])
+                if indices:
+                    regrouped.append((theme, sorted(indices)))
+            left_out = {index for position, (_, indices) in enumerate(groups) if position not in placed
+                        for index in indices}
+            if left_out:
+                regrouped.append((OTHER_LABEL, sorted(left_out)))
+            groups = sorted(regrouped, key=lambda group: (-len(group[1]), group[0]))
+        if len(groups) > max_groups:
+            other = sorted({index for _, indices in groups[max_groups - 1:] for index in indices})
+            groups = groups[:max_groups - 1] + [(OTHER_LABEL, other)]
+
+    result = {}
+    for label, indices in groups:
+        result.setdefault(label, []).extend(indices)
+    return result
+
+
+def label_key(label):
+    """A group label compared loosely: its words, lowercased."""
+    return ' '.join(_LABEL_WORD.findall(label.lower()))
+
+
+def assign_answers_to_groups(answers, groups, bypass_cache=False):
+    """
+    Places new answers into existing groups, with the configured GENAI_GROUPING_BACKEND.
+
+    The model sees each group's label and a few example answers, plus only the new answers,
+    each distinct one once (in GROUPING_BATCH_TOKENS batches if there are many); with the 'local' backend, or when
+    the model fails, the answers are placed by similarity to the examples (see
+    answer_clustering.assign_answers).
+
+    Args:
+        answers (list): The new answer strings.
+        groups (list): (label, [example answers]) per existing group.
+        bypass_cache (bool): Passed on to the model calls.
+
+    Returns:
+        dict: {label: [answer indices]} (existing labels, or new ones), or None if no backend could assign them.
+    """
+    backend = current_app.config['GENAI_GROUPING_BACKEND']
+    assignment = None
+    if backend != 'local':
+        members = dedup_answers(answers)
+        distinct_answers = [answers[indices[0]] for indices in members]
+        counts = [len(indices) for indices in members]
+        _record_dedup(answers, distinct_answers, counts)
+        batch_tokens = current_app.config['GROUPING_BATCH_TOKENS']
+        batches = answer_batches(distinct_answers, batch_tokens, counts) if batch_tokens > 0 \
+            else [list(range(len(distinct_answers)))]
+        if len(batches) == 1:
+            assignment = assign_short_answers(distinct_answers, groups, counts=counts, bypass_cache=bypass_cache)
+            if assignment is not None:
+                assignment = expand_duplicates(members, assignment)
+        else:
+            assignments = map_batches(
+                lambda batch, batch_counts: assign_short_answers(batch, groups, counts=batch_counts,
+                                                                 bypass_cache=bypass_cache),
+                distinct_answers, batches, members)
+            if assignments is not None:
+                # New labels proposed by several batches are one new group
+                assignment, labels = {}, {}
+                for batch_assignment in assignments:
+                    for label, indices in batch_assignment.items():
+                        assignment.setdefault(labels.setdefault(label_key(label), label), []).extend(indices)
+
+    if assignment is None:
+        if backend != 'local':
+            print("GenAI answer assignment unavailable; falling back to local clustering.")
+        assignment = assign_answers(answers, groups, current_app.config['GROUPING_MAX_GROUPS'])
+    return assignment
+
+
+def regroup_activity(activity_id, bypass_cache=False):
+    """
+    Groups all of a short-answer activity's responses from scratch (without committing).
+
+    The activity's AnswerGroup rows are replaced and every response's group_id renumbered.
+
+    Returns:
+        dict: {label: [positions in the activity's responses, by id]}, or None if grouping failed.
+    """
+    rows = db.session.query(Response.id, Response.answer_text).\
+        filter(Response.activity_id == activity_id).order_by(Response.id).all()
+    grouping = group_answers([answer_text or '' for _, answer_text in rows], bypass_cache=bypass_cache) if rows else {}
+    if grouping is None:
+        return None
+
+    AnswerGroup.query.filter_by(activity_id=activity_id).delete(synchronize_session=False)
+    db.session.execute(db.update(Response).where(Response.activity_id == activity_id).values(group_id=None).
+                       execution_options(synchronize_session=False))
+    new_groups, assignments, placed = [], [], set()
+    for number, (label, indices) in enumerate(grouping.items(), 1):
+        new_groups.append({'activity_id': activity_id, 'number': number, 'label': label[:255]})
+        for index in indices:
+            if isinstance(index, int) and 0 <= index < len(rows) and index not in placed:
+                placed.add(index)
+                assignments.append({'id': rows[index].id, 'group_id': number})
+    if new_groups:
+        db.session.execute(db.insert(AnswerGroup), new_groups)
+    if assignments:
+        db.session.execute(db.update(Response), assignments)
+    # Group counts are part of the activity's tallies
+    rebuild_tallies([activity_id])
+    return grouping
+
+
+def _group_examples(activity_id):
+    # The first EXAMPLES_PER_GROUP answers of each group, picked in SQL
+    numbered = db.select(
+        Response.group_id, Response.answer_text,
+        db.func.row_number().over(partition_by=Response.group_id, order_by=Response.id).label('position')
+    ).where(Response.activity_id == activity_id, Response.group_id.is_not(None),
+            Response.answer_text.is_not(None)).subquery()
+    examples = {}
+    for group_id, answer_text in db.session.execute(
+            db.select(numbered.c.group_id, numbered.c.answer_text).where(numbered.c.position <= EXAMPLES_PER_GROUP)):
+        examples.setdefault(group_id, []).append(answer_text)
+    return examples
+
+
+def group_new_answers(activity_id, bypass_cache=False):
+    """
+    Incremental grouping: places only the activity's ungrouped responses (group_id IS NULL),
+    without committing. Existing groups keep their numbers and members; each new answer joins
+    one of them or a newly proposed group, and only the changed group counts are adjusted.
+    An activity that has no groups yet is grouped from scratch.
+
+    Returns:
+        dict: {label: [positions in the ungrouped responses, by id]}, or None if grouping failed.
+    """
+    groups = AnswerGroup.query.filter_by(activity_id=activity_id).order_by(AnswerGroup.number).all()
+    if not groups:
+        return regroup_activity(activity_id, bypass_cache=bypass_cache)
+    rows = db.session.query(Response.id, Response.answer_text).\
+        filter(Response.activity_id == activity_id, Response.group_id.is_(None)).order_by(Response.id).all()
+    if not rows:
+        return {}
+
+    examples = _group_examples(activity_id)
+    assignment = assign_answers_to_groups([answer_text or '' for _, answer_text in rows],
+                                          [(group.label, examples.get(group.number, [])) for group in groups],
+                                          bypass_cache=bypass_cache)
+    if assignment is None:
+        return None
+
+    numbers = {label_key(group.label): group.number for group in groups}
+    next_number = max(numbers.values()) + 1
+    new_groups, deltas, placed = [], {}, set()
+    for label, indices in assignment.items():
+        indices = [index for index in indices if isinstance(index, int) and 0 <= index < len(rows) and index not in placed]
+        if not indices:
+            continue
+        number = numbers.get(label_key(label))
+        if number is None:
+            number = numbers[label_key(label)] = next_number
+            next_number += 1
+            new_groups.append({'activity_id': activity_id, 'number': number, 'label': label[:255]})
+        placed.update(indices)
+        # Only rows still ungrouped: one a concurrent run or a regroup already placed is left alone,
+        # and only the rows updated here count towards the group's tally
+        updated = db.session.execute(
+            db.update(Response).
+            where(Response.id.in_([rows[index].id for index in indices]), Response.group_id.is_(None)).
+            values(group_id=number).returning(Response.id).execution_options(synchronize_session=False)
+        ).all()
+        add_group_delta(deltas, activity_id, number, len(updated))
+    new_groups = [group for group in new_groups if deltas.get((activity_id, 'group', str(group['number'])))]
+    if new_groups:
+        db.session.execute(db.insert(AnswerGroup), new_groups)
+    apply_deltas(deltas)
+    return assignment
@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+from sqlalchemy.orm import contains_eager
+
+from app.models import db, Course, Enrollment, Activity
+
+# A lecturer's course with its counts, as shown on the lecturer dashboard
+CourseSummary = namedtuple('CourseSummary', ['course', 'enrollment_count', 'activity_count'])
+
+
+def lecturer_course_summaries(lecturer_id):
+    """
+    Returns a lecturer's courses with enrollment and activity counts, in one query.
+
+    The counts are grouped in subqueries and outer-joined to the courses, so the query
+    count does not grow with the number of courses (and the join does not multiply
+    enrollments by activities).
+
+    Args:
+        lecturer_id (int): The lecturer whose courses to list.
+
+    Returns:
+        list: CourseSummary tuples, in creation order.
+    """
+    enrollment_counts = db.select(Enrollment.course_id, db.func.count().label('n')).\
+        group_by(Enrollment.course_id).subquery()
+    activity_counts = db.select(Activity.course_id, db.func.count().label('n')).\
+        group_by(Activity.course_id).subquery()
+    rows = db.session.query(Course, db.func.coalesce(enrollment_counts.c.n, 0),
+                            db.func.coalesce(activity_counts.c.n, 0)).\
+        outerjoin(enrollment_counts, enrollment_counts.c.course_id == Course.id).\
+        outerjoin(activity_counts, activity_counts.c.course_id == Course.id).\
+        filter(Course.lecturer_id == lecturer_id).order_by(Course.id)
+    return [CourseSummary(*row) for row in rows]
+
+
+def student_enrollments(student_id):
+    """
+    Returns a student's enrollments with their course and the course's lecturer loaded, in one query.
+
+    Args:
+        student_id (int): The student whose enrollments to list.
+
+    Returns:
+        list: Enrollment objects; enrollment.course.lecturer needs no further queries.
+    """
+    return Enrollment.query.join(Enrollment.course).join(Course.lecturer).\
+        options(contains_eager(Enrollment.course).contains_eager(Course.lecturer)).\
+        filter(Enrollment.student_id == student_id).order_by(Course.id).all()
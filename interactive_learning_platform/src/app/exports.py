@@ -0,0 +1,204 @@
+import csv
+import io
+import json
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from app.models import db, User, Enrollment, Activity, Response
+
+# Rows fetched from the database cursor at a time, and rows per chunk sent to the client
+FETCH_SIZE = 1000
+CHUNK_ROWS = 500
+
+ACTIVITY_HEADER = ['student_id', 'username', 'submitted_at', 'selected_option', 'answer_text', 'answers',
+                   'is_correct', 'score', 'group_id']
+COURSE_HEADER = ['student_id', 'username', 'activity_id', 'activity_title', 'activity_type', 'answered',
+                 'submitted_at', 'selected_option', 'answer_text', 'answers', 'is_correct', 'score']
+
+# A multi-question quiz's answers by question position, as the JSON list stored in response_data
+# (they have no typed column); NULL for other responses
+_QUIZ_ANSWERS = db.case((db.func.json_valid(Response.response_data) == 1,
+                         db.func.json_extract(Response.response_data, '$.answers')))
+
+
+def _streamed(query):
+    # stream_results + yield_per: rows come off the DB-API cursor in batches instead of fetchall()
+    return query.execution_options(stream_results=True, yield_per=FETCH_SIZE)
+
+
+def _readable_answers(rows, position):
+    # json_extract keeps the stored \uXXXX escapes; the file should show the answers as typed
+    for row in rows:
+        if row[position] is not None:
+            row = list(row)
+            row[position] = json.dumps(json.loads(row[position]), ensure_ascii=False)
+        yield row
+
+
+def activity_export_rows(session, activity_id):
+    """
+    Yields the header and then one row per response of an activity, ordered by student.
+
+    Args:
+        session: The session to read with (a dedicated read-only session).
+        activity_id (int): The activity to export.
+    """
+    yield ACTIVITY_HEADER
+    query = session.query(User.student_id, User.username, Response.submitted_at, Response.selected_option,
+                          Response.answer_text, _QUIZ_ANSWERS, Response.is_correct, Response.score, Response.group_id).\
+        join(User, User.id == Response.responder_id).\
+        filter(Response.activity_id == activity_id).order_by(User.username)
+    yield from _readable_answers(_streamed(query), ACTIVITY_HEADER.index('answers'))
+
+
+def course_export_rows(session, course_id):
+    """
+    Yields the header and then one row per (enrolled student, activity) of a course.
+
+    Students who did not answer an activity still get a row, with answered = False.
+
+    Args:
+        session: The session to read with (a dedicated read-only session).
+        course_id (int): The course to export.
+    """
+    yield COURSE_HEADER
+    query = session.query(User.student_id, User.username, Activity.id, Activity.title, Activity.type,
+                          Response.id.is_not(None), Response.submitted_at, Response.selected_option,
+                          Response.answer_text, _QUIZ_ANSWERS, Response.is_correct, Response.score).\
+        select_from(Enrollment).\
+        join(User, User.id == Enrollment.student_id).\
+        join(Activity, Activity.course_id == Enrollment.course_id).\
+        outerjoin(Response, (Response.activity_id == Activity.id) & (Response.responder_id == Enrollment.student_id)).\
+        filter(Enrollment.course_id == course_id).order_by(User.username, Activity.created_at, Activity.id)
+    yield from _readable_answers(_streamed(query), COURSE_HEADER.index('answers'))
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+
+def _csv_text(value):
+    value = _text(value)
+    # Student-typed text must not turn into a spreadsheet formula when the file is opened
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def csv_stream(rows):
+    """Encodes rows as UTF-8 CSV (with a BOM, so Excel detects the encoding), yielding chunks of CHUNK_ROWS rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_text(value) for value in row])
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ZipSink(object):
+    """A write-only file for ZipFile that hands back what was written; having no tell() makes ZipFile stream."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    value = _text(value)
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_ILLEGAL_XML_CHARS.sub("", str(value)))}</t></is></c>'
+
+
+def xlsx_stream(rows, sheet_name='Results'):
+    """
+    Encodes rows as a single-sheet XLSX workbook, yielding compressed chunks as they are produced.
+
+    The worksheet is written with inline strings straight into a streaming ZIP entry, so
+    memory use does not depend on the number of rows (and no spreadsheet library is needed).
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, xml in _XLSX_STATIC_PARTS.items():
+            workbook.writestr(name, xml)
+        workbook.writestr('xl/workbook.xml',
+                          '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                          '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                          'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                          f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+                          '</workbook>')
+        yield sink.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            chunk = []
+            for count, row in enumerate(rows, 1):
+                chunk.append('<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>')
+                if count % CHUNK_ROWS == 0:
+                    sheet.write(''.join(chunk).encode('utf-8'))
+                    chunk = []
+                    data = sink.drain()
+                    if data:
+                        yield data
+            sheet.write((''.join(chunk) + '</sheetData></worksheet>').encode('utf-8'))
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_stream, 'text/csv; charset=utf-8'),
+    'xlsx': (xlsx_stream, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
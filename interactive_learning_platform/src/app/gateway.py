@@ -0,0 +1,285 @@
+"""
+Asyncio fan-out gateway for "activity started/stopped" notifications.
+
+Runs next to the Flask app (python -m app.gateway) and holds the idle Server-Sent Events
+connections of students, subscribed per course. toggle_activity_status publishes to it over
+HTTP, and the event is written to every subscribed connection straight away, so students no
+longer have to keep refreshing the course activities page.
+
+Endpoints:
+    GET  /events?token=...   SSE stream; the token is signed by the Flask app (make_subscribe_token)
+    POST /publish            {"course_id", "event", "activity_id", "title"}; needs X-Gateway-Secret
+    GET  /stats              connection counts and memory accounting
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+TOKEN_SALT = 'activity-gateway'
+MAX_HEADER_BYTES = 8192
+
+
+def make_subscribe_token(secret_key, user_id, course_ids):
+    """Signs the list of courses a user may follow on the gateway."""
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).dumps({'user_id': user_id, 'course_ids': list(course_ids)})
+
+
+def publish_activity_event(config, activity, event):
+    """
+    Tells the gateway that an activity started or stopped (fire-and-forget).
+
+    The POST runs on a short-lived daemon thread with a small timeout, so a slow or absent
+    gateway never delays the lecturer's request. Does nothing if GATEWAY_PUBLISH_URL is unset.
+    """
+    url = config.get('GATEWAY_PUBLISH_URL')
+    if not url:
+        return
+    body = json.dumps({'course_id': activity.course_id, 'event': event,
+                       'activity_id': activity.id, 'title': activity.title}).encode('utf-8')
+    request = urllib.request.Request(url.rstrip('/') + '/publish', data=body, method='POST', headers={
+        'Content-Type': 'application/json', 'X-Gateway-Secret': config['GATEWAY_SECRET']})
+
+    def send():
+        try:
+            urllib.request.urlopen(request, timeout=config['GATEWAY_PUBLISH_TIMEOUT']).close()
+        except Exception as e:
+            print(f"Gateway publish failed: {e}")
+
+    threading.Thread(target=send, daemon=True).start()
+
+
+def _rss_bytes():
+    """Resident set size of this process (Linux), or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class _Connection(object):
+    __slots__ = ('writer', 'course_ids', 'opened_at', 'bytes_sent')
+
+    def __init__(self, writer, course_ids):
+        self.writer = writer
+        self.course_ids = course_ids
+        self.opened_at = time.monotonic()
+        self.bytes_sent = 0
+
+    def send(self, data):
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+
+    def buffered_bytes(self):
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() if transport is not None and not transport.is_closing() else 0
+
+    def accounted_bytes(self):
+        """Approximate memory owned by this connection: the object itself plus unsent output."""
+        return sys.getsizeof(self) + sys.getsizeof(self.course_ids) + self.buffered_bytes()
+
+
+class ActivityGateway(object):
+    """Keeps SSE subscribers per course and broadcasts activity events to them."""
+
+    def __init__(self, secret_key, publish_secret, heartbeat=25.0, max_buffer=64 * 1024, token_max_age=86400):
+        self.serializer = URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT)
+        self.publish_secret = publish_secret
+        self.heartbeat = heartbeat
+        self.max_buffer = max_buffer
+        self.token_max_age = token_max_age
+        self.channels = defaultdict(set)
+        self.connections = set()
+        self.baseline_rss = _rss_bytes()
+        self.events_published = 0
+        self.slow_disconnects = 0
+
+    # --- HTTP plumbing ---
+
+    async def handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        if len(head) > MAX_HEADER_BYTES:
+            await self._respond(writer, 431, {'error': 'Headers too large'})
+            return
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            writer.close()
+            return
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+
+        if method == 'GET' and url.path == '/events':
+            await self._subscribe(reader, writer, parse_qs(url.query).get('token', [''])[0])
+        elif method == 'POST' and url.path == '/publish':
+            length = int(headers.get('content-length') or 0)
+            body = await reader.readexactly(length) if 0 < length <= 65536 else b''
+            await self._publish(writer, headers, body)
+        elif method == 'GET' and url.path == '/stats':
+            await self._respond(writer, 200, self.stats())
+        else:
+            await self._respond(writer, 404, {'error': 'Not found'})
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    # --- Subscribers ---
+
+    async def _subscribe(self, reader, writer, token):
+        try:
+            claims = self.serializer.loads(token, max_age=self.token_max_age)
+            course_ids = frozenset(int(course_id) for course_id in claims['course_ids'])
+        except (BadSignature, KeyError, TypeError, ValueError):
+            await self._respond(writer, 403, {'error': 'Invalid token'})
+            return
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                     b'Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\nretry: 5000\n\n')
+        connection = _Connection(writer, course_ids)
+        self.connections.add(connection)
+        for course_id in course_ids:
+            self.channels[course_id].add(connection)
+        try:
+            # The connection is idle from here on; this only wakes up when the client goes away
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self._drop(connection)
+
+    def _drop(self, connection):
+        self.connections.discard(connection)
+        for course_id in connection.course_ids:
+            channel = self.channels.get(course_id)
+            if channel is not None:
+                channel.discard(connection)
+                if not channel:
+                    del self.channels[course_id]
+        if not connection.writer.is_closing():
+            connection.writer.close()
+
+    def broadcast(self, course_id, event, payload):
+        """Writes one SSE frame to every connection following the course; returns how many got it."""
+        frame = f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+        delivered = 0
+        for connection in list(self.channels.get(course_id, ())):
+            if connection.buffered_bytes() > self.max_buffer:
+                # The client stopped reading; don't let its backlog grow without bound
+                self.slow_disconnects += 1
+                self._drop(connection)
+                continue
+            connection.send(frame)
+            delivered += 1
+        self.events_published += 1
+        return delivered
+
+    async def _publish(self, writer, headers, body):
+        if not hmac.compare_digest(headers.get('x-gateway-secret', ''), self.publish_secret):
+            await self._respond(writer, 403, {'error': 'Bad publish secret'})
+            return
+        try:
+            message = json.loads(body)
+            course_id = int(message['course_id'])
+            event = message['event']
+        except (ValueError, KeyError, TypeError):
+            await self._respond(writer, 400, {'error': 'Expected course_id and event'})
+            return
+        delivered = self.broadcast(course_id, event, {
+            'activity_id': message.get('activity_id'), 'title': message.get('title')})
+        await self._respond(writer, 200, {'delivered': delivered})
+
+    async def _heartbeat_loop(self):
+        # One task pings every connection (rather than a timer per connection), which keeps
+        # proxies from closing idle streams and surfaces dead clients
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            for connection in list(self.connections):
+                if connection.writer.is_closing():
+                    self._drop(connection)
+                else:
+                    connection.send(b': ping\n\n')
+
+    # --- Accounting ---
+
+    def stats(self):
+        """Connection counts plus per-connection memory, both accounted and measured via RSS."""
+        count = len(self.connections)
+        accounted = sum(connection.accounted_bytes() for connection in self.connections)
+        rss = _rss_bytes()
+        report = {
+            'connections': count,
+            'courses': len(self.channels),
+            'events_published': self.events_published,
+            'slow_disconnects': self.slow_disconnects,
+            'accounted_bytes': accounted,
+            'accounted_bytes_per_connection': round(accounted / count) if count else None,
+            'rss_bytes': rss,
+        }
+        if rss is not None and self.baseline_rss is not None and count:
+            report['rss_bytes_per_connection'] = round((rss - self.baseline_rss) / count)
+        return report
+
+    async def serve(self, host, port, backlog=4096):
+        server = await asyncio.start_server(self.handle, host, port, backlog=backlog, limit=MAX_HEADER_BYTES)
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            heartbeat.cancel()
+
+
+def main(argv=None):
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Activity notification gateway')
+    parser.add_argument('--host', default=os.environ.get('GATEWAY_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('GATEWAY_PORT', 8765)))
+    args = parser.parse_args(argv)
+
+    try:
+        # Every idle client holds a socket; allow as many as the hard limit permits
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    gateway = ActivityGateway(Config.SECRET_KEY, Config.GATEWAY_SECRET)
+    print(f"Activity gateway listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(gateway.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
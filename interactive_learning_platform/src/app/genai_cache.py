@@ -0,0 +1,106 @@
+import hashlib
+import json
+import unicodedata
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import db, GenAITask, GenAICacheEntry
+
+
+def normalize_input(text):
+    """Canonical form of a GenAI input for the cache key: NFKC, whitespace runs collapsed, trimmed."""
+    return ' '.join(unicodedata.normalize('NFKC', text or '').split())
+
+
+class GenAICache(object):
+    """
+    Persistent, content-addressed cache of GenAI outputs (the GenAICacheEntry table).
+
+    The key is a sha256 of everything that determines the output: provider, model, task
+    type, the system prompt and JSON schema, and the (already normalized) user input. So
+    regenerating a draft for the same topic, or regrouping an unchanged answer set, is
+    served from the table, while changing the model or a prompt misses.
+
+    Entries live GENAI_CACHE_TTL seconds; when the stored outputs exceed
+    GENAI_CACHE_MAX_BYTES, the least recently used are evicted. Lookups and writes run in
+    their own short transactions, so a slow model call never holds the database write lock
+    and a cached output survives its task failing later on.
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        self.ttl = timedelta(seconds=app.config['GENAI_CACHE_TTL'])
+        self.max_bytes = app.config['GENAI_CACHE_MAX_BYTES']
+        self.enabled = self.ttl > timedelta(0) and self.max_bytes > 0
+
+    @staticmethod
+    def make_key(provider, model, task_type, system_message, json_schema, user_message):
+        material = json.dumps([provider, model, task_type, system_message, json_schema, user_message],
+                              sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached output for a key (counting the hit), or None if absent or expired."""
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            output_data = connection.execute(
+                db.update(GenAICacheEntry).
+                where(GenAICacheEntry.key == key, GenAICacheEntry.expires_at > now).
+                values(hits=GenAICacheEntry.hits + 1, last_used_at=now).
+                returning(GenAICacheEntry.output_data)
+            ).scalar()
+        return json.loads(output_data) if output_data is not None else None
+
+    def put(self, key, task_type, output):
+        """Stores (or refreshes) an output, then evicts expired and least recently used entries."""
+        now = datetime.utcnow()
+        output_data = json.dumps(output, ensure_ascii=False)
+        values = {'task_type': task_type, 'output_data': output_data, 'size': len(output_data.encode('utf-8')),
+                  'created_at': now, 'expires_at': now + self.ttl, 'last_used_at': now}
+        with db.engine.begin() as connection:
+            connection.execute(
+                sqlite_insert(GenAICacheEntry).values(key=key, hits=0, **values).
+                on_conflict_do_update(index_elements=['key'], set_=values)
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        connection.execute(db.delete(GenAICacheEntry).where(GenAICacheEntry.expires_at <= now))
+        # Most recently used first: everything past the point where the running size exceeds the bound goes
+        running = db.select(
+            GenAICacheEntry.key,
+            db.func.sum(GenAICacheEntry.size).over(
+                order_by=(GenAICacheEntry.last_used_at.desc(), GenAICacheEntry.key)).label('running_size')
+        ).subquery()
+        connection.execute(db.delete(GenAICacheEntry).where(
+            GenAICacheEntry.key.in_(db.select(running.c.key).where(running.c.running_size > self.max_bytes))))
+
+    def stats(self, session):
+        """Size of the cache, and how many completed tasks of each type it served."""
+        entries, size, hits = session.query(
+            db.func.count(), db.func.coalesce(db.func.sum(GenAICacheEntry.size), 0),
+            db.func.coalesce(db.func.sum(GenAICacheEntry.hits), 0)).one()
+        by_type = []
+        for task_type, completed, cached in session.query(
+                GenAITask.task_type, db.func.count(),
+                db.func.coalesce(db.func.sum(db.case((GenAITask.cache_hit, 1), else_=0)), 0)).\
+                filter(GenAITask.status == 'completed').group_by(GenAITask.task_type).order_by(GenAITask.task_type):
+            by_type.append({'task_type': task_type, 'completed': completed, 'cache_hits': cached,
+                            'hit_rate': cached / completed if completed else None})
+        completed = sum(row['completed'] for row in by_type)
+        cached = sum(row['cache_hits'] for row in by_type)
+        return {
+            'enabled': self.enabled,
+            'entries': entries,
+            'size_kb': round(size / 1024, 1),
+            'max_kb': round(self.max_bytes / 1024, 1) if self.enabled else None,
+            'entry_hits': hits,
+            'hit_rate': cached / completed if completed else None,
+            'by_type': by_type,
+        }
+
+
+genai_cache = GenAICache()
@@ -0,0 +1,240 @@
+import fcntl
+import os
+import random
+import threading
+import time
+
+from flask import g
+from sqlalchemy.engine import make_url
+
+try:
+    import httpx
+    import openai
+    from openai import OpenAI, DefaultHttpxClient
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+    OpenAI = None
+
+KEEPALIVE_SECONDS = 60 # How long an idle pooled connection to the API is kept open
+SLOT_POLL_INTERVAL = 0.05 # Seconds between tries for a free cross-process slot
+
+
+class GenAIBusyError(Exception):
+    """Raised when no GenAI call slot frees up within GENAI_QUEUE_TIMEOUT (or the task's deadline)."""
+
+
+class StubTransientError(Exception):
+    """A simulated transient failure of the stub provider (GENAI_STUB_ERROR_RATE)."""
+
+
+if OPENAI_AVAILABLE:
+    # Worth retrying: the request may succeed unchanged a moment later
+    TRANSIENT_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                        openai.InternalServerError, StubTransientError)
+else:
+    TRANSIENT_ERRORS = (StubTransientError,)
+
+
+def _retry_after(error):
+    # The server's Retry-After (seconds), if a rate-limited response carried one
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class GenAIClient(object):
+    """
+    The process-wide way GenAI calls reach the provider.
+
+    - One OpenAI client per process (rebuilt after a fork), so calls share a keep-alive
+      connection pool instead of each opening its own.
+    - Every call has a timeout of GENAI_TIMEOUT seconds, cut short by the running task's
+      deadline (g.genai_deadline, GENAI_TASK_TIMEOUT after a worker starts the task).
+    - Transient failures (timeouts, connection errors, 429s, 5xx) are retried up to
+      GENAI_MAX_RETRIES times with full-jitter exponential backoff, honouring Retry-After.
+    - At most GENAI_MAX_CONCURRENCY calls are in flight at once: per process with a
+      semaphore and, for a SQLite file database, across every process using it with
+      flock'd slot files next to it (as the maintenance lock is). A call that waits longer
+      than GENAI_QUEUE_TIMEOUT for a slot raises GenAIBusyError; callers treat it as failed.
+    """
+
+    def __init__(self):
+        self.timeout = 60.0
+        self.max_retries = 0
+        self.max_concurrency = 1
+        self.queue_timeout = 0.0
+        self.slot_prefix = None
+        self._client = None
+        self._client_pid = None
+        self._slots = threading.BoundedSemaphore(1)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.reset_stats()
+
+    def init_app(self, app):
+        self.timeout = app.config['GENAI_TIMEOUT']
+        self.task_timeout = app.config['GENAI_TASK_TIMEOUT']
+        self.max_retries = app.config['GENAI_MAX_RETRIES']
+        self.retry_base_delay = app.config['GENAI_RETRY_BASE_DELAY']
+        self.retry_max_delay = app.config['GENAI_RETRY_MAX_DELAY']
+        self.max_concurrency = max(1, app.config['GENAI_MAX_CONCURRENCY'])
+        self.queue_timeout = app.config['GENAI_QUEUE_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        database = make_url(app.config['SQLALCHEMY_DATABASE_URI']).database
+        shared = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and database not in (None, '', ':memory:')
+        self.slot_prefix = database + '.genai-slot-' if shared else None
+
+    def openai_client(self):
+        """This process's pooled OpenAI client (built on first use)."""
+        if self._client is None or self._client_pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._client_pid != os.getpid():
+                    limits = httpx.Limits(max_connections=self.max_concurrency,
+                                          max_keepalive_connections=self.max_concurrency,
+                                          keepalive_expiry=KEEPALIVE_SECONDS)
+                    # Retries are ours (with the slot released while backing off), not the SDK's
+                    self._client = OpenAI(max_retries=0, timeout=self.timeout,
+                                          http_client=DefaultHttpxClient(limits=limits))
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def start_task(self):
+        """Starts the running task's deadline (GENAI_TASK_TIMEOUT from now); call within its app context."""
+        g.genai_deadline = time.monotonic() + self.task_timeout if self.task_timeout > 0 else None
+
+    def call(self, request, uses_openai=True):
+        """
+        Runs request(client, timeout) in a call slot, retrying transient failures.
+
+        The time spent in requests (not waiting for a slot or backing off) is added to
+        g.genai_usage['model_seconds'], and each retry to g.genai_usage['retries'].
+
+        Args:
+            request (callable): Makes the provider call with the given client and timeout (seconds).
+            uses_openai (bool): False for the stub provider, which is passed no client.
+
+        Raises:
+            GenAIBusyError: No slot freed up in time.
+            Exception: The provider's error, once it is not transient or the retries or deadline run out.
+        """
+        deadline = g.get('genai_deadline')
+        usage = g.setdefault('genai_usage', {'calls': 0, 'cache_hits': 0})
+        attempt = 0
+        while True:
+            slot = self._acquire(deadline)
+            request_started = time.perf_counter()
+            try:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                timeout = self.timeout if remaining is None else max(0.001, min(self.timeout, remaining))
+                return request(self.openai_client() if uses_openai else None, timeout)
+            except TRANSIENT_ERRORS as e:
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0)
+                if attempt >= self.max_retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                    self._count('failed')
+                    raise
+                print(f"GenAI call failed ({e.__class__.__name__}: {e}); retrying in {delay:.2f}s")
+            except Exception:
+                self._count('failed')
+                raise
+            finally:
+                usage['model_seconds'] = usage.get('model_seconds', 0.0) + time.perf_counter() - request_started
+                self._release(slot)
+            attempt += 1
+            self._count('retries')
+            usage['retries'] = usage.get('retries', 0) + 1
+            time.sleep(delay)
+
+    def _acquire(self, deadline):
+        queued_at = time.monotonic()
+        give_up_at = queued_at + self.queue_timeout
+        if deadline is not None:
+            give_up_at = min(give_up_at, deadline)
+        with self._lock:
+            self._stats['waiting'] += 1
+        try:
+            if not self._slots.acquire(timeout=max(0, give_up_at - time.monotonic())):
+                self._count('busy')
+                raise GenAIBusyError('Too many GenAI calls in progress; try again shortly.')
+            try:
+                slot = self._acquire_shared_slot(give_up_at)
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            with self._lock:
+                self._stats['waiting'] -= 1
+        waited = time.monotonic() - queued_at
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['in_flight'] += 1
+            self._stats['wait_seconds'] += waited
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+        return slot
+
+    def _acquire_shared_slot(self, give_up_at):
+        # Any of the slot files this process can flock; its threads each open their own, so they don't share locks
+        if self.slot_prefix is None:
+            return None
+        while True:
+            first = random.randrange(self.max_concurrency)
+            for offset in range(self.max_concurrency):
+                slot_file = open(f'{self.slot_prefix}{(first + offset) % self.max_concurrency}', 'a')
+                try:
+                    fcntl.flock(slot_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot_file
+                except BlockingIOError:
+                    slot_file.close()
+            if time.monotonic() + SLOT_POLL_INTERVAL > give_up_at:
+                self._count('busy')
+                raise GenAIBusyError('Too many GenAI calls in progress across workers; try again shortly.')
+            time.sleep(SLOT_POLL_INTERVAL * random.uniform(0.5, 1.5))
+
+    def _release(self, slot):
+        if slot is not None:
+            slot.close() # Closing the file drops its flock
+        with self._lock:
+            self._stats['in_flight'] -= 1
+        self._slots.release()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    # --- Reporting ---
+
+    def reset_stats(self):
+        with self._lock:
+            in_flight, waiting = self._stats.get('in_flight', 0), self._stats.get('waiting', 0)
+            self._stats = {'calls': 0, 'retries': 0, 'failed': 0, 'busy': 0, 'wait_seconds': 0.0,
+                           'max_wait_seconds': 0.0, 'in_flight': in_flight, 'waiting': waiting}
+
+    def stats(self):
+        """
+        Call slot usage in this process, for sizing GENAI_MAX_CONCURRENCY.
+
+        Returns:
+            dict: Calls started, retries, calls failed after retrying, calls turned away as busy,
+                  calls in flight and waiting for a slot now, mean and longest slot wait (ms),
+                  and the limit and whether it is shared across processes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            'max_concurrency': self.max_concurrency,
+            'shared': self.slot_prefix is not None,
+            'calls': stats['calls'],
+            'retries': stats['retries'],
+            'failed': stats['failed'],
+            'busy': stats['busy'],
+            'in_flight': stats['in_flight'],
+            'waiting': stats['waiting'],
+            'mean_wait_ms': round(stats['wait_seconds'] * 1000 / stats['calls'], 1) if stats['calls'] else None,
+            'max_wait_ms': round(stats['max_wait_seconds'] * 1000, 1),
+        }
+
+
+genai_client = GenAIClient()
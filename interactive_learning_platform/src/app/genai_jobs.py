@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import g
+from flask.cli import with_appcontext
+
+from app.models import db, GenAITask
+from app.genai_client import genai_client
+from app.genai_utils import generate_activity_draft
+from app.answer_grouping import regroup_activity, group_new_answers
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class GenAITaskError(Exception):
+    """A GenAI task that cannot complete; the message is stored on the task."""
+
+
+def run_activity_generation(input_data):
+    """Generates an activity draft; returns the draft."""
+    draft = generate_activity_draft(input_data['topic'], input_data['type'], bypass_cache=input_data.get('refresh', False))
+    if not draft:
+        raise GenAITaskError('GenAI generation failed or not supported for this type yet.')
+    return draft
+
+
+def run_answer_grouping(input_data):
+    """
+    Groups an activity's short answers: only those not grouped yet (see group_new_answers),
+    or, with 'refresh', all of them from scratch and bypassing the GenAI cache.
+    """
+    activity_id = input_data['activity_id']
+    if input_data.get('refresh', False):
+        grouping_result = regroup_activity(activity_id, bypass_cache=True)
+    else:
+        grouping_result = group_new_answers(activity_id)
+    if grouping_result is None:
+        raise GenAITaskError('GenAI grouping failed')
+    return grouping_result
+
+
+TASK_HANDLERS = {
+    'activity_generation': run_activity_generation,
+    'answer_grouping': run_answer_grouping,
+}
+
+
+class GenAIJobQueue(object):
+    """
+    Runs GenAI tasks on a pool of background threads instead of in the request.
+
+    The GenAITask table is the queue: a request inserts a 'pending' task and wakes the pool;
+    a worker claims the oldest pending task with one conditional UPDATE (so workers in
+    several processes never run the same task), marks it 'processing' with a lease, and
+    stores the output as 'completed' or the error as 'failed'. A task whose lease expires
+    (its worker process died) goes back to 'pending', up to GENAI_MAX_ATTEMPTS claims.
+
+    GENAI_WORKERS bounds how many GenAI calls one process makes at once; with 0, this
+    process only enqueues and `flask genai-worker` runs the tasks.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.workers = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._signals = 0
+        self._pid = None
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['GENAI_WORKERS']
+        self.poll_interval = app.config['GENAI_POLL_INTERVAL']
+        self.lease = timedelta(seconds=app.config['GENAI_TASK_LEASE'])
+        self.max_attempts = app.config['GENAI_MAX_ATTEMPTS']
+        if self.workers > 0:
+            # Pending and expired tasks left by a restart are picked up once this process serves
+            # anything, not only when a new task is queued; the pid check restarts the pool in
+            # each forked worker process. CLI commands never start it (genai-worker has its own).
+            app.before_request(self._ensure_started)
+
+    def _ensure_started(self, workers=None):
+        """Starts (or, after a fork, restarts) this process's worker threads."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [threading.Thread(target=self._work_loop, name=f'genai-worker-{n}', daemon=True)
+                             for n in range(self.workers if workers is None else workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, task_id):
+        """Wakes a worker for a task just committed as 'pending'."""
+        if self.workers > 0:
+            self._ensure_started()
+        with self._lock:
+            self._signals += 1
+            self._wakeup.notify()
+
+    # --- Workers ---
+
+    def _work_loop(self):
+        # run_next sweeps expired leases before each claim, so a new worker recovers a dead process's tasks first
+        while True:
+            try:
+                ran = self.run_next()
+            except Exception as e:
+                print(f"GenAI worker failed: {e}")
+                ran = False
+            if ran:
+                continue
+            with self._lock:
+                if not self._signals:
+                    self._wakeup.wait(timeout=self.poll_interval)
+                self._signals = max(self._signals - 1, 0)
+
+    def run_next(self):
+        """Claims and runs the oldest pending task, if any; returns whether one ran."""
+        with self.app.app_context():
+            try:
+                self.recover_expired()
+                task_id = self._claim()
+                if task_id is None:
+                    return False
+                self._run(task_id)
+                return True
+            finally:
+                db.session.remove()
+
+    def _claim(self):
+        oldest_pending = db.select(GenAITask.id).where(GenAITask.status == PENDING).\
+            order_by(GenAITask.id).limit(1).scalar_subquery()
+        claimed = db.session.execute(
+            db.update(GenAITask).where(GenAITask.id == oldest_pending, GenAITask.status == PENDING).
+            values(status=PROCESSING, started_at=datetime.utcnow(), attempts=GenAITask.attempts + 1).
+            returning(GenAITask.id).execution_options(synchronize_session=False)
+        ).scalar()
+        db.session.commit()
+        return claimed
+
+    def _run(self, task_id):
+        task = db.session.get(GenAITask, task_id)
+        started = time.perf_counter()
+        genai_client.start_task() # The task's calls, retries included, share GENAI_TASK_TIMEOUT
+        try:
+            handler = TASK_HANDLERS.get(task.task_type)
+            if handler is None:
+                raise GenAITaskError(f"Unknown GenAI task type '{task.task_type}'")
+            output = handler(json.loads(task.input_data))
+            task.output_data = json.dumps(output)
+            task.status = COMPLETED
+            task.error = None
+            # Served from the cache only if every model call of the task was
+            usage = g.get('genai_usage')
+            task.cache_hit = usage['cache_hits'] == usage['calls'] if usage else None
+            if usage and 'tokens_saved' in usage:
+                self._record_dedup(task, usage)
+        except Exception as e:
+            db.session.rollback()
+            print(f"GenAI task {task_id} ({task.task_type}) failed: {e}")
+            task = db.session.get(GenAITask, task_id)
+            task.status = FAILED
+            task.error = str(e) or e.__class__.__name__
+        # A failed task's calls were made (and billed) too
+        self._record_usage(task, g.get('genai_usage') or {})
+        task.completed_at = datetime.utcnow()
+        db.session.commit()
+        with self._stats_lock:
+            self._stats[task.status] += 1
+            self._stats['run_seconds'] += time.perf_counter() - started
+
+    def _record_usage(self, task, usage):
+        config = self.app.config
+        task.model = 'stub' if config['GENAI_PROVIDER'] == 'stub' else config['GENAI_MODEL']
+        task.queue_seconds = round((task.started_at - task.created_at).total_seconds(), 3) \
+            if task.started_at and task.created_at else None
+        task.latency_seconds = round(usage.get('model_seconds', 0.0), 3)
+        task.prompt_tokens = usage.get('prompt_tokens', 0)
+        task.completion_tokens = usage.get('completion_tokens', 0)
+        task.retries = usage.get('retries', 0)
+        pricing = config['GENAI_PRICING'].get(task.model)
+        task.cost_usd = (task.prompt_tokens * pricing[0] + task.completion_tokens * pricing[1]) / 1e6 \
+            if pricing else None
+
+    @staticmethod
+    def _record_dedup(task, usage):
+        # Model time is taken as proportional to prompt tokens, at the rate this task's model calls ran
+        task.answers_sent = usage['distinct_answers']
+        task.tokens_saved = usage['tokens_saved']
+        if usage.get('prompt_tokens'):
+            task.seconds_saved = round(usage['model_seconds'] * usage['tokens_saved'] / usage['prompt_tokens'], 3)
+        else:
+            task.seconds_saved = 0.0 # Every call was served from the cache
+
+    def recover_expired(self):
+        """Re-queues tasks whose worker's lease expired (failing those out of attempts); returns how many."""
+        expired = (GenAITask.status == PROCESSING) & (GenAITask.started_at < datetime.utcnow() - self.lease)
+        retried = GenAITask.query.filter(expired, GenAITask.attempts < self.max_attempts).\
+            update({'status': PENDING}, synchronize_session=False)
+        failed = GenAITask.query.filter(expired, GenAITask.attempts >= self.max_attempts).\
+            update({'status': FAILED, 'completed_at': datetime.utcnow(),
+                    'error': 'The worker running this task stopped; no attempts left.'}, synchronize_session=False)
+        if retried or failed:
+            db.session.commit()
+        return retried + failed
+
+    def run_forever(self, workers):
+        """Runs `workers` worker threads in the foreground (the genai-worker command)."""
+        self._ensure_started(workers)
+        while True:
+            time.sleep(60)
+
+    # --- Reporting ---
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {COMPLETED: 0, FAILED: 0, 'run_seconds': 0.0}
+
+    def usage_report(self, session, days=14):
+        """
+        Usage of the tasks created in the last `days` days, per day and per task type.
+
+        Everything is aggregated in SQL, including the latency percentiles (see _usage_rows).
+
+        Returns:
+            dict: 'by_day' and 'by_type' rows (newest day first, task types by name).
+        """
+        since = datetime.utcnow() - timedelta(days=days)
+        return {
+            'days': days,
+            'by_day': self._usage_rows(session, since, db.func.date(GenAITask.created_at), descending=True),
+            'by_type': self._usage_rows(session, since, GenAITask.task_type),
+        }
+
+    @staticmethod
+    def _usage_rows(session, since, key, descending=False):
+        # Nearest-rank percentiles of model latency over the tasks that reached the model (latency > 0):
+        # each task is ranked by latency within its group, and p% is the smallest latency whose rank
+        # is at least p% of the group's size (compared in integers, as SQLite has no ceil)
+        reached_model = db.func.coalesce(GenAITask.latency_seconds, 0) > 0
+        partition = [key, reached_model]
+        ranked = db.select(
+            key.label('key'), GenAITask.status, GenAITask.cache_hit, GenAITask.queue_seconds,
+            GenAITask.latency_seconds, GenAITask.prompt_tokens, GenAITask.completion_tokens, GenAITask.cost_usd,
+            reached_model.label('reached_model'),
+            db.func.row_number().over(partition_by=partition, order_by=GenAITask.latency_seconds).label('position'),
+            db.func.count().over(partition_by=partition).label('group_size'),
+        ).where(GenAITask.created_at >= since).subquery()
+
+        def percentile(p):
+            return db.func.min(db.case(
+                (db.and_(ranked.c.reached_model == 1, ranked.c.position * 100 >= p * ranked.c.group_size),
+                 ranked.c.latency_seconds)))
+
+        def count_where(condition):
+            return db.func.coalesce(db.func.sum(db.case((condition, 1), else_=0)), 0)
+
+        rows = session.execute(db.select(
+            ranked.c.key, db.func.count().label('tasks'),
+            count_where(ranked.c.status == COMPLETED).label('completed'),
+            count_where(ranked.c.status == FAILED).label('failed'),
+            count_where(ranked.c.cache_hit == 1).label('cache_hits'),
+            db.func.avg(ranked.c.queue_seconds).label('mean_queue_seconds'),
+            percentile(50).label('p50_latency_seconds'),
+            percentile(95).label('p95_latency_seconds'),
+            db.func.coalesce(db.func.sum(ranked.c.prompt_tokens), 0).label('prompt_tokens'),
+            db.func.coalesce(db.func.sum(ranked.c.completion_tokens), 0).label('completion_tokens'),
+            db.func.sum(ranked.c.cost_usd).label('cost_usd'),
+        ).group_by(ranked.c.key).order_by(ranked.c.key.desc() if descending else ranked.c.key))
+        return [row._asdict() for row in rows]
+
+    def stats(self):
+        """Tasks finished by this process, and the queue as the database sees it."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        finished = stats[COMPLETED] + stats[FAILED]
+        counts = dict(db.session.query(GenAITask.status, db.func.count()).
+                      filter(GenAITask.status.in_([PENDING, PROCESSING])).group_by(GenAITask.status).all())
+        return {
+            'workers': self.workers,
+            'pending': counts.get(PENDING, 0),
+            'processing': counts.get(PROCESSING, 0),
+            'completed': stats[COMPLETED],
+            'failed': stats[FAILED],
+            'mean_run_ms': round(stats['run_seconds'] * 1000 / finished, 1) if finished else None,
+        }
+
+
+genai_jobs = GenAIJobQueue()
+
+
+@click.command('genai-worker')
+@click.option('--workers', type=int, default=2, show_default=True)
+@with_appcontext
+def genai_worker_command(workers):
+    """Run GenAI tasks in the foreground (for GENAI_WORKERS = 0 in the web processes)."""
+    click.echo(f'Running {workers} GenAI workers; Ctrl+C to stop.')
+    genai_jobs.run_forever(workers)
@@ -1,39 +1,177 @@
 import os
+import re
 import json
-from flask import current_app
+import random
+import time
+from flask import current_app, g
 
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    OpenAI = None
+from app.genai_cache import genai_cache, normalize_input
+from app.genai_client import genai_client, OPENAI_AVAILABLE, StubTransientError
 
 def get_openai_client():
-    """Initializes and returns the OpenAI client."""
+    """Returns this process's pooled OpenAI client (see app/genai_client.py)."""
     # The API key is available in the environment variable OPENAI_API_KEY
     # The client will automatically pick it up.
-    return OpenAI()
+    return genai_client.openai_client()
 
-def generate_activity_draft(topic_or_content, activity_type):
+_CJK_CHAR = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+
+def estimate_tokens(text):
+    """A rough token count for prompt sizing: ~4 characters per token, one per CJK character."""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def genai_available():
+    """Whether the configured GENAI_PROVIDER can be called at all."""
+    return current_app.config['GENAI_PROVIDER'] == 'stub' or OPENAI_AVAILABLE
+
+def complete_json(task_type, system_message, user_message, json_schema, bypass_cache=False):
+    """
+    Runs one JSON-mode chat completion with the configured GENAI_PROVIDER and returns the parsed object.
+
+    Outputs are served from and stored in the GenAI cache (see app/genai_cache.py); each call
+    is counted in g.genai_usage, so the task running it can record whether it hit the cache,
+    and the calls that reach the model add their prompt and completion tokens (as the API
+    reports them, or estimated) and seconds.
+
+    Args:
+        task_type (str): 'activity_generation' or 'answer_grouping' (the stub provider answers per task type).
+        system_message (str): The instructions.
+        user_message (str): The input, already normalized.
+        json_schema (dict): The schema the output must conform to.
+        bypass_cache (bool): Call the model even if a cached output exists (the new output replaces it).
+
+    The call goes through genai_client: a pooled connection, a timeout, retries of transient
+    errors and a limit on concurrent calls.
+
+    Raises:
+        Exception: Whatever the provider raises once retries are exhausted, or GenAIBusyError;
+            callers log and treat it as a failed task.
+    """
+    provider = current_app.config['GENAI_PROVIDER']
+    model = current_app.config['GENAI_MODEL']
+    usage = g.setdefault('genai_usage', {'calls': 0, 'cache_hits': 0})
+    usage['calls'] += 1
+    cache_key = None
+    if genai_cache.enabled:
+        cache_key = genai_cache.make_key(provider, model, task_type, system_message, json_schema, user_message)
+        cached = None if bypass_cache else genai_cache.get(cache_key)
+        if cached is not None:
+            usage['cache_hits'] += 1
+            return cached
+
+    reported_usage = None
+    if provider == 'stub':
+        output = genai_client.call(lambda client, timeout: _stub_complete(task_type, user_message), uses_openai=False)
+    else:
+        def request(client, timeout):
+            return client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": user_message}
+                ],
+                response_format={"type": "json_object", "schema": json_schema},
+                timeout=timeout
+            )
+        response = genai_client.call(request)
+        # The response text should be a JSON string
+        raw_json = response.choices[0].message.content
+        output = json.loads(raw_json)
+        reported_usage = getattr(response, 'usage', None)
+    if reported_usage is not None:
+        prompt_tokens, completion_tokens = reported_usage.prompt_tokens, reported_usage.completion_tokens
+    else:
+        prompt_tokens = estimate_tokens(system_message) + estimate_tokens(user_message)
+        completion_tokens = estimate_tokens(json.dumps(output, ensure_ascii=False))
+    usage['prompt_tokens'] = usage.get('prompt_tokens', 0) + prompt_tokens
+    usage['completion_tokens'] = usage.get('completion_tokens', 0) + completion_tokens
+
+    if cache_key is not None:
+        genai_cache.put(cache_key, task_type, output)
+    return output
+
+# --- Local stub provider (GENAI_PROVIDER = 'stub') ---
+# Deterministic answers in the real output shapes, so the task queue and the pages that
+# use GenAI can run offline and in tests. The model's latency is simulated as GENAI_STUB_LATENCY
+# seconds plus GENAI_STUB_SECONDS_PER_1K_TOKENS per thousand prompt tokens, and a share
+# GENAI_STUB_ERROR_RATE of calls fail with a transient error (after that latency).
+
+_ANSWER_LINE = re.compile(r'^\[(\d+)\](?: \(×(\d+)\))?: ?(.*)$')
+_LABEL_LINE = re.compile(r'^\[(\d+)\]: ?(.*) \((\d+) answers?\)$')
+_WORD = re.compile(r'\w+')
+_STUB_MAX_GROUPS = 8
+
+def _stub_complete(task_type, user_message):
+    time.sleep(current_app.config['GENAI_STUB_LATENCY'] +
+               estimate_tokens(user_message) / 1000.0 * current_app.config['GENAI_STUB_SECONDS_PER_1K_TOKENS'])
+    if random.random() < current_app.config['GENAI_STUB_ERROR_RATE']:
+        raise StubTransientError('Simulated provider overload')
+    if task_type == 'activity_generation':
+        topic = user_message.split(':', 1)[-1].strip() or 'the topic'
+        return {
+            "title": f"{topic[:60]}",
+            "question": f"Which statement about {topic[:120]} is correct?",
+            "options": [f"Statement {letter} about {topic[:40]}" for letter in "ABCD"],
+            "correct_answer": f"Statement A about {topic[:40]}",
+        }
+    if task_type in ('answer_grouping', 'answer_assignment'):
+        # Groups answers by their first word (so an assignment matches the groups the stub made
+        # before); when grouping, the smallest groups are merged into "Other"
+        groups, sizes = {}, {}
+        for line in user_message.splitlines():
+            match = _ANSWER_LINE.match(line)
+            if match:
+                words = _WORD.findall(match.group(3).lower())
+                word = words[0] if words else '(blank)'
+                groups.setdefault(word, []).append(int(match.group(1)))
+                sizes[word] = sizes.get(word, 0) + int(match.group(2) or 1)
+        ranked = sorted(groups.items(), key=lambda item: (-sizes[item[0]], item[0]))
+        kept = len(ranked) if task_type == 'answer_assignment' else _STUB_MAX_GROUPS - 1
+        result = {f"Answers starting with '{word}'": indices for word, indices in ranked[:kept]}
+        other = sorted(index for _, indices in ranked[kept:] for index in indices)
+        if other:
+            result["Other"] = other
+        return result
+    if task_type == 'label_merging':
+        # Keeps the largest groups (by the answer counts in the labels) and merges the rest into "Other"
+        labels = []
+        for line in user_message.splitlines():
+            match = _LABEL_LINE.match(line)
+            if match:
+                labels.append((int(match.group(1)), match.group(2), int(match.group(3))))
+        labels.sort(key=lambda label: (-label[2], label[0]))
+        result = {text: [position] for position, text, _ in labels[:_STUB_MAX_GROUPS - 1]}
+        other = sorted(position for position, _, _ in labels[_STUB_MAX_GROUPS - 1:])
+        if other:
+            result["Other"] = other
+        return result
+    raise ValueError(f"The stub provider does not support task type '{task_type}'")
+
+def _indexed_answers(answers, counts=None):
+    # One "[i]: answer" line per answer; an answer several students gave reads "[i] (×n): answer"
+    return "\n".join(f"[{i}]{f' (×{counts[i]})' if counts and counts[i] > 1 else ''}: {normalize_input(answer)}"
+                     for i, answer in enumerate(answers))
+
+_COUNTS_NOTE = " An answer given by several students is listed once, with the number of students as (×n) after its index."
+
+def generate_activity_draft(topic_or_content, activity_type, bypass_cache=False):
     """
     Uses GenAI to generate a draft for a learning activity.
     
     Args:
         topic_or_content (str): The subject matter or content to base the activity on.
         activity_type (str): The type of activity (e.g., 'quiz', 'poll', 'short_answer').
+        bypass_cache (bool): Generate a fresh draft even if one is cached for this input.
         
     Returns:
         dict: A dictionary containing the generated activity content (title, question, options, etc.)
               or None if generation fails.
     """
-    if not OPENAI_AVAILABLE:
+    if not genai_available():
         print("OpenAI is not available. GenAI features are disabled.")
         return None
     
-    client = get_openai_client()
-    model = current_app.config['GENAI_MODEL']
-    
     # Define the desired JSON output structure
     if activity_type == 'quiz':
         json_schema = {
@@ -64,44 +202,32 @@ def generate_activity_draft(topic_or_content, activity_type):
     system_message = f"You are an expert educational content generator. Your task is to create a learning activity of type '{activity_type}'. {prompt_suffix}"
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"Content/Topic: {topic_or_content}"}
-            ],
-            response_format={"type": "json_object", "schema": json_schema}
-        )
-        
-        # The response text should be a JSON string
-        raw_json = response.choices[0].message.content
-        return json.loads(raw_json)
+        return complete_json('activity_generation', system_message, f"Content/Topic: {normalize_input(topic_or_content)}",
+                             json_schema, bypass_cache=bypass_cache)
         
     except Exception as e:
         print(f"GenAI activity generation failed: {e}")
         return None
 
-def group_short_answers(answers):
+def group_short_answers(answers, counts=None, bypass_cache=False):
     """
     Uses GenAI to group similar short answers from students.
     
     Args:
         answers (list): A list of student answer strings.
+        counts (list): How many students gave each answer, if the answers were deduplicated.
+        bypass_cache (bool): Regroup even if a grouping of the same answers is cached.
         
     Returns:
         dict: A dictionary where keys are group labels and values are lists of answer indices.
               Example: {"Group A (Concept X)": [0, 2], "Group B (Concept Y)": [1, 3]}
     """
-    if not OPENAI_AVAILABLE:
+    if not genai_available():
         print("OpenAI is not available. GenAI features are disabled.")
         return None
     
-    client = get_openai_client()
-    model = current_app.config['GENAI_MODEL']
-    
     # Prepend index to each answer for easy mapping back
-    indexed_answers = [f"[{i}]: {answer}" for i, answer in enumerate(answers)]
-    answers_text = "\n".join(indexed_answers)
+    answers_text = _indexed_answers(answers, counts)
     
     json_schema = {
         "type": "object",
@@ -115,21 +241,95 @@ def group_short_answers(answers):
     }
     
     system_message = "You are an expert in qualitative data analysis. Your task is to group the following short answers into a few thematic categories. The output MUST be a JSON object conforming to the provided schema. The keys should be descriptive group labels, and the values should be lists of the original answer indices (the number in the square brackets)."
+    if counts and max(counts) > 1:
+        system_message += _COUNTS_NOTE
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": f"Short answers to group:\n{answers_text}"}
-            ],
-            response_format={"type": "json_object", "schema": json_schema}
-        )
-        
-        raw_json = response.choices[0].message.content
-        return json.loads(raw_json)
+        return complete_json('answer_grouping', system_message, f"Short answers to group:\n{answers_text}",
+                             json_schema, bypass_cache=bypass_cache)
         
     except Exception as e:
         print(f"GenAI answer grouping failed: {e}")
         return None
 
+def assign_short_answers(answers, groups, counts=None, bypass_cache=False):
+    """
+    Uses GenAI to place new short answers into an activity's existing answer groups.
+
+    Args:
+        answers (list): The new answer strings.
+        groups (list): (label, [example answers]) per existing group.
+        counts (list): How many students gave each answer, if the answers were deduplicated.
+        bypass_cache (bool): Ask the model even if the same assignment is cached.
+
+    Returns:
+        dict: {label: [answer indices]}, where a label is an existing group's label or a newly
+              proposed one; or None if the assignment fails.
+    """
+    if not genai_available():
+        print("OpenAI is not available. GenAI features are disabled.")
+        return None
+
+    groups_text = "\n".join(
+        f"- {label}" + (f" (e.g. {'; '.join(normalize_input(example) for example in examples)})" if examples else "")
+        for label, examples in groups)
+    answers_text = _indexed_answers(answers, counts)
+    json_schema = {
+        "type": "object",
+        "patternProperties": {
+            "^.*$": {
+                "type": "array",
+                "items": {"type": "integer", "description": "The index of the answer in the input list."}
+            }
+        },
+        "description": "A mapping of group labels (existing labels verbatim, or new ones) to a list of answer indices."
+    }
+    system_message = "You are an expert in qualitative data analysis. Short answers have already been grouped into the existing groups listed. Assign each new answer to the existing group it fits, using that group's label exactly as written; if it fits none, put it under a new descriptive label. The output MUST be a JSON object conforming to the provided schema. The keys are group labels, and the values are lists of the new answers' indices (the number in the square brackets); every index must appear exactly once."
+    if counts and max(counts) > 1:
+        system_message += _COUNTS_NOTE
+
+    try:
+        return complete_json('answer_assignment', system_message,
+                             f"Existing groups:\n{groups_text}\n\nNew answers to assign:\n{answers_text}",
+                             json_schema, bypass_cache=bypass_cache)
+
+    except Exception as e:
+        print(f"GenAI answer assignment failed: {e}")
+        return None
+
+def merge_group_labels(labels, max_groups, bypass_cache=False):
+    """
+    Uses GenAI to consolidate group labels (from separately grouped batches) into at most max_groups themes.
+
+    Args:
+        labels (list): (label, answer count) pairs.
+        max_groups (int): The most themes to return.
+        bypass_cache (bool): Merge again even if the same labels were merged before.
+
+    Returns:
+        dict: {final label: [positions in `labels`]}, or None if merging fails.
+    """
+    if not genai_available():
+        print("OpenAI is not available. GenAI features are disabled.")
+        return None
+
+    labels_text = "\n".join(f"[{i}]: {label} ({count} answers)" for i, (label, count) in enumerate(labels))
+    json_schema = {
+        "type": "object",
+        "patternProperties": {
+            "^.*$": {
+                "type": "array",
+                "items": {"type": "integer", "description": "The index of the label in the input list."}
+            }
+        },
+        "description": "A mapping of final group labels to the indices of the input labels merged into each."
+    }
+    system_message = f"You are an expert in qualitative data analysis. The following labels name groups of short answers that were grouped in separate batches, so several labels may describe the same theme. Merge them into at most {max_groups} themes. The output MUST be a JSON object conforming to the provided schema. The keys should be descriptive theme labels, and the values should be lists of the input label indices (the number in the square brackets); every index must appear exactly once."
+
+    try:
+        return complete_json('label_merging', system_message, f"Group labels to merge:\n{labels_text}",
+                             json_schema, bypass_cache=bypass_cache)
+
+    except Exception as e:
+        print(f"GenAI label merging failed: {e}")
+        return None
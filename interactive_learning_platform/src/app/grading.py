@@ -0,0 +1,104 @@
+import json
+
+import click
+from flask.cli import with_appcontext
+
+from app.models import db, Activity, Response
+from app.aggregates import rebuild_tallies, KEY_LENGTH
+from app.activity_cache import activity_cache
+from app.leaderboard import add_grade_deltas, apply_grade_deltas
+
+
+def set_answer_keys(activity, answer_keys):
+    """
+    Changes a quiz's correct answers in its content (bumping content_version on flush).
+
+    Args:
+        activity (Activity): The quiz.
+        answer_keys (list): The new correct option of each question, in order.
+    """
+    content = dict(activity_cache.get(activity).content)
+    questions = content.get('questions')
+    if content.get('correct_answer') is None and isinstance(questions, list):
+        content['questions'] = [dict(question, correct_answer=answer_key) if isinstance(question, dict) else question
+                                for question, answer_key in zip(questions, answer_keys)] + questions[len(answer_keys):]
+    elif answer_keys:
+        content['correct_answer'] = answer_keys[0]
+    activity.content = json.dumps(content)
+
+
+def _regraded_marks(compiled):
+    # The new (is_correct, score) of a response, as SQL expressions evaluated per row
+    if not compiled.multi_question:
+        if compiled.answer_key is None:
+            return db.null(), db.null()
+        # selected_option holds the answer cut to KEY_LENGTH (see response_columns), so the key is cut alike
+        is_correct = db.case((Response.selected_option.is_(None), db.null()),
+                             else_=Response.selected_option == compiled.answer_key[:KEY_LENGTH])
+        return is_correct, db.case((is_correct, 1.0), (is_correct.is_not(None), 0.0), else_=db.null())
+
+    graded = sum(answer_key is not None for answer_key in compiled.answer_keys)
+    if not graded:
+        return db.null(), db.null()
+    # All questions are marked inside SQLite: the answers list joined to the key list by position
+    payload = db.case((db.func.json_valid(Response.response_data), Response.response_data), else_=db.null())
+    answers = db.func.json_each(payload, '$.answers').table_valued('key', 'value')
+    answer_keys = db.func.json_each(json.dumps(compiled.answer_keys)).table_valued('key', 'value')
+    correct = db.select(db.func.count()).select_from(answers).\
+        join(answer_keys, (answer_keys.c.key == answers.c.key) &
+             (answer_keys.c.value == db.cast(answers.c.value, db.String))).\
+        scalar_subquery()
+    submitted = db.func.json_type(payload, '$.answers') == 'array'
+    return (db.case((submitted, correct == graded), else_=db.null()),
+            db.case((submitted, db.cast(correct, db.Float)), else_=db.null()))
+
+
+def regrade_activity(activity):
+    """
+    Re-marks every response of a quiz against its current answer keys (without committing).
+
+    is_correct and score are recomputed for all of the activity's responses by a single
+    UPDATE (for a multi-question quiz, every question of every response is marked in that
+    statement); only rows whose marks actually change are written. The rows about to
+    change are read first (three narrow columns) so leaderboards can be adjusted by delta,
+    and the activity's tallies are then rebuilt with set-based statements.
+
+    Args:
+        activity (Activity): The quiz, with its answer keys already changed and flushed.
+
+    Returns:
+        int: The number of responses whose marks changed.
+    """
+    is_correct, score = _regraded_marks(activity_cache.get(activity))
+    changed = (Response.activity_id == activity.id) & \
+        (Response.is_correct.is_distinct_from(is_correct) | Response.score.is_distinct_from(score))
+
+    grades = {}
+    previous = db.session.query(Response.responder_id, Response.score, Response.submitted_at).filter(changed)
+    for responder_id, points, submitted_at in previous:
+        add_grade_deltas(grades, activity.course_id, responder_id, points, submitted_at, sign=-1)
+
+    regraded = db.session.execute(
+        db.update(Response).where(changed).values(is_correct=is_correct, score=score).
+        returning(Response.responder_id, Response.score, Response.submitted_at).
+        execution_options(synchronize_session=False)
+    ).all()
+    for responder_id, points, submitted_at in regraded:
+        add_grade_deltas(grades, activity.course_id, responder_id, points, submitted_at)
+
+    rebuild_tallies([activity.id])
+    apply_grade_deltas(grades)
+    return len(regraded)
+
+
+@click.command('regrade-activity')
+@click.argument('activity_id', type=int)
+@with_appcontext
+def regrade_activity_command(activity_id):
+    """Re-mark all responses of a quiz against its current answer key."""
+    activity = db.session.get(Activity, activity_id)
+    if activity is None:
+        raise click.ClickException(f'Activity {activity_id} not found.')
+    regraded = regrade_activity(activity)
+    db.session.commit()
+    click.echo(f'Regraded {regraded} responses of activity {activity_id}.')
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+class IdentityCache(object):
+    """
+    A bounded LRU cache with a TTL, holding the column values of recently loaded users.
+
+    Only plain column values are stored (never ORM instances), so an entry can be turned
+    back into a User attached to the current request's session without a SELECT.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config['IDENTITY_CACHE_SIZE']
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+        self.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+user_cache = IdentityCache()
+_invalidation_registered = False
+
+
+def load_cached_user(session, user_model, user_id):
+    """
+    Returns the user with the given id, from the identity cache when possible.
+
+    A cached entry is rebuilt into a detached instance and attached to the session, so
+    relationships and later attribute loads keep working as for a queried user.
+    """
+    identity_key = session.identity_key(user_model, user_id)
+    if identity_key in session.identity_map:
+        return session.identity_map[identity_key]
+
+    state = user_cache.get(user_id)
+    if state is not None:
+        user = user_model(**state)
+        make_transient_to_detached(user)
+        session.add(user)
+        return user
+
+    user = session.get(user_model, user_id)
+    if user is not None:
+        user_cache.put(user_id, {attr.key: getattr(user, attr.key) for attr in user_model.__mapper__.column_attrs})
+    return user
+
+
+def register_invalidation(user_model):
+    """
+    Drops cache entries for users updated or deleted through the ORM.
+
+    Entries are dropped at flush and again after commit, so a concurrent request cannot
+    re-cache the old row between the two. Bulk query.update()/delete() calls bypass
+    these events and are covered by the TTL only.
+    """
+    global _invalidation_registered
+    if _invalidation_registered:
+        return
+    _invalidation_registered = True
+
+    def _forget(mapper, connection, target):
+        user_cache.invalidate(target.id)
+
+    event.listen(user_model, 'after_update', _forget)
+    event.listen(user_model, 'after_delete', _forget)
+
+    @event.listens_for(Session, 'after_flush')
+    def _collect(session, flush_context):
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, user_model) and obj.id is not None:
+                session.info.setdefault('_identity_cache_dirty', set()).add(obj.id)
+
+    @event.listens_for(Session, 'after_commit')
+    def _invalidate_committed(session):
+        for user_id in session.info.pop('_identity_cache_dirty', ()):
+            user_cache.invalidate(user_id)
+
+    @event.listens_for(Session, 'after_rollback')
+    def _discard(session):
+        session.info.pop('_identity_cache_dirty', None)
@@ -0,0 +1,306 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import db, Activity, Response
+from app.aggregates import response_columns, add_response_deltas, add_group_delta, apply_deltas
+from app.activity_cache import activity_cache
+from app.submissions import response_policy, FIRST_ANSWER_WINS
+from app.leaderboard import add_grade_deltas, apply_grade_deltas
+
+ORPHAN_SCAN_INTERVAL = 30 # Seconds between scans for journals of processes that died since the last one
+
+
+class WriteBehindIngestor(object):
+    """
+    Optional write-behind path for submit_response (INGEST_MODE = 'write_behind').
+
+    A validated submission is appended to a local journal file (fsynced) and acknowledged;
+    a background thread then writes the pending submissions to the database in batches,
+    with one multi-row INSERT every INGEST_FLUSH_INTERVAL_MS or INGEST_FLUSH_MAX_RECORDS,
+    instead of one commit per request contending for SQLite's write lock.
+
+    Each worker process appends to its own journal segment and holds an exclusive flock on
+    it. A segment whose lock can be taken belongs to a dead process and is replayed (when a
+    process starts, and every ORPHAN_SCAN_INTERVAL seconds), so no acknowledged answer is
+    lost to a crash. Replays are idempotent: a submission is applied
+    as "last answer wins" for its (activity, responder) pair.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = []
+        self._segment = None
+        self._segment_path = None
+        self._pid = None
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['INGEST_MODE'] == 'write_behind'
+        self.directory = app.config['INGEST_JOURNAL_DIR']
+        self.interval = app.config['INGEST_FLUSH_INTERVAL_MS'] / 1000.0
+        self.max_records = app.config['INGEST_FLUSH_MAX_RECORDS']
+        self.fsync = app.config['INGEST_FSYNC']
+        if self.enabled:
+            # Replay journals a crashed process left behind now, not on the next submission (which,
+            # after a lecture, may never come); the pid check restarts the flusher in forked workers
+            self._ensure_started()
+            app.before_request(self._ensure_started)
+
+    # --- Journal ---
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f'journal-{os.getpid()}-{time.time_ns()}.log')
+        segment = open(path, 'ab')
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return segment, path
+
+    def _ensure_started(self):
+        """Starts (or, after a fork, restarts) this process's segment and flusher thread."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pending = []
+            self._segment, self._segment_path = self._open_segment()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._flush_loop, name='ingest-flusher', daemon=True)
+            self._thread.start()
+
+    def submit(self, activity_id, responder_id, response_data):
+        """
+        Durably queues one submission and returns once it is safe to acknowledge.
+
+        Args:
+            activity_id (int): The activity answered.
+            responder_id (int): The submitting student.
+            response_data (dict): The validated answer payload.
+        """
+        self._ensure_started()
+        record = {'activity_id': activity_id, 'responder_id': responder_id,
+                  'response_data': response_data, 'submitted_at': datetime.utcnow().isoformat()}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        started = time.perf_counter()
+        with self._lock:
+            self._segment.write(line)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._pending.append(record)
+            if len(self._pending) >= self.max_records:
+                self._wakeup.notify()
+        with self._stats_lock:
+            self._stats['accepted'] += 1
+            self._stats['ack_seconds'] += time.perf_counter() - started
+
+    # --- Flushing ---
+
+    def _flush_loop(self):
+        needs_replay = True
+        last_replay = 0.0
+        while True:
+            if needs_replay or time.monotonic() - last_replay >= ORPHAN_SCAN_INTERVAL:
+                # Segments of dead processes, and of our own batches that failed to write
+                try:
+                    self.replay_orphans()
+                    needs_replay = False
+                    last_replay = time.monotonic()
+                except Exception as e:
+                    print(f"Replaying write-behind journals failed: {e}")
+            with self._lock:
+                if len(self._pending) < self.max_records:
+                    self._wakeup.wait(timeout=self.interval)
+                if not self._pending:
+                    continue
+                batch, self._pending = self._pending, []
+                # Later submissions go to a fresh segment; the old one is deleted once committed
+                old_segment, old_path = self._segment, self._segment_path
+                self._segment, self._segment_path = self._open_segment()
+            old_segment.close()
+            try:
+                self._write_batch(batch)
+                os.remove(old_path)
+            except Exception as e:
+                # The segment stays on disk and is replayed on a later pass
+                print(f"Write-behind flush of {len(batch)} submissions failed: {e}")
+                needs_replay = True
+                with self._stats_lock:
+                    self._stats['failed_flushes'] += 1
+
+    def _write_batch(self, batch):
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                apply_submissions(batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats['flushed'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['flush_seconds'].append(elapsed)
+
+    def replay_orphans(self):
+        """Writes any journal segments left behind by dead processes; returns the submissions replayed."""
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, 'journal-*.log'))):
+            if path == self._segment_path:
+                continue
+            try:
+                segment = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with segment:
+                try:
+                    fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue # A live process still owns it
+                batch = []
+                for line in segment:
+                    try:
+                        batch.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass # A torn final line: that submission was never acknowledged
+                if batch:
+                    self._write_batch(batch)
+                os.remove(path)
+                replayed += len(batch)
+        return replayed
+
+    # --- Reporting ---
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'accepted': 0, 'ack_seconds': 0.0, 'flushed': 0, 'flushes': 0,
+                           'failed_flushes': 0, 'flush_seconds': deque(maxlen=500), 'since': time.time()}
+
+    def stats(self):
+        """Submission throughput, acknowledgement time and flush latency for this process."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._stats['flush_seconds'])
+        with self._lock:
+            queued = len(self._pending)
+        elapsed = max(time.time() - stats['since'], 1e-9)
+
+        def percentile(p):
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1) if latencies else None
+
+        return {
+            'enabled': getattr(self, 'enabled', False),
+            'queued': queued,
+            'accepted': stats['accepted'],
+            'accepted_per_second': round(stats['accepted'] / elapsed, 2),
+            'mean_ack_ms': round(stats['ack_seconds'] * 1000 / stats['accepted'], 2) if stats['accepted'] else None,
+            'flushed': stats['flushed'],
+            'flushes': stats['flushes'],
+            'failed_flushes': stats['failed_flushes'],
+            'mean_batch': round(stats['flushed'] / stats['flushes'], 1) if stats['flushes'] else None,
+            'flush_p50_ms': percentile(0.5),
+            'flush_p95_ms': percentile(0.95),
+        }
+
+
+def apply_submissions(batch):
+    """
+    Writes a batch of queued submissions in the current transaction, per RESPONSE_POLICY.
+
+    Existing responses for the batch's (activity, responder) pairs are found with one set-based
+    query; new ones are written with a single multi-row INSERT, and tallies and leaderboards are adjusted for both.
+    """
+    activity_ids = {record['activity_id'] for record in batch}
+    activities = {activity.id: activity for activity in Activity.query.filter(Activity.id.in_(activity_ids))}
+    contents = {activity_id: activity_cache.get(activity).content for activity_id, activity in activities.items()}
+
+    latest = {}
+    for record in batch:
+        activity = activities.get(record['activity_id'])
+        pair = (record['activity_id'], record['responder_id'])
+        if activity is None or (pair in latest and response_policy(activity.type) == FIRST_ANSWER_WINS):
+            continue
+        latest[pair] = record
+
+    responder_ids = {responder_id for _, responder_id in latest}
+    existing = {}
+    for response in Response.query.filter(Response.activity_id.in_(activity_ids),
+                                          Response.responder_id.in_(responder_ids)):
+        if (response.activity_id, response.responder_id) in latest:
+            existing[(response.activity_id, response.responder_id)] = response
+
+    new_rows = {}
+    deltas = {}
+    grades = {}
+    for pair, record in latest.items():
+        activity = activities[pair[0]]
+        submitted_at = datetime.fromisoformat(record['submitted_at'])
+        response = existing.get(pair)
+        if response is not None:
+            if response_policy(activity.type) == FIRST_ANSWER_WINS:
+                continue
+            if response.submitted_at and response.submitted_at > submitted_at:
+                continue # A replayed submission older than the stored answer
+            try:
+                previous_data = json.loads(response.response_data)
+            except json.JSONDecodeError:
+                previous_data = {}
+            add_grade_deltas(grades, activity.course_id, pair[1], response.score, response.submitted_at, sign=-1)
+            response.response_data = json.dumps(record['response_data'])
+            response.submitted_at = submitted_at
+            for column, value in response_columns(activity.type, contents[activity.id], record['response_data']).items():
+                setattr(response, column, value)
+            add_response_deltas(deltas, activity, contents[activity.id], record['response_data'], previous_data)
+            if response.group_id is not None:
+                # A changed answer leaves its group, to be regrouped with the other new answers
+                add_group_delta(deltas, activity.id, response.group_id, -1)
+                response.group_id = None
+            add_grade_deltas(grades, activity.course_id, pair[1], response.score, submitted_at)
+        else:
+            new_rows[pair] = {'activity_id': pair[0], 'responder_id': pair[1],
+                              'response_data': json.dumps(record['response_data']), 'submitted_at': submitted_at,
+                              **response_columns(activity.type, contents[activity.id], record['response_data'])}
+    if new_rows:
+        # Rows written since the lookup above (e.g. by another worker) win under the unique index,
+        # so only the rows actually inserted are counted
+        stmt = sqlite_insert(Response).values(list(new_rows.values())).\
+            on_conflict_do_nothing(index_elements=['activity_id', 'responder_id'])
+        for pair in db.session.execute(stmt.returning(Response.activity_id, Response.responder_id)):
+            activity = activities[pair[0]]
+            row = new_rows[tuple(pair)]
+            add_response_deltas(deltas, activity, contents[activity.id], latest[tuple(pair)]['response_data'])
+            add_grade_deltas(grades, activity.course_id, pair[1], row['score'], row['submitted_at'])
+    apply_deltas(deltas)
+    apply_grade_deltas(grades)
+
+
+ingestor = WriteBehindIngestor()
+
+
+@click.command('ingest-replay')
+@with_appcontext
+def ingest_replay_command():
+    """Write journaled submissions left behind by stopped workers."""
+    from flask import current_app
+    os.makedirs(current_app.config['INGEST_JOURNAL_DIR'], exist_ok=True)
+    replayed = ingestor.replay_orphans()
+    click.echo(f'Replayed {replayed} queued submissions.')
@@ -0,0 +1,236 @@
+import json
+from datetime import datetime
+from functools import lru_cache
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import db, User, Activity, Response, LeaderboardScore, LeaderboardBucket
+
+GLOBAL = 0 # course_id of the all-courses leaderboard
+ALL_TIME = 'all'
+# Above this many changed users, a board is updated set-based and its score histogram recounted
+BULK_BOARD_USERS = 1000
+
+
+def period_keys(submitted_at, term_start_months=None):
+    """
+    Returns the leaderboard periods an answer submitted at a given time counts towards.
+
+    Args:
+        submitted_at (datetime): When the answer was submitted.
+        term_start_months (tuple): Months in which terms start; LEADERBOARD_TERM_START_MONTHS by default.
+
+    Returns:
+        list: 'all', the ISO week ('week:2026-W42'; 2027-01-01 is in 'week:2026-W53') and the term ('term:2026-09').
+    """
+    if term_start_months is None:
+        term_start_months = current_app.config['LEADERBOARD_TERM_START_MONTHS']
+    return _day_period_keys((submitted_at or datetime.utcnow()).date(), tuple(term_start_months))
+
+
+@lru_cache(maxsize=1024)
+def _day_period_keys(day, term_start_months):
+    # Periods only depend on the day, and bulk jobs see the same few days over and over
+    started = [month for month in sorted(term_start_months) if month <= day.month]
+    if started:
+        term = f'term:{day.year}-{started[-1]:02d}'
+    else:
+        term = f'term:{day.year - 1}-{max(term_start_months):02d}'
+    # The ISO year and week, so a week spanning New Year keeps one key
+    iso_year, iso_week, _ = day.isocalendar()
+    return [ALL_TIME, f'week:{iso_year}-W{iso_week:02d}', term]
+
+
+def current_periods():
+    """The period keys of right now, as {'all': ..., 'week': ..., 'term': ...}."""
+    all_time, week, term = period_keys(datetime.utcnow())
+    return {'all': all_time, 'week': week, 'term': term}
+
+
+def add_grade_deltas(deltas, course_id, user_id, points, submitted_at, sign=1):
+    """
+    Accumulates the standing changes of one graded quiz response (sign=-1 to take one back) into deltas.
+
+    Each response counts on its course's board and the global board, for every period it falls in.
+    points is the response's score (its number of correct questions); ungraded responses (None) do not count.
+    """
+    if points is None:
+        return deltas
+    points = int(round(points))
+    for board in (course_id, GLOBAL):
+        for period in period_keys(submitted_at):
+            score, answered = deltas.get((board, period, user_id), (0, 0))
+            deltas[(board, period, user_id)] = (score + sign * points, answered + sign)
+    return deltas
+
+
+def apply_grade_deltas(deltas):
+    """
+    Applies accumulated {(course_id, period, user_id): (score delta, answered delta)} in the current transaction.
+
+    A board with few changed users (a submission) has their standings read and written back,
+    moving each user between score buckets. A board with many (a regrade) gets one
+    INSERT ... SELECT upsert per distinct delta and has its buckets recounted in SQL.
+    Callers have already written in this transaction, so they hold SQLite's write lock and
+    the read-modify-write cannot race.
+    """
+    boards = {}
+    for (course_id, period, user_id), change in deltas.items():
+        if change != (0, 0):
+            boards.setdefault((course_id, period), {})[user_id] = change
+    scores = []
+    buckets = {}
+    for (course_id, period), changes in boards.items():
+        if len(changes) > BULK_BOARD_USERS:
+            _shift_board(course_id, period, changes)
+            continue
+        current = db.session.query(LeaderboardScore.user_id, LeaderboardScore.score, LeaderboardScore.answered).\
+            filter(LeaderboardScore.course_id == course_id, LeaderboardScore.period == period,
+                   LeaderboardScore.user_id.in_(list(changes)))
+        current = {user_id: (score, answered) for user_id, score, answered in current}
+        for user_id, (score_delta, answered_delta) in changes.items():
+            old_score, old_answered = current.get(user_id, (0, 0))
+            new_score, new_answered = old_score + score_delta, old_answered + answered_delta
+            scores.append({'course_id': course_id, 'period': period, 'user_id': user_id,
+                           'score': new_score, 'answered': new_answered})
+            # Users with no graded answers left are off the board
+            if old_answered > 0:
+                buckets[(course_id, period, old_score)] = buckets.get((course_id, period, old_score), 0) - 1
+            if new_answered > 0:
+                buckets[(course_id, period, new_score)] = buckets.get((course_id, period, new_score), 0) + 1
+
+    if scores:
+        # Core statements on the tables: executemany without the ORM's per-row bulk bookkeeping
+        stmt = sqlite_insert(LeaderboardScore.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['course_id', 'period', 'user_id'],
+            set_={'score': stmt.excluded.score, 'answered': stmt.excluded.answered}
+        )
+        db.session.execute(stmt, scores)
+    rows = [{'course_id': course_id, 'period': period, 'score': score, 'users': change}
+            for (course_id, period, score), change in buckets.items() if change]
+    if rows:
+        stmt = sqlite_insert(LeaderboardBucket.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['course_id', 'period', 'score'],
+            set_={'users': LeaderboardBucket.__table__.c.users + stmt.excluded.users}
+        )
+        db.session.execute(stmt, rows)
+
+
+def _shift_board(course_id, period, changes):
+    by_delta = {}
+    for user_id, change in changes.items():
+        by_delta.setdefault(change, []).append(user_id)
+    user_id = db.column('value', db.Integer)
+    for (score_delta, answered_delta), user_ids in by_delta.items():
+        # The user ids travel as one JSON parameter, expanded by json_each; the WHERE keeps
+        # SQLite from reading ON CONFLICT as a join constraint
+        changed_users = db.select(db.literal(course_id), db.literal(period), user_id,
+                                  db.literal(score_delta), db.literal(answered_delta)).\
+            select_from(db.func.json_each(json.dumps(user_ids))).where(db.true())
+        stmt = sqlite_insert(LeaderboardScore).\
+            from_select(['course_id', 'period', 'user_id', 'score', 'answered'], changed_users)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['course_id', 'period', 'user_id'],
+            set_={'score': LeaderboardScore.score + stmt.excluded.score,
+                  'answered': LeaderboardScore.answered + stmt.excluded.answered}
+        )
+        db.session.execute(stmt)
+
+    LeaderboardBucket.query.filter_by(course_id=course_id, period=period).delete(synchronize_session=False)
+    histogram = db.select(LeaderboardScore.course_id, LeaderboardScore.period, LeaderboardScore.score, db.func.count()).\
+        where(LeaderboardScore.course_id == course_id, LeaderboardScore.period == period,
+              LeaderboardScore.answered > 0).\
+        group_by(LeaderboardScore.score)
+    db.session.execute(db.insert(LeaderboardBucket).from_select(['course_id', 'period', 'score', 'users'], histogram))
+
+
+def top(session, course_id, period, limit=20):
+    """
+    Returns the first `limit` standings of a board, best first, with competition ranks (1, 2, 2, 4).
+
+    Reads one range of ix_leaderboard_rank, however many students the board has.
+
+    Returns:
+        list: dicts with rank, user_id, username, score and answered.
+    """
+    rows = session.query(LeaderboardScore.user_id, User.username, LeaderboardScore.score, LeaderboardScore.answered).\
+        join(User, User.id == LeaderboardScore.user_id).\
+        filter(LeaderboardScore.course_id == course_id, LeaderboardScore.period == period,
+               LeaderboardScore.answered > 0).\
+        order_by(LeaderboardScore.score.desc(), LeaderboardScore.user_id).limit(limit).all()
+    standings = []
+    for position, (user_id, username, score, answered) in enumerate(rows, 1):
+        rank = standings[-1]['rank'] if standings and standings[-1]['score'] == score else position
+        standings.append({'rank': rank, 'user_id': user_id, 'username': username, 'score': score, 'answered': answered})
+    return standings
+
+
+def standing(session, course_id, period, user_id):
+    """
+    Returns a user's place on a board: a primary-key lookup plus a sum over the distinct higher scores.
+
+    Returns:
+        dict: rank (None if the user has no graded answers in the period), score, answered and
+              players (the number of users on the board).
+    """
+    mine = session.query(LeaderboardScore.score, LeaderboardScore.answered).\
+        filter_by(course_id=course_id, period=period, user_id=user_id).first()
+    buckets = session.query(LeaderboardBucket.score, LeaderboardBucket.users).\
+        filter(LeaderboardBucket.course_id == course_id, LeaderboardBucket.period == period,
+               LeaderboardBucket.users > 0)
+    players = 0
+    above = 0
+    for score, users in buckets:
+        players += users
+        if mine is not None and score > mine[0]:
+            above += users
+    if mine is None or mine[1] == 0:
+        return {'rank': None, 'score': 0, 'answered': 0, 'players': players}
+    return {'rank': above + 1, 'score': mine[0], 'answered': mine[1], 'players': players}
+
+
+def rebuild_leaderboards(batch_size=5000):
+    """
+    Recomputes every leaderboard from the graded quiz responses in one pass (without committing).
+
+    Returns:
+        int: The number of graded responses counted.
+    """
+    LeaderboardScore.query.delete(synchronize_session=False)
+    LeaderboardBucket.query.delete(synchronize_session=False)
+
+    deltas = {}
+    counted = 0
+    graded = db.session.query(Activity.course_id, Response.responder_id, Response.score, Response.submitted_at).\
+        join(Activity, Activity.id == Response.activity_id).\
+        filter(Activity.type == 'quiz', Response.score.is_not(None)).\
+        execution_options(yield_per=batch_size)
+    for course_id, user_id, points, submitted_at in graded:
+        add_grade_deltas(deltas, course_id, user_id, points, submitted_at)
+        counted += 1
+
+    buckets = {}
+    for (course_id, period, _), (score, _) in deltas.items():
+        buckets[(course_id, period, score)] = buckets.get((course_id, period, score), 0) + 1
+    if deltas:
+        db.session.execute(db.insert(LeaderboardScore.__table__), [
+            {'course_id': course_id, 'period': period, 'user_id': user_id, 'score': score, 'answered': answered}
+            for (course_id, period, user_id), (score, answered) in deltas.items()])
+        db.session.execute(db.insert(LeaderboardBucket.__table__), [
+            {'course_id': course_id, 'period': period, 'score': score, 'users': users}
+            for (course_id, period, score), users in buckets.items()])
+    return counted
+
+
+@click.command('rebuild-leaderboards')
+@with_appcontext
+def rebuild_leaderboards_command():
+    """Recompute all leaderboards from the graded quiz responses."""
+    counted = rebuild_leaderboards()
+    db.session.commit()
+    click.echo(f'Rebuilt leaderboards from {counted} graded responses.')
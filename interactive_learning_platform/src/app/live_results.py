@@ -0,0 +1,224 @@
+import json
+import threading
+import time
+from collections import deque
+
+from app.models import db, Activity, Response, User
+from app.aggregates import read_results
+
+# How many recent short answers a feed keeps for viewers that fall behind
+ANSWER_BACKLOG = 500
+
+
+class StreamLimitError(Exception):
+    """Raised when an activity, or this process, already has the maximum number of live viewers."""
+
+
+def answers_after(activity_id, after_id, upto_id=None):
+    """
+    Returns an activity's text answers with an id above after_id (and up to upto_id), oldest first.
+
+    Only short answers and word clouds have answer text; poll and quiz responses show up in the
+    tallies alone. At most ANSWER_BACKLOG are returned, as dicts with 'id', 'responder' and 'answer'.
+    Call within an app context.
+    """
+    query = db.session.query(Response.id, User.username, Response.answer_text).\
+        join(User, Response.responder_id == User.id).\
+        filter(Response.activity_id == activity_id, Response.id > after_id, Response.answer_text.is_not(None))
+    if upto_id is not None:
+        query = query.filter(Response.id <= upto_id)
+    rows = query.order_by(Response.id).limit(ANSWER_BACKLOG).all()
+    return [{'id': response_id, 'responder': username, 'answer': answer} for response_id, username, answer in rows]
+
+
+class _ActivityFeed(object):
+    """
+    Polls one activity's tallies on a single background thread and publishes the latest state.
+
+    However many lecturers are watching, the activity costs one cheap tally read per interval
+    in this process, and viewers are woken at most once per interval, which coalesces bursts
+    of submissions into a single frame. Polling (rather than in-process notifications) also
+    picks up submissions handled by other gunicorn workers.
+    """
+
+    def __init__(self, app, activity_id, interval):
+        self.app = app
+        self.activity_id = activity_id
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.version = 0
+        self.results = None
+        self.answers = deque(maxlen=ANSWER_BACKLOG)
+        self.last_answer_id = None
+        self.first_answer_id = None # Where the feed started: answers up to here are not in self.answers
+        self.is_active = True
+        self.subscribers = 0
+        self.thread = threading.Thread(target=self._run, name=f'live-results-{activity_id}', daemon=True)
+
+    def _poll(self):
+        with self.app.app_context():
+            try:
+                is_active = db.session.query(Activity.is_active).filter(Activity.id == self.activity_id).scalar()
+                results = read_results(self.activity_id)
+                if self.last_answer_id is None:
+                    # Viewers fetch what came before this themselves (see stream_results)
+                    latest = db.session.query(db.func.max(Response.id)).\
+                        filter(Response.activity_id == self.activity_id).scalar()
+                    new_answers = []
+                    last_answer_id = latest or 0
+                else:
+                    new_answers = answers_after(self.activity_id, self.last_answer_id)
+                    last_answer_id = new_answers[-1]['id'] if new_answers else self.last_answer_id
+            finally:
+                db.session.remove()
+
+        return bool(is_active), results, new_answers, last_answer_id
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                is_active, results, new_answers, last_answer_id = self._poll()
+            except Exception as e:
+                print(f"Live results poll failed for activity {self.activity_id}: {e}")
+                is_active, results, new_answers, last_answer_id = self.is_active, self.results, [], self.last_answer_id
+
+            with self.cond:
+                changed = results != self.results or new_answers or is_active != self.is_active
+                if self.first_answer_id is None:
+                    self.first_answer_id = last_answer_id
+                self.last_answer_id = last_answer_id
+                if changed:
+                    self.results = results
+                    self.answers.extend(new_answers)
+                    self.is_active = is_active
+                    self.version += 1
+                    self.cond.notify_all()
+                if self.subscribers == 0 or not self.is_active:
+                    return
+            time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+
+class LiveResultsBroadcaster(object):
+    """
+    Hands out one shared _ActivityFeed per activity and tracks its viewers.
+
+    Each open stream holds a gunicorn thread for as long as it lasts, so the viewers of all
+    activities together are capped at LIVE_RESULTS_MAX_STREAMS_PER_PROCESS (well below the
+    thread count), leaving threads for submissions; viewers past the cap poll instead.
+    """
+
+    def __init__(self):
+        self._feeds = {}
+        self._streams = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, app, activity_id):
+        with self._lock:
+            if self._streams >= app.config['LIVE_RESULTS_MAX_STREAMS_PER_PROCESS']:
+                raise StreamLimitError('Too many live viewers in this process')
+            feed = self._feeds.get(activity_id)
+            if feed is None or not feed.thread.is_alive() and feed.version > 0:
+                feed = _ActivityFeed(app, activity_id, app.config['LIVE_RESULTS_INTERVAL'])
+                self._feeds[activity_id] = feed
+            with feed.cond:
+                if feed.subscribers >= app.config['LIVE_RESULTS_MAX_STREAMS']:
+                    raise StreamLimitError('Too many live viewers for this activity')
+                feed.subscribers += 1
+            self._streams += 1
+            if not feed.thread.is_alive():
+                feed.thread.start()
+            return feed
+
+    def unsubscribe(self, feed):
+        with self._lock:
+            self._streams -= 1
+            with feed.cond:
+                feed.subscribers -= 1
+                if feed.subscribers <= 0 and self._feeds.get(feed.activity_id) is feed:
+                    del self._feeds[feed.activity_id]
+
+
+broadcaster = LiveResultsBroadcaster()
+
+
+def _results_delta(previous, current):
+    """Returns only the counters in current that differ from previous (a nested dict)."""
+    if previous is None:
+        return current
+    delta = {}
+    for key, value in current.items():
+        if isinstance(value, dict):
+            changed = {k: v for k, v in value.items() if previous.get(key, {}).get(k) != v}
+            # Counters that dropped to zero disappear from the tallies
+            changed.update({k: 0 for k in previous.get(key, {}) if k not in value})
+            if changed:
+                delta[key] = changed
+        elif previous.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def _frame(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def stream_results(app, activity_id, since=None):
+    """
+    Yields Server-Sent Events for an activity's results until it stops or the client leaves.
+
+    The first 'snapshot' event carries the full tallies; each 'delta' event after that carries
+    only the counters that changed. Both carry the short answers newer than `since` (the newest
+    answer on the viewer's page) not sent yet. An 'end' event is sent once the activity is no
+    longer active.
+    """
+    feed = broadcaster.subscribe(app, activity_id)
+    heartbeat = app.config['LIVE_RESULTS_HEARTBEAT']
+    seen_version = 0
+    seen_results = None
+    answer_cursor = since
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            with feed.cond:
+                if feed.version == seen_version:
+                    feed.cond.wait(timeout=heartbeat)
+                version, results, is_active = feed.version, feed.results, feed.is_active
+                first_answer_id = feed.first_answer_id
+                if version == 0:
+                    new_answers = []
+                elif answer_cursor is None:
+                    # No cursor from the page: only answers from here on
+                    answer_cursor = feed.last_answer_id
+                    new_answers = []
+                else:
+                    new_answers = [answer for answer in feed.answers if answer['id'] > answer_cursor]
+
+            if version == seen_version:
+                yield ': keepalive\n\n'
+                continue
+
+            if answer_cursor is not None and first_answer_id is not None and answer_cursor < first_answer_id:
+                # Submitted after the page rendered but before the feed started: not in its backlog
+                with app.app_context():
+                    try:
+                        new_answers = answers_after(activity_id, answer_cursor, first_answer_id) + new_answers
+                    finally:
+                        db.session.remove()
+                answer_cursor = first_answer_id
+
+            if seen_results is None:
+                yield _frame('snapshot', {'results': results, 'is_active': is_active, 'new_answers': new_answers})
+            else:
+                delta = _results_delta(seen_results, results)
+                if delta or new_answers:
+                    yield _frame('delta', {'results': delta, 'new_answers': new_answers})
+            seen_version, seen_results = version, results
+            if new_answers:
+                answer_cursor = new_answers[-1]['id']
+
+            if not is_active:
+                yield _frame('end', {'is_active': False})
+                return
+    finally:
+        broadcaster.unsubscribe(feed)
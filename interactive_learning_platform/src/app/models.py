@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.password_hashing import hasher
 
 db = SQLAlchemy()
 
@@ -18,12 +18,17 @@ class User(db.Model):
     enrollments = db.relationship('Enrollment', backref='student', lazy='dynamic')
     activities_created = db.relationship('Activity', backref='creator', lazy='dynamic')
     responses = db.relationship('Response', backref='responder', lazy='dynamic')
+    genai_tasks = db.relationship('GenAITask', backref='user', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        # True when the stored hash predates the configured PASSWORD_HASH_METHOD
+        return hasher.needs_rehash(self.password_hash)
 
     # Flask-Login required properties and methods
     @property
@@ -80,6 +85,7 @@ class Activity(db.Model):
     content = db.Column(db.Text, nullable=False) # JSON string for question/options/settings
     is_active = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    content_version = db.Column(db.Integer, nullable=False, default=1, server_default='1') # Bumped on edit/toggle (see app/activity_cache.py)
 
     # Relationships
     responses = db.relationship('Response', backref='activity', lazy='dynamic')
@@ -94,14 +100,76 @@ class Response(db.Model):
     responder_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     response_data = db.Column(db.Text, nullable=False) # JSON string for the answer
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Typed copies of the answer, filled from response_data on write (see aggregates.response_columns)
+    selected_option = db.Column(db.String(255)) # Poll option or quiz answer
+    answer_text = db.Column(db.Text) # Short answer or word cloud text
+    score = db.Column(db.Float) # For quizzes
     
     # For Short Answer/GenAI grouping
     group_id = db.Column(db.Integer, index=True) # To group similar answers
     is_correct = db.Column(db.Boolean) # For quizzes
 
+    __table_args__ = (
+        # One answer per student per activity; submissions upsert against it (see app/submissions.py)
+        db.UniqueConstraint('activity_id', 'responder_id', name='_activity_responder_uc'),
+        db.Index('ix_response_activity_option', 'activity_id', 'selected_option'),
+        db.Index('ix_response_activity_correct', 'activity_id', 'is_correct'),
+        # Incremental grouping reads an activity's ungrouped answers (group_id IS NULL)
+        db.Index('ix_response_activity_group', 'activity_id', 'group_id'),
+    )
+
     def __repr__(self):
         return f'<Response Activity:{self.activity_id} Responder:{self.responder_id}>'
 
+# Labelled answer groups of a short-answer activity; Response.group_id holds the group's number
+# (see app/answer_grouping.py)
+class AnswerGroup(db.Model):
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity.id'), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnswerGroup Activity:{self.activity_id} {self.number}: {self.label}>'
+
+# Incrementally maintained result counters for an activity (see app/aggregates.py)
+class ActivityTally(db.Model):
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity.id'), primary_key=True)
+    metric = db.Column(db.String(20), primary_key=True) # 'responses', 'option', 'quiz', 'group'
+    key = db.Column(db.String(255), primary_key=True, default='') # option text, 'correct'/'incorrect', group id
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ActivityTally Activity:{self.activity_id} {self.metric}:{self.key}={self.count}>'
+
+# Leaderboard standings per course (course_id 0 = all courses) and period ('all', 'week:...', 'term:...')
+# Maintained incrementally as quiz answers are graded (see app/leaderboard.py)
+class LeaderboardScore(db.Model):
+    course_id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(20), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False, default=0) # Correct quiz questions (sum of Response.score)
+    answered = db.Column(db.Integer, nullable=False, default=0) # Graded quiz responses
+
+    __table_args__ = (
+        # Top-k is a range scan of this index
+        db.Index('ix_leaderboard_rank', 'course_id', 'period', db.text('score DESC'), 'user_id'),
+    )
+
+    def __repr__(self):
+        return f'<LeaderboardScore {self.course_id}/{self.period} User:{self.user_id}={self.score}>'
+
+# How many users hold each score on a leaderboard; a rank is 1 + the users on higher scores
+class LeaderboardBucket(db.Model):
+    course_id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(20), primary_key=True)
+    score = db.Column(db.Integer, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<LeaderboardBucket {self.course_id}/{self.period} {self.score}: {self.users}>'
+
 # GenAI Task Log
 class GenAITask(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -111,8 +179,50 @@ class GenAITask(db.Model):
     output_data = db.Column(db.Text)
     status = db.Column(db.String(20), default='pending') # 'pending', 'processing', 'completed', 'failed'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime) # When a worker claimed it (its lease starts here)
     completed_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Times a worker has claimed it
+    error = db.Column(db.Text)
+    cache_hit = db.Column(db.Boolean) # Whether the output came from GenAICacheEntry rather than the model
+    answers_sent = db.Column(db.Integer) # Answer grouping: distinct answers sent to the model (duplicates collapsed)
+    tokens_saved = db.Column(db.Integer) # Estimated prompt tokens the duplicates would have cost
+    seconds_saved = db.Column(db.Float) # Estimated model time those tokens would have cost
+    # Per-task usage, recorded when a worker finishes it (see GenAIJobQueue.usage_report)
+    model = db.Column(db.String(100)) # GENAI_MODEL, or 'stub'
+    queue_seconds = db.Column(db.Float) # From created_at until a worker last claimed it
+    latency_seconds = db.Column(db.Float) # Time in model calls, retries included (0 if all were cached)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    cost_usd = db.Column(db.Float) # Estimated from GENAI_PRICING; None for an unpriced model
+    retries = db.Column(db.Integer) # Transient failures retried by genai_client
+
+    __table_args__ = (
+        # Workers claim the oldest pending task, and sweep expired 'processing' leases
+        db.Index('ix_genai_task_status', 'status', 'id'),
+        # The usage report scans a recent window of tasks
+        db.Index('ix_genai_task_created', 'created_at'),
+    )
 
     def __repr__(self):
         return f'<GenAITask {self.task_type} Status:{self.status}>'
 
+# GenAI outputs keyed by a hash of (provider, model, task type, prompt and schema, normalized input)
+# (see app/genai_cache.py)
+class GenAICacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True) # sha256 hex
+    task_type = db.Column(db.String(50), nullable=False)
+    output_data = db.Column(db.Text, nullable=False)
+    size = db.Column(db.Integer, nullable=False) # Bytes of output_data, for the size bound
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Eviction drops the least recently used entries first
+        db.Index('ix_genai_cache_last_used', 'last_used_at'),
+    )
+
+    def __repr__(self):
+        return f'<GenAICacheEntry {self.task_type} {self.key[:12]}>'
+
@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusyError(Exception):
+    """Raised when too many hash/verify jobs are already queued."""
+
+
+class PasswordHasher(object):
+    """
+    Runs password hashing and verification in a bounded worker pool.
+
+    hashlib's scrypt and PBKDF2 release the GIL, so a small thread pool hashes in parallel
+    while capping how much CPU a login burst can take. Callers beyond the pool size plus
+    PASSWORD_HASH_MAX_QUEUE are rejected with HashingBusyError instead of piling up.
+    """
+
+    def __init__(self, app=None):
+        self.method = 'scrypt'
+        self.hash_prefix = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        # The "method" part of a hash (e.g. 'scrypt:32768:8:1') with werkzeug's defaults filled in
+        self.hash_prefix = generate_password_hash('', method=self.method).split('$', 1)[0]
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_MAX_QUEUE'])
+
+    def _run(self, kind, func, *args):
+        if self._executor is None:
+            # Not bound to an app (e.g. a one-off script): hash inline
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingBusyError('Password hashing queue is full')
+        queued_at = time.perf_counter()
+        try:
+            return self._executor.submit(self._timed, kind, queued_at, func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _timed(self, kind, queued_at, func, *args):
+        started_at = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                stats = self._stats[kind]
+                stats['count'] += 1
+                stats['busy_seconds'] += finished_at - started_at
+                stats['wait_seconds'] += started_at - queued_at
+
+    def hash(self, password):
+        """Returns a new hash of password using the configured method and cost."""
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Checks password against a stored hash (any method werkzeug understands)."""
+        return self._run('verify', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with a different method or cost than the configured one."""
+        return self.hash_prefix is not None and pwhash.split('$', 1)[0] != self.hash_prefix
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {
+                'hash': {'count': 0, 'busy_seconds': 0.0, 'wait_seconds': 0.0},
+                'verify': {'count': 0, 'busy_seconds': 0.0, 'wait_seconds': 0.0},
+                'rejected': 0,
+                'since': time.time(),
+            }
+
+    def stats(self):
+        """
+        Returns throughput figures for sizing the pool.
+
+        Returns:
+            dict: Per operation ('hash', 'verify'): count, per-second rate since the last reset,
+                  mean hashing time and mean queue wait (ms); plus 'rejected' and the pool settings.
+        """
+        with self._lock:
+            snapshot = {kind: dict(values) for kind, values in self._stats.items() if isinstance(values, dict)}
+            rejected = self._stats['rejected']
+            elapsed = max(time.time() - self._stats['since'], 1e-9)
+        report = {'method': self.hash_prefix or self.method, 'rejected': rejected,
+                  'workers': self._executor._max_workers if self._executor else 0}
+        for kind, values in snapshot.items():
+            count = values['count']
+            report[kind] = {
+                'count': count,
+                'per_second': round(count / elapsed, 2),
+                'mean_ms': round(values['busy_seconds'] * 1000 / count, 1) if count else None,
+                'mean_wait_ms': round(values['wait_seconds'] * 1000 / count, 1) if count else None,
+            }
+        return report
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,47 @@
+import json
+
+from app.models import User, Response
+
+# Columns the report shows per response; nothing else is loaded
+REPORT_COLUMNS = (Response.id, User.username, Response.response_data, Response.answer_text, Response.group_id)
+
+
+def _report_query(session, activity_id, after_id=None):
+    query = session.query(*REPORT_COLUMNS).join(User, User.id == Response.responder_id).\
+        filter(Response.activity_id == activity_id)
+    if after_id is not None:
+        query = query.filter(Response.id > after_id)
+    return query.order_by(Response.id)
+
+
+def _report_row(response_id, username, raw_data, answer_text, group_id):
+    try:
+        data = json.loads(raw_data)
+    except (TypeError, json.JSONDecodeError):
+        data = {'answer': 'Invalid data'}
+    return {'id': response_id, 'responder': username, 'data': data, 'answer': answer_text, 'group_id': group_id}
+
+
+def report_page(session, activity_id, after_id=None, page_size=200):
+    """
+    Returns one keyset-paginated page of an activity's responses.
+
+    Args:
+        session: The session to query with (the read-only report session).
+        activity_id (int): The activity reported on.
+        after_id (int): The last response id of the previous page; None for the first page.
+        page_size (int): Responses per page.
+
+    Returns:
+        tuple: (rows, next_after_id), where next_after_id is None on the last page.
+    """
+    rows = _report_query(session, activity_id, after_id).limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = [_report_row(*row) for row in rows[:page_size]]
+    return rows, rows[-1]['id'] if has_more else None
+
+
+def iter_report_rows(session, activity_id, batch_size=500):
+    """Yields every response of an activity as a report row, fetching batch_size rows at a time."""
+    for row in _report_query(session, activity_id).execution_options(yield_per=batch_size):
+        yield _report_row(*row)
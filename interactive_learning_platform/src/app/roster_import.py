@@ -0,0 +1,207 @@
+import csv
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+from app.models import db, User, Enrollment
+
+# SQLite limits the number of bound parameters per statement, so IN (...) lookups are chunked
+IN_CLAUSE_CHUNK = 500
+
+_hash_pool = None
+
+
+def _get_hash_pool():
+    """Returns the process pool used to hash the passwords of imported users (created lazily)."""
+    global _hash_pool
+    if _hash_pool is None:
+        # 'spawn' keeps the children free of the parent's DB connections and threads
+        _hash_pool = ProcessPoolExecutor(
+            max_workers=current_app.config['ROSTER_IMPORT_HASH_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _hash_pool
+
+
+def _chunks(items, size=IN_CLAUSE_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_roster(stream, content_type):
+    """
+    Lazily parses an uploaded roster into student dicts.
+
+    Args:
+        stream: A binary file-like object (the request body or an uploaded file).
+        content_type (str): The MIME type of the upload. 'text/csv' is read with a header row,
+            'application/x-ndjson' / 'application/jsonl' as one JSON object per line, and
+            anything else as a single JSON list.
+
+    Yields:
+        dict: One entry per roster row, or None for a row that could not be parsed.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        for row in csv.DictReader(text):
+            yield {key.strip(): (value or '').strip() for key, value in row.items() if key}
+    elif content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        text = io.TextIOWrapper(stream, encoding='utf-8')
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+    else:
+        data = json.load(stream)
+        if not isinstance(data, list):
+            raise ValueError('Expected a list of students.')
+        for item in data:
+            yield item
+
+
+def import_roster(course_id, rows, default_password='password123'):
+    """
+    Enrolls a roster into a course with set-based lookups and a single transaction.
+
+    Existing users and enrollments are resolved with a few IN queries per batch, the
+    passwords of new users are hashed in a process pool, and users and enrollments are
+    written with bulk inserts. Nothing is committed if any batch fails.
+
+    Args:
+        course_id (int): The course to enroll the students into.
+        rows (iterable): Student dicts with 'username' and 'student_id' (and optionally
+            'email' and 'password'), e.g. the output of parse_roster().
+        default_password (str): The password for new users whose row has none.
+
+    Returns:
+        list: One result dict per input row: {'row', 'student_id', 'status', 'error'}, where
+              status is 'created', 'enrolled', 'already_enrolled', 'duplicate', 'conflict' or 'invalid'.
+    """
+    batch_size = current_app.config['ROSTER_IMPORT_BATCH_SIZE']
+    results = []
+    seen_student_ids = set()
+    seen_usernames = set()
+    batch = []
+
+    try:
+        for row_number, row in enumerate(rows, start=1):
+            result = {'row': row_number, 'student_id': None, 'status': None, 'error': None}
+            results.append(result)
+
+            if not isinstance(row, dict):
+                result.update(status='invalid', error='Row could not be parsed')
+                continue
+            student_id_val = str(row.get('student_id') or '').strip()
+            username = str(row.get('username') or '').strip()
+            result['student_id'] = student_id_val or None
+            if not student_id_val or not username:
+                result.update(status='invalid', error='Missing username or student_id')
+                continue
+            if student_id_val in seen_student_ids:
+                result.update(status='duplicate', error='student_id appears earlier in the roster')
+                continue
+            seen_student_ids.add(student_id_val)
+
+            batch.append((result, {
+                'username': username,
+                'student_id': student_id_val,
+                'email': str(row.get('email') or '').strip() or None,
+                'password': row.get('password') or default_password,
+            }))
+            if len(batch) >= batch_size:
+                _import_batch(course_id, batch, seen_usernames)
+                batch = []
+
+        if batch:
+            _import_batch(course_id, batch, seen_usernames)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return results
+
+
+def _import_batch(course_id, batch, seen_usernames):
+    """Resolves, hashes and bulk-inserts one batch of validated roster rows (without committing)."""
+    student_ids = [entry['student_id'] for _, entry in batch]
+
+    # 1. Existing users, by student_id
+    existing = {}
+    for chunk in _chunks(student_ids):
+        for user_id, student_id_val, role in db.session.query(User.id, User.student_id, User.role).\
+                filter(User.student_id.in_(chunk)):
+            existing[student_id_val] = (user_id, role)
+
+    # 2. Usernames and emails that new users would collide with
+    new_entries = [(result, entry) for result, entry in batch if entry['student_id'] not in existing]
+    taken_usernames = set()
+    for chunk in _chunks(entry['username'] for _, entry in new_entries):
+        taken_usernames.update(name for (name,) in db.session.query(User.username).filter(User.username.in_(chunk)))
+    taken_emails = set()
+    for chunk in _chunks(entry['email'] for _, entry in new_entries if entry['email']):
+        taken_emails.update(email for (email,) in db.session.query(User.email).filter(User.email.in_(chunk)))
+
+    to_create = []
+    for result, entry in new_entries:
+        if entry['username'] in taken_usernames or entry['username'] in seen_usernames:
+            result.update(status='conflict', error='Username already taken by another user')
+        elif entry['email'] and entry['email'] in taken_emails:
+            result.update(status='conflict', error='Email already taken by another user')
+        else:
+            seen_usernames.add(entry['username'])
+            if entry['email']:
+                taken_emails.add(entry['email'])
+            to_create.append((result, entry))
+
+    for result, entry in batch:
+        if entry['student_id'] in existing and existing[entry['student_id']][1] != 'student':
+            result.update(status='conflict', error='student_id belongs to a non-student account')
+
+    # 3. Hash the new passwords in parallel and bulk insert the users
+    if to_create:
+        passwords = [entry['password'] for _, entry in to_create]
+        hash_password = partial(generate_password_hash, method=current_app.config['PASSWORD_HASH_METHOD'])
+        if len(passwords) < current_app.config['ROSTER_IMPORT_POOL_THRESHOLD']:
+            hashes = [hash_password(password) for password in passwords]
+        else:
+            hashes = list(_get_hash_pool().map(hash_password, passwords, chunksize=16))
+        db.session.execute(db.insert(User), [
+            {'username': entry['username'], 'student_id': entry['student_id'], 'email': entry['email'],
+             'role': 'student', 'password_hash': password_hash}
+            for (_, entry), password_hash in zip(to_create, hashes)
+        ])
+        for chunk in _chunks(entry['student_id'] for _, entry in to_create):
+            for user_id, student_id_val in db.session.query(User.id, User.student_id).filter(User.student_id.in_(chunk)):
+                existing[student_id_val] = (user_id, 'student')
+        for result, _ in to_create:
+            result['status'] = 'created'
+
+    # 4. Existing enrollments, then bulk insert the missing ones
+    enrollable = [(result, existing[entry['student_id']][0]) for result, entry in batch
+                  if result['status'] in (None, 'created')]
+    enrolled = set()
+    for chunk in _chunks(user_id for _, user_id in enrollable):
+        enrolled.update(student_id for (student_id,) in db.session.query(Enrollment.student_id).
+                        filter(Enrollment.course_id == course_id, Enrollment.student_id.in_(chunk)))
+
+    new_enrollments = []
+    for result, user_id in enrollable:
+        if user_id in enrolled:
+            result['status'] = 'already_enrolled'
+        else:
+            new_enrollments.append({'course_id': course_id, 'student_id': user_id})
+            if result['status'] is None:
+                result['status'] = 'enrolled'
+    if new_enrollments:
+        db.session.execute(db.insert(Enrollment), new_enrollments)
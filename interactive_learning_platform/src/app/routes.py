@@ -1,11 +1,29 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, stream_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Response as HTTPResponse
 import json
-from datetime import datetime
 from flask_login import current_user, login_user, logout_user, login_required
 from app import db
-from app.models import User, Course, Enrollment, Activity, Response, GenAITask
+from app.models import User, Course, Enrollment, Activity, Response, GenAITask, AnswerGroup
 from urllib.parse import urlparse
-from app.genai_utils import generate_activity_draft, group_short_answers
+from app.genai_jobs import genai_jobs
+from app.genai_cache import genai_cache
+from app.genai_client import genai_client
+from app.roster_import import parse_roster, import_roster
+from app.password_hashing import hasher, HashingBusyError
+from app.identity_cache import user_cache
+from app.aggregates import read_results
+from app.submissions import save_response
+from app.dashboards import lecturer_course_summaries, student_enrollments
+from app.activity_cache import activity_cache
+from app.reports import report_page, iter_report_rows
+from app.exports import activity_export_rows, course_export_rows, EXPORT_FORMATS
+from app.leaderboard import top, standing, current_periods, GLOBAL
+from app.grading import set_answer_keys, regrade_activity
+from app.live_results import stream_results, answers_after, StreamLimitError
+from app.gateway import make_subscribe_token, publish_activity_event
+from app.ingest import ingestor
+from app.sqlite_profile import sqlite_profile
+from sqlalchemy.orm import joinedload
 from functools import wraps
 
 main = Blueprint('main', __name__)
@@ -35,8 +53,17 @@ def login():
         remember = request.form.get('remember') == 'on'
         
         user = User.query.filter_by(username=username).first()
-        if user is None or not user.check_password(password):
-            flash('Invalid username or password', 'danger')
+        try:
+            if user is None or not user.check_password(password):
+                flash('Invalid username or password', 'danger')
+                return redirect(url_for('main.login'))
+
+            # Transparently upgrade hashes made with an older method or cost
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+        except HashingBusyError:
+            flash('The server is busy, please try again in a moment.', 'warning')
             return redirect(url_for('main.login'))
         
         login_user(user, remember=remember)
@@ -72,7 +99,11 @@ def register():
             return redirect(url_for('main.register'))
 
         user = User(username=username, email=email, role=role, student_id=student_id)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except HashingBusyError:
+            flash('The server is busy, please try again in a moment.', 'warning')
+            return redirect(url_for('main.register'))
         db.session.add(user)
         db.session.commit()
         flash('Congratulations, you are now a registered user! Please log in.', 'success')
@@ -89,8 +120,8 @@ def lecturer_dashboard():
     if current_user.role != 'lecturer':
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
-    # Fetch courses taught by the lecturer
-    courses = Course.query.filter_by(lecturer_id=current_user.id).all()
+    # Courses taught by the lecturer, with their enrollment and activity counts
+    courses = lecturer_course_summaries(current_user.id)
     return render_template('lecturer/dashboard.html', title='Lecturer Dashboard', courses=courses)
 
 @main.route('/student/dashboard')
@@ -99,8 +130,8 @@ def student_dashboard():
     if current_user.role != 'student':
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
-    # Fetch enrolled courses
-    enrollments = Enrollment.query.filter_by(student_id=current_user.id).all()
+    # Fetch enrolled courses (with each course's lecturer)
+    enrollments = student_enrollments(current_user.id)
     return render_template('student/dashboard.html', title='Student Dashboard', enrollments=enrollments)
 
 @main.route('/student/course/<int:course_id>/activities')
@@ -118,11 +149,17 @@ def student_course_activities(course_id):
     
     course = Course.query.get_or_404(course_id)
     activities = Activity.query.filter_by(course_id=course_id).order_by(Activity.created_at.desc()).all()
+
+    # Lets the page hear about activities starting/stopping from the notification gateway
+    gateway_url = current_app.config['GATEWAY_PUBLIC_URL']
+    gateway_token = make_subscribe_token(current_app.config['SECRET_KEY'], current_user.id, [course_id]) if gateway_url else None
     
     return render_template('student/course_activities.html', 
                          title=f'{course.code} - 课程活动', 
                          course=course, 
-                         activities=activities)
+                         activities=activities,
+                         gateway_url=gateway_url,
+                         gateway_token=gateway_token)
 
 @main.route('/student/activity/<int:activity_id>', methods=['GET', 'POST'])
 @login_required
@@ -139,87 +176,71 @@ def student_activity_detail(activity_id):
         flash('您没有权限访问此活动。', 'danger')
         return redirect(url_for('main.student_dashboard'))
     
-    # Parse the activity content (it's stored as JSON)
-    import json
-    try:
-        content_data = json.loads(activity.content)
-    except:
-        content_data = {}
+    # The activity content, parsed once per content version
+    content_data = activity_cache.get(activity).content
     
     # Handle POST request (form submission)
     if request.method == 'POST':
-        # Check if the student has already responded to this activity
-        existing_response = Response.query.filter_by(
-            activity_id=activity_id, 
-            responder_id=current_user.id
-        ).first()
+        # Process different types of responses
+        response_data = {}
         
-        if existing_response:
-            flash('您已经参与过此活动了。', 'warning')
-        else:
-            # Process different types of responses
-            response_data = {}
-            
-            if activity.type == 'poll':
-                # Handle poll response
-                selected_option = request.form.get('poll_option')
-                if selected_option:
-                    response_data = {
-                        'type': 'poll',
-                        'selected_option': selected_option,
-                        'timestamp': datetime.utcnow().isoformat()
-                    }
-                else:
-                    flash('请选择一个选项。', 'warning')
-                    return render_template('student/activity_detail.html', 
-                                         title=f'{activity.title}', 
-                                         activity=activity,
-                                         content_data=content_data)
-            
-            elif activity.type == 'word_cloud':
-                # Handle word cloud response
-                word_input = request.form.get('word_input')
-                if word_input:
-                    response_data = {
-                        'type': 'word_cloud',
-                        'words': word_input.strip(),
-                        'timestamp': datetime.utcnow().isoformat()
-                    }
-                else:
-                    flash('请输入词汇。', 'warning')
-                    return render_template('student/activity_detail.html', 
-                                         title=f'{activity.title}', 
-                                         activity=activity,
-                                         content_data=content_data)
-            
-            elif activity.type == 'short_answer':
-                # Handle short answer response
-                answer = request.form.get('answer')
-                if answer:
-                    response_data = {
-                        'type': 'short_answer',
-                        'answer': answer.strip(),
-                        'timestamp': datetime.utcnow().isoformat()
-                    }
-                else:
-                    flash('请输入答案。', 'warning')
-                    return render_template('student/activity_detail.html', 
-                                         title=f'{activity.title}', 
-                                         activity=activity,
-                                         content_data=content_data)
+        if activity.type == 'poll':
+            # Handle poll response
+            selected_option = request.form.get('poll_option')
+            if selected_option:
+                response_data = {
+                    'type': 'poll',
+                    'selected_option': selected_option
+                }
+            else:
+                flash('请选择一个选项。', 'warning')
+                return render_template('student/activity_detail.html', 
+                                     title=f'{activity.title}', 
+                                     activity=activity,
+                                     content_data=content_data)
+        
+        elif activity.type == 'word_cloud':
+            # Handle word cloud response
+            word_input = request.form.get('word_input')
+            if word_input:
+                response_data = {
+                    'type': 'word_cloud',
+                    'words': word_input.strip()
+                }
+            else:
+                flash('请输入词汇。', 'warning')
+                return render_template('student/activity_detail.html', 
+                                     title=f'{activity.title}', 
+                                     activity=activity,
+                                     content_data=content_data)
+        
+        elif activity.type == 'short_answer':
+            # Handle short answer response
+            answer = request.form.get('answer')
+            if answer:
+                response_data = {
+                    'type': 'short_answer',
+                    'answer': answer.strip()
+                }
+            else:
+                flash('请输入答案。', 'warning')
+                return render_template('student/activity_detail.html', 
+                                     title=f'{activity.title}', 
+                                     activity=activity,
+                                     content_data=content_data)
+        
+        # Save the response to database
+        if response_data:
+            status = save_response(activity, current_user.id, response_data, content_data)
+            db.session.commit()
             
-            # Save the response to database
-            if response_data:
-                new_response = Response(
-                    activity_id=activity_id,
-                    responder_id=current_user.id,
-                    response_data=json.dumps(response_data)
-                )
-                db.session.add(new_response)
-                db.session.commit()
-                
+            if status == 'kept':
+                flash('您已经参与过此活动了。', 'warning')
+            elif status == 'updated':
+                flash('您的回答已更新！', 'success')
+            else:
                 flash('您的回答已成功提交！', 'success')
-                return redirect(url_for('main.student_activity_detail', activity_id=activity_id))
+            return redirect(url_for('main.student_activity_detail', activity_id=activity_id))
     
     # Check if the student has already responded
     user_response = Response.query.filter_by(
@@ -247,7 +268,11 @@ def admin_dashboard():
     if current_user.role != 'admin':
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
-    return render_template('admin/dashboard.html', title='Admin Dashboard')
+    return render_template('admin/dashboard.html', title='Admin Dashboard',
+                           hashing_stats=hasher.stats(), identity_cache_stats=user_cache.stats(),
+                           ingest_stats=ingestor.stats(), activity_cache_stats=activity_cache.stats(),
+                           genai_job_stats=genai_jobs.stats(), genai_client_stats=genai_client.stats(),
+                           sqlite_settings=sqlite_profile.current_settings())
 
 # --- Course Management Routes ---
 
@@ -293,29 +318,41 @@ def genai_generate_activity(course_id):
     if not topic_or_content:
         return jsonify({'error': 'Missing topic or content'}), 400
 
-    # Log the task
+    # Queue the task; a GenAI worker runs it and the page polls genai_task_status
     task = GenAITask(
         user_id=current_user.id,
         task_type='activity_generation',
-        input_data=json.dumps({'topic': topic_or_content, 'type': activity_type}),
+        input_data=json.dumps({'topic': topic_or_content, 'type': activity_type, 'refresh': bool(data.get('refresh'))}),
         status='pending'
     )
     db.session.add(task)
     db.session.commit()
+    genai_jobs.submit(task.id)
+    return genai_task_accepted(task)
 
-    # Call the GenAI utility
-    generated_content = generate_activity_draft(topic_or_content, activity_type)
 
-    if generated_content:
-        task.output_data = json.dumps(generated_content)
-        task.status = 'completed'
-        db.session.commit()
-        return jsonify({'success': True, 'content': generated_content}), 200
-    else:
-        task.status = 'failed'
-        db.session.commit()
-        return jsonify({'error': 'GenAI generation failed or not supported for this type yet.'}), 500
+def genai_task_accepted(task):
+    """The 202 reply for a queued GenAI task: its id and where to poll for the result."""
+    return jsonify({
+        'task_id': task.id,
+        'status': task.status,
+        'status_url': url_for('main.genai_task_status', task_id=task.id)
+    }), 202
+
 
+@main.route('/api/genai/tasks/<int:task_id>')
+@login_required
+def genai_task_status(task_id):
+    task = GenAITask.query.get_or_404(task_id)
+    if task.user_id != current_user.id and current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    status = {'task_id': task.id, 'task_type': task.task_type, 'status': task.status}
+    if task.status == 'completed':
+        status['result'] = json.loads(task.output_data) if task.output_data else None
+    elif task.status == 'failed':
+        status['error'] = task.error or 'GenAI task failed'
+    return jsonify(status), 200
 
 
 @main.route('/api/courses/<int:course_id>/students', methods=['POST'])
@@ -328,38 +365,29 @@ def import_students(course_id):
     if course.lecturer_id != current_user.id:
         return jsonify({'error': 'Unauthorized to manage this course'}), 403
 
-    # Expecting a JSON list of students: [{"username": "...", "student_id": "...", "email": "..."}]
-    data = request.get_json()
-    if not data or not isinstance(data, list):
-        return jsonify({'error': 'Invalid data format. Expected a list of students.'}), 400
-
-    imported_count = 0
-    for student_data in data:
-        student_id_val = student_data.get('student_id')
-        username = student_data.get('username')
-        email = student_data.get('email')
-        
-        if not student_id_val or not username:
-            continue # Skip invalid entries
-
-        # Find or create student user
-        student = User.query.filter_by(student_id=student_id_val, role='student').first()
-        if not student:
-            # Simple default password for imported students, they should change it on first login
-            student = User(username=username, student_id=student_id_val, email=email, role='student')
-            student.set_password('password123') # Placeholder password
-            db.session.add(student)
-            db.session.commit()
+    # Accepts a JSON list of students: [{"username": "...", "student_id": "...", "email": "..."}],
+    # or a streamed CSV (header row) / JSON-lines body, either raw or as an uploaded 'file'
+    upload = request.files.get('file')
+    if upload:
+        stream, content_type = upload.stream, upload.mimetype
+    else:
+        stream, content_type = request.stream, request.mimetype
 
-        # Enroll student
-        enrollment = Enrollment.query.filter_by(course_id=course_id, student_id=student.id).first()
-        if not enrollment:
-            enrollment = Enrollment(course_id=course_id, student_id=student.id)
-            db.session.add(enrollment)
-            imported_count += 1
+    try:
+        # Imported students get a simple default password; they should change it on first login
+        results = import_roster(course_id, parse_roster(stream, content_type))
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'error': 'Invalid data format. Expected a list of students.'}), 400
 
-    db.session.commit()
-    return jsonify({'message': f'Successfully imported and enrolled {imported_count} students.'}), 200
+    imported_count = sum(1 for result in results if result['status'] in ('created', 'enrolled'))
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return jsonify({
+        'message': f'Successfully imported and enrolled {imported_count} students.',
+        'summary': summary,
+        'results': results
+    }), 200
 
 # --- Activity Management Routes (Placeholder) ---
 
@@ -376,7 +404,8 @@ def manage_activities(course_id):
         return redirect(url_for('main.lecturer_dashboard'))
     
     activities = Activity.query.filter_by(course_id=course_id).order_by(Activity.created_at.desc()).all()
-    return render_template('lecturer/manage_activities.html', title=f'Manage Activities for {course.code}', course=course, activities=activities)
+    quizzes = {activity.id: activity_cache.get(activity) for activity in activities if activity.type == 'quiz'}
+    return render_template('lecturer/manage_activities.html', title=f'Manage Activities for {course.code}', course=course, activities=activities, quizzes=quizzes)
 
 @main.route('/lecturer/activity/create/<int:course_id>', methods=['GET', 'POST'])
 @login_required
@@ -396,14 +425,28 @@ def create_activity(course_id):
         activity_type = request.form.get('type')
         content_data = {}
 
-        if activity_type in ['poll', 'quiz']:
+        if activity_type == 'poll':
             options = request.form.get('options').split('\n')
             content_data = {
                 'question': request.form.get('question'),
                 'options': [opt.strip() for opt in options if opt.strip()],
             }
-            if activity_type == 'quiz':
-                content_data['correct_answer'] = request.form.get('correct_answer')
+        elif activity_type == 'quiz':
+            # One question block per 'question' field; several make a multi-question quiz
+            questions = []
+            for question, options, correct_answer in zip(request.form.getlist('question'),
+                                                         request.form.getlist('options'),
+                                                         request.form.getlist('correct_answer')):
+                if question.strip():
+                    questions.append({
+                        'question': question.strip(),
+                        'options': [opt.strip() for opt in options.split('\n') if opt.strip()],
+                        'correct_answer': correct_answer.strip() or None,
+                    })
+            if len(questions) == 1:
+                content_data = questions[0]
+            elif questions:
+                content_data = {'questions': questions}
         elif activity_type == 'word_cloud':
             content_data = {
                 'prompt': request.form.get('prompt')
@@ -455,6 +498,33 @@ def toggle_activity_status(activity_id, action):
         return jsonify({'error': 'Invalid action'}), 400
 
     db.session.commit()
+    publish_activity_event(current_app.config, activity, 'activity_started' if action == 'start' else 'activity_stopped')
+    return redirect(url_for('main.manage_activities', course_id=activity.course_id))
+
+@main.route('/lecturer/activity/<int:activity_id>/answer_key', methods=['POST'])
+@login_required
+def update_answer_key(activity_id):
+    if current_user.role != 'lecturer':
+        return jsonify({'error': 'Access denied'}), 403
+
+    activity = Activity.query.get_or_404(activity_id)
+    if activity.creator_id != current_user.id:
+        return jsonify({'error': 'Unauthorized to manage this activity'}), 403
+    if activity.type != 'quiz':
+        return jsonify({'error': 'Only quizzes have an answer key'}), 400
+
+    # One correct answer per question, in order
+    answer_keys = [answer.strip() for answer in request.form.getlist('correct_answer')]
+    if not answer_keys or not all(answer_keys):
+        flash('請選擇正確答案。', 'warning')
+        return redirect(url_for('main.manage_activities', course_id=activity.course_id))
+
+    # The new keys and the regrade of every existing answer commit together
+    set_answer_keys(activity, answer_keys)
+    db.session.flush()
+    regraded = regrade_activity(activity)
+    db.session.commit()
+    flash(f'活動 "{activity.title}" 的正確答案已更新，重新評分 {regraded} 份回答。', 'success')
     return redirect(url_for('main.manage_activities', course_id=activity.course_id))
 
 @main.route('/api/response/<int:activity_id>', methods=['POST'])
@@ -481,24 +551,17 @@ def submit_response(activity_id):
     if not response_data:
         return jsonify({'error': 'Missing response data'}), 400
 
-    # Prevent duplicate submission (for simple activities)
-    existing_response = Response.query.filter_by(
-        activity_id=activity_id, 
-        responder_id=current_user.id
-    ).first()
-    if existing_response:
-        # For simplicity, we just update the existing response
-        existing_response.response_data = json.dumps(response_data)
-    else:
-        response = Response(
-            activity_id=activity_id,
-            responder_id=current_user.id,
-            response_data=json.dumps(response_data)
-        )
-        db.session.add(response)
+    if ingestor.enabled:
+        # Journaled and acknowledged now; written to the database in the next batch
+        ingestor.submit(activity_id, current_user.id, response_data)
+        return jsonify({'message': 'Response accepted'}), 202
 
+    # One upsert; a repeat submission replaces or keeps the earlier answer per RESPONSE_POLICY
+    status = save_response(activity, current_user.id, response_data)
     db.session.commit()
-    return jsonify({'message': 'Response submitted successfully'}), 200
+    if status == 'kept':
+        return jsonify({'error': 'Response already submitted'}), 409
+    return jsonify({'message': 'Response submitted successfully', 'status': status}), 200
 
 # --- GenAI Answer Grouping API ---
 
@@ -515,59 +578,42 @@ def genai_group_answers(activity_id):
     if activity.type != 'short_answer':
         return jsonify({'error': 'Answer grouping is only for Short Answer activities'}), 400
 
-    # 1. Get all responses
-    responses = Response.query.filter_by(activity_id=activity_id).all()
-    if not responses:
+    if not Response.query.filter_by(activity_id=activity_id).first():
         return jsonify({'message': 'No responses to group'}), 200
 
-    # Extract the text of each response
-    # Assuming response_data for short_answer is a simple string like {"answer": "..."}
-    answers_text = []
-    for response in responses:
-        try:
-            data = json.loads(response.response_data)
-            # Assuming the short answer is stored under the key 'answer'
-            answers_text.append(data.get('answer', '')) 
-        except json.JSONDecodeError:
-            answers_text.append('')
-
-    # 2. Call the GenAI utility
-    grouping_result = group_short_answers(answers_text)
-
-    if grouping_result:
-        # 3. Update the responses with group_id
-        # We need to map the result back to the Response objects
-        group_id_counter = 1
-        for group_label, indices in grouping_result.items():
-            for index in indices:
-                # The index corresponds to the position in the 'responses' list
-                if 0 <= index < len(responses):
-                    responses[index].group_id = group_id_counter
-            group_id_counter += 1
-        
-        # Log the task
-        task = GenAITask(
-            user_id=current_user.id,
-            task_type='answer_grouping',
-            input_data=json.dumps({'activity_id': activity_id, 'count': len(answers_text)}),
-            output_data=json.dumps(grouping_result),
-            status='completed'
-        )
-        db.session.add(task)
-        db.session.commit()
-        
-        return jsonify({'message': 'Answers grouped successfully', 'groups': grouping_result}), 200
-    else:
-        # Log the failed task
-        task = GenAITask(
-            user_id=current_user.id,
-            task_type='answer_grouping',
-            input_data=json.dumps({'activity_id': activity_id, 'count': len(answers_text)}),
-            status='failed'
-        )
-        db.session.add(task)
-        db.session.commit()
-        return jsonify({'error': 'GenAI grouping failed'}), 500
+    # By default only answers not grouped yet are grouped, into the existing groups where they fit;
+    # refresh regroups every answer from scratch, bypassing the GenAI cache
+    refresh = (request.get_json(silent=True) or {}).get('refresh') or request.form.get('refresh')
+    if not refresh and AnswerGroup.query.filter_by(activity_id=activity_id).first() is not None and \
+            not Response.query.filter_by(activity_id=activity_id, group_id=None).first():
+        return jsonify({'message': 'No new answers to group'}), 200
+
+    # One grouping (incremental or a full regroup) per activity at a time: two at once would both
+    # place the same ungrouped answers, or renumber groups under each other
+    running = GenAITask.query.filter(
+        GenAITask.task_type == 'answer_grouping',
+        GenAITask.status.in_(['pending', 'processing']),
+        db.func.json_extract(GenAITask.input_data, '$.activity_id') == activity_id
+    ).order_by(GenAITask.id).first()
+    if running is not None:
+        return jsonify({
+            'message': 'Answers are already being grouped',
+            'task_id': running.id,
+            'status': running.status,
+            'status_url': url_for('main.genai_task_status', task_id=running.id)
+        }), 409
+
+    # Queue the task; the worker stores each response's group_id and the page polls genai_task_status
+    task = GenAITask(
+        user_id=current_user.id,
+        task_type='answer_grouping',
+        input_data=json.dumps({'activity_id': activity_id, 'refresh': bool(refresh)}),
+        status='pending'
+    )
+    db.session.add(task)
+    db.session.commit()
+    genai_jobs.submit(task.id)
+    return genai_task_accepted(task)
 
 
 
@@ -585,56 +631,159 @@ def activity_report(activity_id):
         flash('Unauthorized to view this report.', 'danger')
         return redirect(url_for('main.lecturer_dashboard'))
 
-    # Fetch responses
-    responses = Response.query.filter_by(activity_id=activity_id).all()
-    
-    # Process activity content and responses
-    activity_content = json.loads(activity.content)
+    # Summary counts come from the incrementally maintained tallies; the response list is
+    # either one keyset page (?after=<last id>) or, with ?stream=1, every row streamed
+    # into the template from one joined, column-projected query
+    stream = request.args.get('stream') == '1'
+    compiled = activity_cache.get(activity)
     report_data = {
         'activity': activity,
-        'content': activity_content,
-        'responses': []
+        'content': compiled.content,
+        'questions': compiled.questions,
+        'results': read_results(activity_id),
+        'stream': stream,
+        'next_after': None,
+        # Live updates pick up from the newest answer at render time, so none are missed in between
+        'live_since': db.session.query(db.func.max(Response.id)).filter(Response.activity_id == activity_id).scalar() or 0
     }
     
     if activity.type == 'short_answer':
-        # Grouping data for short_answer
-        group_counts = db.session.query(Response.group_id, db.func.count(Response.id)).\
-            filter(Response.activity_id == activity_id, Response.group_id.isnot(None)).\
-            group_by(Response.group_id).all()
-        
-        # Fetch the GenAI task log for group labels
-        genai_task = GenAITask.query.filter_by(
-            task_type='answer_grouping', 
-            status='completed'
-        ).order_by(GenAITask.completed_at.desc()).first()
-        
-        group_labels = {}
-        if genai_task and genai_task.output_data:
+        # Group labels; the counts come from the tallies, so answers not grouped yet are the remainder
+        group_counts = report_data['results']['groups']
+        group_labels = {group.number: group.label for group in
+                        AnswerGroup.query.filter_by(activity_id=activity_id).order_by(AnswerGroup.number)}
+        if not group_labels and group_counts:
+            # Grouped before groups were stored: the labels are in this activity's last grouping task
+            genai_task = GenAITask.query.filter(
+                GenAITask.task_type == 'answer_grouping',
+                GenAITask.status == 'completed',
+                db.func.json_extract(GenAITask.input_data, '$.activity_id') == activity_id
+            ).order_by(GenAITask.id.desc()).first()
             try:
-                grouping_result = json.loads(genai_task.output_data)
-                # Reverse map the indices to find the group label for each group_id
-                # This is a bit complex, simpler to just pass the grouping_result to the template
-                # and let the template handle the presentation
-                report_data['grouping_result'] = grouping_result
-            except json.JSONDecodeError:
-                pass
-
-        report_data['group_counts'] = group_counts
-        
-    # Prepare individual responses for display
-    for response in responses:
+                group_labels = dict(enumerate(json.loads(genai_task.output_data), 1)) if genai_task else {}
+            except (TypeError, json.JSONDecodeError):
+                group_labels = {}
+        report_data['answer_groups'] = [(number, group_labels.get(number, f'Group {number}'), count)
+                                        for number, count in sorted(group_counts.items()) if count]
+        report_data['group_labels'] = group_labels
+        report_data['ungrouped'] = report_data['results']['responses'] - sum(group_counts.values())
+
+    title = f'活動報告 - {activity.title}'
+    # Quizzes, and short answers not grouped yet, show tallies only: no rows to read or page through
+    report_data['lists_rows'] = activity.type != 'quiz' and \
+        (activity.type != 'short_answer' or bool(report_data['answer_groups']))
+    if not report_data['lists_rows']:
+        report_data['responses'] = []
+        return render_template('lecturer/activity_report.html', title=title, report_data=report_data)
+
+    if stream:
+        activity.course # Loaded now: the request's session is gone by the time the template reaches it
+
+        def streamed_rows():
+            session = sqlite_profile.open_read_session()
+            try:
+                yield from iter_report_rows(session, activity_id)
+            finally:
+                session.close()
+
+        report_data['responses'] = streamed_rows()
+        return stream_template('lecturer/activity_report.html', title=title, report_data=report_data)
+
+    after_id = request.args.get('after', type=int)
+    report_data['responses'], report_data['next_after'] = report_page(
+        sqlite_profile.read_session(), activity_id, after_id, current_app.config['REPORT_PAGE_SIZE'])
+    return render_template('lecturer/activity_report.html', title=title, report_data=report_data)
+
+def export_response(rows, object_id, filename, fmt):
+    """Streams an export generator as a file download, reading through its own read-only session."""
+    encode, mimetype = EXPORT_FORMATS[fmt]
+    session = sqlite_profile.open_read_session()
+    response = HTTPResponse(encode(rows(session, object_id)), mimetype=mimetype,
+                            headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'})
+    response.call_on_close(session.close)
+    return response
+
+@main.route('/lecturer/activity/<int:activity_id>/export.<fmt>')
+@login_required
+def export_activity_results(activity_id, fmt):
+    if current_user.role != 'lecturer':
+        flash('Access denied.', 'danger')
+        return redirect(url_for('main.index'))
+
+    activity = Activity.query.get_or_404(activity_id)
+    if activity.creator_id != current_user.id:
+        flash('Unauthorized to export this activity.', 'danger')
+        return redirect(url_for('main.lecturer_dashboard'))
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 404
+
+    return export_response(activity_export_rows, activity_id, f'activity-{activity_id}-results', fmt)
+
+@main.route('/lecturer/course/<int:course_id>/export.<fmt>')
+@login_required
+def export_course_results(course_id, fmt):
+    if current_user.role != 'lecturer':
+        flash('Access denied.', 'danger')
+        return redirect(url_for('main.index'))
+
+    course = Course.query.get_or_404(course_id)
+    if course.lecturer_id != current_user.id:
+        flash('Unauthorized to export this course.', 'danger')
+        return redirect(url_for('main.lecturer_dashboard'))
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 404
+
+    return export_response(course_export_rows, course_id, f'{course.code}-results', fmt)
+
+@main.route('/lecturer/activity/<int:activity_id>/live')
+@login_required
+def activity_live_results(activity_id):
+    if current_user.role != 'lecturer':
+        return jsonify({'error': 'Access denied'}), 403
+
+    activity = Activity.query.get_or_404(activity_id)
+    if activity.creator_id != current_user.id:
+        return jsonify({'error': 'Unauthorized to view this report'}), 403
+    if not activity.is_active:
+        # 204 tells EventSource not to reconnect
+        return '', 204
+
+    stream = stream_results(current_app._get_current_object(), activity_id, request.args.get('since', type=int))
+    try:
+        first_chunk = next(stream) # Subscribes to the activity's feed
+    except StreamLimitError as e:
+        # The page falls back to polling activity_live_results_poll
+        return jsonify({'error': str(e)}), 503
+
+    def generate():
         try:
-            data = json.loads(response.response_data)
-        except json.JSONDecodeError:
-            data = {'answer': 'Invalid data'}
-            
-        report_data['responses'].append({
-            'responder': response.responder.username,
-            'data': data,
-            'group_id': response.group_id
-        })
+            yield first_chunk
+            yield from stream
+        finally:
+            stream.close() # Unsubscribes even if the client left before the first frame
+
+    return HTTPResponse(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-    return render_template('lecturer/activity_report.html', title=f'活動報告 - {activity.title}', report_data=report_data)
+@main.route('/lecturer/activity/<int:activity_id>/live.json')
+@login_required
+def activity_live_results_poll(activity_id):
+    """The live results as one JSON reply, for report pages that could not open a stream."""
+    if current_user.role != 'lecturer':
+        return jsonify({'error': 'Access denied'}), 403
+
+    activity = Activity.query.get_or_404(activity_id)
+    if activity.creator_id != current_user.id:
+        return jsonify({'error': 'Unauthorized to view this report'}), 403
+
+    since = request.args.get('since', 0, type=int)
+    new_answers = answers_after(activity_id, since)
+    return jsonify({
+        'results': read_results(activity_id),
+        'is_active': activity.is_active,
+        'new_answers': new_answers,
+        'last_answer_id': new_answers[-1]['id'] if new_answers else since
+    })
 
 # --- Leaderboard and Student Dashboard Refinement ---
 
@@ -645,14 +794,22 @@ def student_leaderboard():
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
     
-    # Placeholder for a simple global leaderboard based on total correct quiz answers
-    # This will require more complex logic for scoring, but for now, we'll keep it simple.
-    
-    # Example: Count correct answers for all quizzes
-    # This is a complex query and will be simplified for the initial implementation
-    # For now, just show a placeholder page
-    
-    return render_template('student/leaderboard.html', title='我的排行榜')
+    # Scope: the global board (course 0) or one of the student's courses; window: all time, this week or this term
+    session = sqlite_profile.read_session()
+    courses = session.query(Course).join(Enrollment, Enrollment.course_id == Course.id).\
+        filter(Enrollment.student_id == current_user.id).order_by(Course.name).all()
+    course_id = request.args.get('course', GLOBAL, type=int)
+    if course_id != GLOBAL and course_id not in {course.id for course in courses}:
+        course_id = GLOBAL
+    periods = current_periods()
+    window = request.args.get('period', 'all')
+    if window not in periods:
+        window = 'all'
+
+    standings = top(session, course_id, periods[window], current_app.config['LEADERBOARD_TOP_K'])
+    mine = standing(session, course_id, periods[window], current_user.id)
+    return render_template('student/leaderboard.html', title='我的排行榜', courses=courses, course_id=course_id,
+                           window=window, standings=standings, mine=mine)
 
 
 
@@ -673,15 +830,25 @@ def admin_required(f):
 @login_required
 @admin_required
 def admin_users():
-    users = User.query.all()
+    users = sqlite_profile.read_session().query(User).all()
     return render_template('admin/user_management.html', title='用戶管理', users=users)
 
 @main.route('/admin/genai_tasks')
 @login_required
 @admin_required
 def admin_genai_tasks():
-    tasks = GenAITask.query.order_by(GenAITask.created_at.desc()).all()
-    return render_template('admin/genai_task_log.html', title='GenAI 任務日誌', tasks=tasks)
+    session = sqlite_profile.read_session()
+    tasks = session.query(GenAITask).options(joinedload(GenAITask.user)).\
+        order_by(GenAITask.created_at.desc()).all()
+    # What collapsing duplicate answers saved, over all grouping tasks that logged it
+    dedup_stats = session.query(
+        db.func.count(GenAITask.tokens_saved).label('tasks'),
+        db.func.coalesce(db.func.sum(GenAITask.tokens_saved), 0).label('tokens_saved'),
+        db.func.coalesce(db.func.sum(GenAITask.seconds_saved), 0.0).label('seconds_saved')
+    ).filter(GenAITask.status == 'completed').one()
+    return render_template('admin/genai_task_log.html', title='GenAI 任務日誌', tasks=tasks,
+                           cache_stats=genai_cache.stats(session), dedup_stats=dedup_stats,
+                           usage_report=genai_jobs.usage_report(session))
 
 @main.route('/student/quiz/<int:activity_id>', methods=['GET', 'POST'])
 @login_required
@@ -697,35 +864,36 @@ def student_quiz(activity_id):
     if not enrollment:
         flash('您没有权限访问此测验。', 'danger')
         return redirect(url_for('main.student_dashboard'))
-    import json
-    try:
-        quiz_data = json.loads(activity.content)
-        if 'questions' not in quiz_data and 'question' in quiz_data:
-            quiz_data = {'questions': [quiz_data]}
-    except:
-        quiz_data = {}
-    # 查询是否已提交
-    user_response = Response.query.filter_by(activity_id=activity_id, responder_id=current_user.id).first()
-    user_answer = None
-    if user_response:
-        try:
-            user_answer = json.loads(user_response.response_data).get('answer')
-        except:
-            user_answer = None
-    # 处理提交，彻底防止重复
+    # 已编译的测验内容（questions 已规范化），无需每次解析 JSON
+    quiz_data = activity_cache.get(activity)
+    # 查询是否已提交：单题测验读 selected_option，多题测验读 answers 列表
+    submitted = db.session.query(Response.selected_option, Response.response_data).\
+        filter_by(activity_id=activity_id, responder_id=current_user.id).first()
+    user_answers = None
+    if submitted is not None:
+        if quiz_data.multi_question:
+            try:
+                user_answers = json.loads(submitted.response_data).get('answers') or []
+            except (TypeError, ValueError, AttributeError):
+                user_answers = []
+        else:
+            user_answers = [submitted.selected_option]
+    # 处理提交，由唯一索引和 upsert 防止重复；所有题目的答案作为一条回答保存
     if request.method == 'POST':
-        if user_response:
-            flash('您已提交过测验，不能重复提交。', 'warning')
-            return redirect(url_for('main.student_quiz', activity_id=activity_id))
-        selected = request.form.get('q1')
-        if selected:
-            response_data = {'type': 'quiz', 'answer': selected, 'timestamp': datetime.utcnow().isoformat()}
-            new_response = Response(activity_id=activity_id, responder_id=current_user.id, response_data=json.dumps(response_data))
-            db.session.add(new_response)
+        answers = [request.form.get(f'q{position}') for position in range(1, len(quiz_data.questions) + 1)]
+        if answers and all(answers):
+            if quiz_data.multi_question:
+                response_data = {'type': 'quiz', 'answers': answers}
+            else:
+                response_data = {'type': 'quiz', 'answer': answers[0]}
+            status = save_response(activity, current_user.id, response_data, quiz_data.content)
             db.session.commit()
-            flash('测验已提交！', 'success')
+            if status == 'kept':
+                flash('您已提交过测验，不能重复提交。', 'warning')
+            else:
+                flash('测验已提交！', 'success')
             return redirect(url_for('main.student_quiz', activity_id=activity_id))
         else:
-            flash('请选择一个选项。', 'warning')
-    return render_template('student/quiz.html', title=activity.title, activity=activity, quiz_data=quiz_data, user_answer=user_answer)
+            flash('请回答所有题目。', 'warning')
+    return render_template('student/quiz.html', title=activity.title, activity=activity, quiz_data=quiz_data, user_answers=user_answers)
 
@@ -0,0 +1,182 @@
+import fcntl
+import os
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask.globals import app_ctx
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from app.models import db
+
+# PRAGMAs that only make sense on connections that write
+WRITER_ONLY_PRAGMAS = ('journal_mode',)
+
+
+def _is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:')
+
+
+def _pragma_listener(pragmas, read_only):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if read_only and name in WRITER_ONLY_PRAGMAS:
+                    continue
+                cursor.execute(f'PRAGMA {name}={value}')
+            if read_only:
+                cursor.execute('PRAGMA query_only=ON')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+class SQLiteProfile(object):
+    """
+    Production settings for the SQLite database (SQLITE_PROFILE = 'production').
+
+    - Applies SQLITE_PRAGMAS (WAL, synchronous=NORMAL, busy_timeout, mmap and cache size)
+      to every new connection.
+    - Adds a 'reports' bind on the same file whose connections are query_only, and a
+      read_session bound to it for heavy read paths (reports, admin lists). In WAL mode
+      those readers never block, and are never blocked by, student writes.
+    - Runs a WAL checkpoint and ANALYZE on a schedule from a background thread; a lock
+      file makes sure only one worker process does it per interval.
+
+    With any other profile, or a non-SQLite database, read_session uses the default engine.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.last_maintenance = None
+        self._session_factory = None
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        """Call before db.init_app(app): it adds the read-only bind to the config."""
+        self.app = app
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self.enabled = app.config['SQLITE_PROFILE'] == 'production' and _is_sqlite_file(uri)
+        if self.enabled:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.setdefault('reports', uri)
+            app.config['SQLALCHEMY_BINDS'] = binds
+
+    def configure_engines(self, app):
+        """Call after db.init_app(app): hooks the PRAGMAs into the engines' connect events."""
+        if not self.enabled:
+            return
+        pragmas = app.config['SQLITE_PRAGMAS']
+        with app.app_context():
+            for bind_key, engine in db.engines.items():
+                event.listen(engine, 'connect', _pragma_listener(pragmas, read_only=bind_key == 'reports'))
+        self.start_scheduler()
+
+    # --- Read-only sessions ---
+
+    def _read_engine(self):
+        engines = db.engines
+        return engines['reports'] if self.enabled and 'reports' in engines else engines[None]
+
+    def read_session(self):
+        """Returns the read-only session for the current app context (created on first use)."""
+        if self._session_factory is None:
+            self._session_factory = scoped_session(sessionmaker(), scopefunc=lambda: id(app_ctx._get_current_object()))
+        session = self._session_factory()
+        session.bind = self._read_engine()
+        return session
+
+    def open_read_session(self):
+        """Returns a new read-only session that outlives the app context (e.g. for a streamed response); close it when done."""
+        return sessionmaker(bind=self._read_engine())()
+
+    def remove_read_session(self, exception=None):
+        if self._session_factory is not None:
+            self._session_factory.remove()
+
+    # --- Maintenance ---
+
+    def run_maintenance(self, analyze=True):
+        """Checkpoints the WAL (and optionally runs ANALYZE); returns what was done."""
+        result = {'ran_at': datetime.utcnow(), 'checkpoint': None, 'analyze': False}
+        with db.engines[None].connect() as connection:
+            busy, log_frames, checkpointed = connection.execute(text('PRAGMA wal_checkpoint(PASSIVE)')).one()
+            result['checkpoint'] = {'busy': busy, 'log_frames': log_frames, 'checkpointed': checkpointed}
+            if analyze:
+                connection.execute(text('ANALYZE'))
+                result['analyze'] = True
+            connection.commit()
+        self.last_maintenance = result
+        return result
+
+    def start_scheduler(self):
+        if self._pid == os.getpid() or not self.app.config['SQLITE_MAINTENANCE_INTERVAL']:
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._maintenance_loop, name='sqlite-maintenance', daemon=True)
+        self._thread.start()
+
+    def _maintenance_loop(self):
+        interval = self.app.config['SQLITE_MAINTENANCE_INTERVAL']
+        analyze_every = self.app.config['SQLITE_ANALYZE_INTERVAL']
+        lock_path = make_url(self.app.config['SQLALCHEMY_DATABASE_URI']).database + '.maintenance'
+        while True:
+            time.sleep(interval)
+            try:
+                with open(lock_path, 'a+') as lock_file:
+                    try:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue # Another worker is on it
+                    # The file holds when any worker last checkpointed and analyzed
+                    lock_file.seek(0)
+                    try:
+                        last_checkpoint, last_analyze = (float(v) for v in lock_file.read().split())
+                    except ValueError:
+                        last_checkpoint = last_analyze = 0.0
+                    now = time.time()
+                    if now - last_checkpoint < interval * 0.9:
+                        continue
+                    analyze = now - last_analyze >= analyze_every
+                    with self.app.app_context():
+                        self.run_maintenance(analyze=analyze)
+                    lock_file.truncate(0)
+                    lock_file.write(f'{now} {now if analyze else last_analyze}')
+            except Exception as e:
+                print(f"SQLite maintenance failed: {e}")
+
+    def current_settings(self):
+        """Reads the effective PRAGMA values from a writer and a report connection."""
+        names = ['journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size', 'query_only']
+        settings = {'profile': current_app.config['SQLITE_PROFILE'], 'enabled': self.enabled,
+                    'last_maintenance': self.last_maintenance, 'connections': {}}
+        if not _is_sqlite_file(current_app.config['SQLALCHEMY_DATABASE_URI']):
+            return settings
+        engines = {'default': db.engines[None]}
+        if self.enabled:
+            engines['reports'] = db.engines['reports']
+        for label, engine in engines.items():
+            with engine.connect() as connection:
+                settings['connections'][label] = {
+                    name: connection.execute(text(f'PRAGMA {name}')).scalar() for name in names}
+        return settings
+
+
+sqlite_profile = SQLiteProfile()
+
+
+@click.command('sqlite-maintenance')
+@click.option('--no-analyze', is_flag=True, help='Only checkpoint the WAL.')
+@with_appcontext
+def sqlite_maintenance_command(no_analyze):
+    """Checkpoint the SQLite WAL and refresh query planner statistics."""
+    result = sqlite_profile.run_maintenance(analyze=not no_analyze)
+    click.echo(f"Checkpoint: {result['checkpoint']}; ANALYZE: {'yes' if result['analyze'] else 'no'}")
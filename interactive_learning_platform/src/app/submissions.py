@@ -0,0 +1,109 @@
+import json
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import db, Activity, Response
+from app.aggregates import response_columns, add_response_deltas, add_group_delta, apply_deltas
+from app.activity_cache import activity_cache
+from app.leaderboard import add_grade_deltas, apply_grade_deltas
+
+FIRST_ANSWER_WINS = 'first'
+LAST_ANSWER_WINS = 'last'
+
+
+def response_policy(activity_type):
+    """Returns 'first' or 'last': which answer counts when a student submits to an activity twice."""
+    policies = current_app.config['RESPONSE_POLICY']
+    return policies.get(activity_type, policies['default'])
+
+
+def save_response(activity, responder_id, response_data, content=None):
+    """
+    Stores a student's answer with a single INSERT ... ON CONFLICT, honouring the activity type's policy.
+
+    The insert is the transaction's first write, so it takes SQLite's write lock: a
+    double-click cannot slip a second row in between (the unique index would reject it
+    anyway), and replacing an earlier answer reads and adjusts it under the same lock.
+    Tallies and leaderboards are updated in the caller's transaction, which the caller commits.
+
+    Args:
+        activity (Activity): The activity answered.
+        responder_id (int): The submitting student.
+        response_data (dict): The validated answer payload.
+        content (dict): The activity's parsed content; taken from activity_cache when omitted.
+
+    Returns:
+        str: 'created', 'updated', or 'kept' (an earlier answer stands under first-answer-wins).
+    """
+    if content is None:
+        content = activity_cache.get(activity).content
+    row = {'activity_id': activity.id, 'responder_id': responder_id, 'response_data': json.dumps(response_data),
+           'submitted_at': datetime.utcnow(), **response_columns(activity.type, content, response_data)}
+
+    stmt = sqlite_insert(Response).values(row).on_conflict_do_nothing(index_elements=['activity_id', 'responder_id'])
+    inserted = db.session.execute(stmt.returning(Response.id)).first()
+    if inserted is not None:
+        apply_deltas(add_response_deltas({}, activity, content, response_data))
+        apply_grade_deltas(add_grade_deltas({}, activity.course_id, responder_id, row['score'],
+                                            row['submitted_at']))
+        return 'created'
+    if response_policy(activity.type) == FIRST_ANSWER_WINS:
+        return 'kept'
+
+    previous_raw, previous_score, previous_at, previous_group = \
+        db.session.query(Response.response_data, Response.score, Response.submitted_at, Response.group_id).\
+        filter_by(activity_id=activity.id, responder_id=responder_id).one()
+    try:
+        previous_data = json.loads(previous_raw)
+    except (TypeError, json.JSONDecodeError):
+        previous_data = {}
+    changes = {column: value for column, value in row.items() if column not in ('activity_id', 'responder_id')}
+    deltas = add_response_deltas({}, activity, content, response_data, previous_data)
+    if previous_group is not None:
+        # A changed answer leaves its group, to be regrouped with the other new answers
+        changes['group_id'] = None
+        add_group_delta(deltas, activity.id, previous_group, -1)
+    db.session.execute(db.update(Response).
+                       where(Response.activity_id == activity.id, Response.responder_id == responder_id).
+                       values(changes).execution_options(synchronize_session=False))
+    apply_deltas(deltas)
+    grades = add_grade_deltas({}, activity.course_id, responder_id, previous_score, previous_at, sign=-1)
+    apply_grade_deltas(add_grade_deltas(grades, activity.course_id, responder_id, row['score'],
+                                        row['submitted_at']))
+    return 'updated'
+
+
+def dedupe_responses():
+    """
+    Removes duplicate (activity, responder) responses so the unique index can be created (without committing).
+
+    Keeps the earliest row for first-answer-wins activity types and the latest otherwise.
+    It runs before the schema upgrade, so it only touches columns the old schema has;
+    'flask backfill-response-columns' rebuilds the tallies once the upgrade is in.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    duplicates = db.session.query(Response.activity_id, Response.responder_id, Activity.type,
+                                  db.func.min(Response.id), db.func.max(Response.id)).\
+        join(Activity, Activity.id == Response.activity_id).\
+        group_by(Response.activity_id, Response.responder_id).having(db.func.count() > 1).all()
+    deleted = 0
+    for activity_id, responder_id, activity_type, first_id, last_id in duplicates:
+        keep_id = first_id if response_policy(activity_type) == FIRST_ANSWER_WINS else last_id
+        deleted += Response.query.filter(Response.activity_id == activity_id, Response.responder_id == responder_id,
+                                         Response.id != keep_id).delete(synchronize_session=False)
+    return deleted
+
+
+@click.command('dedupe-responses')
+@with_appcontext
+def dedupe_responses_command():
+    """Delete duplicate answers per (activity, student), as the upgrade to the unique index requires."""
+    deleted = dedupe_responses()
+    db.session.commit()
+    click.echo(f'Deleted {deleted} duplicate responses.')
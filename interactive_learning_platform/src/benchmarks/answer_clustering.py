@@ -0,0 +1,74 @@
+"""
+Benchmark: grouping N short answers locally, without a model.
+
+Generates N synthetic answers to one question, each paraphrasing one of a few themes
+(with typos, filler words and some Chinese answers), then times cluster_answers (the
+'local' backend and the fallback) and precluster_answers (the first pass of the
+'precluster' backend). Reports the groups found and their purity: the share of each
+group's answers that belong to its most common theme.
+
+Usage (from the src directory):
+    python -m benchmarks.answer_clustering --answers 1000 5000
+"""
+import argparse
+import random
+import time
+from collections import Counter
+
+from app.answer_clustering import CLUSTERING_AVAILABLE, cluster_answers, precluster_answers
+
+THEMES = {
+    'light': ['plants turn sunlight into chemical energy', 'photosynthesis uses light to make glucose',
+              'chlorophyll in the leaves absorbs light'],
+    'water': ['roots take up water from the soil', 'water and carbon dioxide are the raw materials',
+              'the plant needs water to split into oxygen'],
+    'gas': ['leaves take in carbon dioxide through stomata', 'oxygen is released as a by-product',
+            'gas exchange happens through tiny pores'],
+    'storage': ['glucose is stored as starch for later', 'the sugar is used for growth and respiration',
+                'energy is stored in the bonds of sugar'],
+    'zh': ['植物利用陽光把二氧化碳和水變成葡萄糖', '光合作用在葉綠體中進行', '葉綠素吸收光能'],
+}
+FILLERS = ['', '', 'I think ', 'Basically ', 'um ']
+
+
+def synthetic_answers(count, rng):
+    answers, themes = [], []
+    for _ in range(count):
+        theme = rng.choice(list(THEMES))
+        words = rng.choice(THEMES[theme]).split(' ')
+        if rng.random() < 0.3:
+            position = rng.randrange(len(words))
+            words[position] = words[position][:-1] or words[position] # A typo
+        answers.append(rng.choice(FILLERS) + ' '.join(words) + rng.choice(['', '.', '!']))
+        themes.append(theme)
+    return answers, themes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--answers', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--max-groups', type=int, default=8)
+    parser.add_argument('--preclusters', type=int, default=150)
+    args = parser.parse_args()
+    if not CLUSTERING_AVAILABLE:
+        raise SystemExit('NumPy and SciPy are required for local clustering.')
+    rng = random.Random(0)
+    for count in args.answers:
+        answers, themes = synthetic_answers(count, rng)
+
+        started = time.perf_counter()
+        groups = cluster_answers(answers, args.max_groups)
+        cluster_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        preclusters = precluster_answers(answers, args.preclusters)
+        precluster_seconds = time.perf_counter() - started
+
+        pure = sum(Counter(themes[index] for index in indices).most_common(1)[0][1] for indices in groups.values())
+        print(f'{count:6d} answers: {len(groups)} groups in {cluster_seconds * 1000:.0f} ms '
+              f'(purity {pure / count:.1%}); {len(preclusters)} preclusters in {precluster_seconds * 1000:.0f} ms')
+        for label, indices in groups.items():
+            print(f'        {len(indices):6d}  {label}')
+
+
+if __name__ == '__main__':
+    main()
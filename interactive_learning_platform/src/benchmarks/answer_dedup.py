@@ -0,0 +1,89 @@
+"""
+Benchmark: grouping N short answers with and without collapsing duplicates first.
+
+Runs against the local stub provider (GENAI_PROVIDER = 'stub'), whose simulated latency
+is a fixed cost per call plus a cost per thousand prompt tokens. The N synthetic answers
+are drawn from a few dozen distinct ones, each written with random case, spacing and
+punctuation, as a class's answers to a short question often are. Groups them twice, with
+the GenAI cache off:
+  - every answer: each sent to the model (group_short_answers),
+  - deduplicated: each distinct answer sent once, with its count (group_with_model).
+Reports the wall-clock time, the estimated prompt tokens and the groups of each.
+
+Usage (from the src directory):
+    python -m benchmarks.answer_dedup --answers 2000 --distinct 40
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from flask import g
+
+from config import Config
+from app import create_app
+from app.genai_utils import group_short_answers
+from app.answer_grouping import dedup_answers, prompt_tokens, group_with_model
+
+SUBJECTS = ['plants', 'leaves', 'roots', 'chlorophyll', 'sunlight', 'glucose', 'oxygen', 'water']
+ENDINGS = ['make food from light', 'need water to grow', 'release oxygen', 'store energy as sugar',
+           'take in carbon dioxide', 'absorb light']
+
+
+def build_app(workdir, args):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'dedup.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+        GENAI_PROVIDER = 'stub'
+        GENAI_STUB_LATENCY = args.latency
+        GENAI_STUB_SECONDS_PER_1K_TOKENS = args.per_1k_tokens
+        GENAI_CACHE_TTL = 0
+        GENAI_WORKERS = 0
+        GROUPING_BATCH_TOKENS = 0 # One prompt each way, so only the prompt size differs
+
+    return create_app(BenchConfig)
+
+
+def synthetic_answers(count, distinct, rng):
+    pool = [f'{subject} {ending}' for subject in SUBJECTS for ending in ENDINGS]
+    pool = rng.sample(pool, min(distinct, len(pool)))
+    answers = []
+    for _ in range(count):
+        answer = rng.choice(pool)
+        answer = rng.choice([answer, answer.capitalize(), answer.upper()])
+        answers.append(rng.choice(['', ' ']) + answer.replace(' ', rng.choice([' ', '  '])) + rng.choice(['', '.', '!']))
+    return answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--answers', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=40, help='distinct answers the N are drawn from')
+    parser.add_argument('--latency', type=float, default=0.3, help='simulated seconds per model call')
+    parser.add_argument('--per-1k-tokens', type=float, default=0.2, help='simulated seconds per 1000 prompt tokens')
+    args = parser.parse_args()
+    answers = synthetic_answers(args.answers, args.distinct, random.Random(0))
+    members = dedup_answers(answers)
+    distinct_answers = [answers[indices[0]] for indices in members]
+    tokens = {'every answer': prompt_tokens(answers),
+              'deduplicated': prompt_tokens(distinct_answers, [len(indices) for indices in members])}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = build_app(workdir, args)
+        for name, group in (('every answer', lambda: group_short_answers(answers)),
+                            ('deduplicated', lambda: group_with_model(answers))):
+            with app.app_context():
+                started = time.perf_counter()
+                grouping = group()
+                elapsed = time.perf_counter() - started
+                calls = g.get('genai_usage', {}).get('calls', 0)
+            grouped = sum(len(indices) for indices in grouping.values())
+            print(f'{name:>12}: {elapsed:6.2f}s, ~{tokens[name]} answer tokens, {calls} model calls, '
+                  f'{len(grouping)} groups, {grouped}/{len(answers)} answers grouped')
+    print(f'{len(answers)} answers, {len(members)} distinct after normalizing case, whitespace and punctuation')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: SQL statements per dashboard view as the number of courses grows.
+
+Seeds a throwaway SQLite database with one lecturer teaching N courses (each with a few
+students and activities) and one student enrolled in all of them, then counts the
+statements each dashboard executes. The count must not depend on N.
+
+Usage (from the src directory):
+    python -m benchmarks.dashboard_queries --courses 1 12 50
+"""
+import argparse
+import os
+import tempfile
+
+from sqlalchemy import event
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity
+
+
+def build_app(workdir, courses):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, f'dashboard-{courses}.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        lecturer = User(username='lecturer', role='lecturer')
+        lecturer.set_password('pw')
+        student = User(username='student', role='student', student_id='S000001')
+        student.set_password('pw')
+        others = [User(username=f'other{i}', role='student', password_hash='x') for i in range(5)]
+        db.session.add_all([lecturer, student] + others)
+        db.session.flush()
+        for i in range(courses):
+            course = Course(code=f'C{i:04d}', name=f'Course {i}', lecturer_id=lecturer.id)
+            db.session.add(course)
+            db.session.flush()
+            db.session.add_all(Enrollment(course_id=course.id, student_id=user.id) for user in [student] + others)
+            db.session.add_all(Activity(course_id=course.id, creator_id=lecturer.id, title=f'A{j}', type='poll',
+                                        content='{}') for j in range(3))
+        db.session.commit()
+    return app
+
+
+def count_statements(app, client, url):
+    statements = []
+    with app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--courses', type=int, nargs='+', default=[1, 12, 50])
+    args = parser.parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for courses in args.courses:
+            app = build_app(workdir, courses)
+            lecturer, student = app.test_client(), app.test_client()
+            lecturer.post('/login', data={'username': 'lecturer', 'password': 'pw'})
+            student.post('/login', data={'username': 'student', 'password': 'pw'})
+            results[courses] = (count_statements(app, lecturer, '/lecturer/dashboard'),
+                                count_statements(app, student, '/student/dashboard'))
+            print(f"{courses:4d} courses: lecturer dashboard {results[courses][0]} statements, "
+                  f"student dashboard {results[courses][1]} statements")
+    assert len(set(results.values())) == 1, 'statement count grows with the number of courses'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark: idle SSE clients on one activity gateway process.
+
+Starts the gateway (python -m app.gateway) in a subprocess, opens N idle subscriptions to one
+course, then reports the gateway's memory per connection and how long one "activity started"
+broadcast takes to reach every client.
+
+Usage (from the src directory):
+    python -m benchmarks.gateway_idle_clients --clients 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+
+from config import Config
+from app.gateway import make_subscribe_token
+
+
+def rss_of(pid):
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def http_json(url, body=None):
+    headers = {'Content-Type': 'application/json', 'X-Gateway-Secret': Config.GATEWAY_SECRET}
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=30) as response:
+        return json.loads(response.read())
+
+
+async def open_client(port, token):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET /events?token={token} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n'.encode())
+    await writer.drain()
+    await reader.readuntil(b'retry: 5000\n\n')
+    return reader, writer
+
+
+async def wait_for_event(reader):
+    await reader.readuntil(b'event: activity_started')
+    return time.perf_counter()
+
+
+async def run(clients, port):
+    token = make_subscribe_token(Config.SECRET_KEY, 0, [1])
+    gateway = subprocess.Popen([sys.executable, '-m', 'app.gateway', '--host', '127.0.0.1', '--port', str(port)],
+                               stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                http_json(f'http://127.0.0.1:{port}/stats')
+                break
+            except OSError:
+                time.sleep(0.1)
+        rss_before = rss_of(gateway.pid)
+
+        started = time.perf_counter()
+        connections = []
+        for start in range(0, clients, 200):
+            connections += await asyncio.gather(*(open_client(port, token) for _ in range(min(200, clients - start))))
+        connect_seconds = time.perf_counter() - started
+        await asyncio.sleep(1)
+        rss_after = rss_of(gateway.pid)
+        stats = await asyncio.to_thread(http_json, f'http://127.0.0.1:{port}/stats')
+
+        waiters = [asyncio.create_task(wait_for_event(reader)) for reader, _ in connections]
+        published_at = time.perf_counter()
+        result = await asyncio.to_thread(http_json, f'http://127.0.0.1:{port}/publish',
+                                         {'course_id': 1, 'event': 'activity_started', 'activity_id': 1, 'title': 'bench'})
+        received = await asyncio.gather(*waiters)
+
+        print(f"clients connected:        {stats['connections']} (in {connect_seconds:.2f}s)")
+        print(f"gateway RSS:              {rss_before / 2**20:.1f} MiB idle -> {rss_after / 2**20:.1f} MiB")
+        print(f"RSS per connection:       {(rss_after - rss_before) / clients / 1024:.1f} KiB")
+        print(f"accounted per connection: {stats['accounted_bytes_per_connection']} bytes")
+        print(f"broadcast delivered to:   {result['delivered']}")
+        print(f"fan-out latency:          p50 {sorted(received)[len(received) // 2] - published_at:.3f}s, "
+              f"max {max(received) - published_at:.3f}s")
+
+        for _, writer in connections:
+            writer.close()
+    finally:
+        gateway.terminate()
+        gateway.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.run(run(args.clients, args.port))
+
+
+if __name__ == '__main__':
+    main()
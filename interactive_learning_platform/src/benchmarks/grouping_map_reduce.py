@@ -0,0 +1,79 @@
+"""
+Benchmark: grouping N short answers in one prompt vs. map-reduce batches.
+
+Runs against the local stub provider (GENAI_PROVIDER = 'stub'), whose simulated latency
+is a fixed cost per call plus a cost per thousand prompt tokens, as with a real model.
+Groups the same N synthetic answers twice, with the GenAI cache off:
+  - single prompt: every answer in one call (group_short_answers),
+  - map-reduce: batches of at most --batch-tokens estimated tokens, --concurrency calls at
+    a time, then the batches' labels reconciled (group_in_batches).
+Reports the wall-clock time of each, the number of model calls, and the groups produced.
+
+Usage (from the src directory):
+    python -m benchmarks.grouping_map_reduce --answers 3000 --latency 0.3 --per-1k-tokens 0.2
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from flask import g
+
+from config import Config
+from app import create_app
+from app.genai_utils import estimate_tokens, group_short_answers
+from app.answer_grouping import group_in_batches, answer_batches
+
+SUBJECTS = ['plants', 'leaves', 'roots', 'chlorophyll', 'sunlight', 'glucose', 'oxygen', 'water', 'carbon', 'energy']
+ENDINGS = ['make food from light', 'need water to grow', 'release oxygen into the air', 'store energy as sugar',
+           'take in carbon dioxide', 'absorb light for photosynthesis']
+
+
+def build_app(workdir, args):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'grouping.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+        GENAI_PROVIDER = 'stub'
+        GENAI_STUB_LATENCY = args.latency
+        GENAI_STUB_SECONDS_PER_1K_TOKENS = args.per_1k_tokens
+        GENAI_CACHE_TTL = 0
+        GENAI_WORKERS = 0
+        GROUPING_BATCH_TOKENS = args.batch_tokens
+        GROUPING_CONCURRENCY = args.concurrency
+
+    return create_app(BenchConfig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--answers', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0.3, help='simulated seconds per model call')
+    parser.add_argument('--per-1k-tokens', type=float, default=0.2, help='simulated seconds per 1000 prompt tokens')
+    parser.add_argument('--batch-tokens', type=int, default=8000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    answers = [f'{rng.choice(SUBJECTS)} {rng.choice(ENDINGS)}' for _ in range(args.answers)]
+    tokens = sum(estimate_tokens(answer) for answer in answers)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = build_app(workdir, args)
+        for name, group in (('single prompt', lambda: group_short_answers(answers)),
+                            ('map-reduce', lambda: group_in_batches(answers, args.batch_tokens))):
+            with app.app_context():
+                started = time.perf_counter()
+                grouping = group()
+                elapsed = time.perf_counter() - started
+                calls = g.get('genai_usage', {}).get('calls', 0)
+            grouped = sum(len(indices) for indices in grouping.values())
+            print(f'{name:>13}: {elapsed:6.2f}s, {calls} model calls, {len(grouping)} groups, '
+                  f'{grouped}/{len(answers)} answers grouped')
+    batches = len(answer_batches(answers, args.batch_tokens))
+    print(f'{len(answers)} answers, ~{tokens} answer tokens; {batches} batches of <= {args.batch_tokens} tokens, '
+          f'{args.concurrency} at a time')
+
+
+if __name__ == '__main__':
+    main()
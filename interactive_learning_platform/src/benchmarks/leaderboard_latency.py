@@ -0,0 +1,101 @@
+"""
+Benchmark: leaderboard page latency, small vs. large number of graded answers.
+
+Seeds a throwaway SQLite database with one course of S students and A quizzes, each answered
+by every student (S x A graded responses spread over the last few months), rebuilds the
+leaderboards with the batch job (timed), then requests the student leaderboard page R times
+per scope and window as a student in the middle of the board. Reports p50/p99 page latency:
+these should stay flat as the response count grows, since the page reads one index range
+(top-k) and the score histogram (own rank), never the responses.
+
+Usage (from the src directory):
+    python -m benchmarks.leaderboard_latency --sizes 100x100 1000x100 --requests 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity, Response
+from app.leaderboard import rebuild_leaderboards
+
+
+def build_app(workdir, students, quizzes):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, f'leaderboard-{students}x{quizzes}.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        lecturer = User(username='lecturer', role='lecturer')
+        lecturer.set_password('pw')
+        db.session.add(lecturer)
+        db.session.flush()
+        course = Course(code='BENCH', name='Bench', lecturer_id=lecturer.id)
+        db.session.add(course)
+        db.session.flush()
+        db.session.execute(db.insert(User), [
+            {'username': f'student{i:06d}', 'role': 'student', 'student_id': f'S{i:07d}', 'password_hash': 'x'}
+            for i in range(students)])
+        student_ids = [row[0] for row in db.session.query(User.id).filter(User.role == 'student')]
+        db.session.execute(db.insert(Enrollment), [{'course_id': course.id, 'student_id': sid} for sid in student_ids])
+        content = json.dumps({'question': 'Q', 'options': ['A', 'B', 'C', 'D'], 'correct_answer': 'A'})
+        db.session.execute(db.insert(Activity), [
+            {'course_id': course.id, 'creator_id': lecturer.id, 'title': f'Quiz {j}', 'type': 'quiz', 'content': content}
+            for j in range(quizzes)])
+        now = datetime.utcnow()
+        for position, activity_id in enumerate(row[0] for row in db.session.query(Activity.id)):
+            submitted_at = now - timedelta(days=(quizzes - position) * 90 // quizzes)
+            db.session.execute(db.insert(Response), [
+                {'activity_id': activity_id, 'responder_id': sid, 'response_data': '{}', 'submitted_at': submitted_at,
+                 'is_correct': (sid * 7 + activity_id) % (sid % 5 + 2) == 0}
+                for sid in student_ids])
+        started = time.perf_counter()
+        graded = rebuild_leaderboards()
+        db.session.commit()
+        rebuild_seconds = time.perf_counter() - started
+        middle = db.session.get(User, student_ids[len(student_ids) // 2])
+        middle.set_password('pw')
+        db.session.commit()
+        return app, course.id, middle.username, graded, rebuild_seconds
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['100x100', '1000x100'],
+                        help='STUDENTSxQUIZZES per run')
+    parser.add_argument('--requests', type=int, default=200, help='page requests per scope and window')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            students, quizzes = (int(part) for part in size.split('x'))
+            app, course_id, username, graded, rebuild_seconds = build_app(workdir, students, quizzes)
+            client = app.test_client()
+            client.post('/login', data={'username': username, 'password': 'pw'})
+            samples = []
+            for scope in (0, course_id):
+                for window in ('all', 'week', 'term'):
+                    url = f'/student/leaderboard?course={scope}&period={window}'
+                    client.get(url)
+                    for _ in range(args.requests):
+                        started = time.perf_counter()
+                        response = client.get(url)
+                        samples.append(time.perf_counter() - started)
+                        assert response.status_code == 200, response.status_code
+            print(f'{graded:7d} graded answers ({size}): rebuild {rebuild_seconds:.2f}s, '
+                  f'page p50 {percentile(samples, 0.5) * 1000:.2f} ms, p99 {percentile(samples, 0.99) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: grading a multi-question quiz, 1 vs. Q questions, for S students.
+
+Seeds a throwaway SQLite database with one course of S students and two quizzes (1 and
+Q questions), then grades every student's submission to each quiz three ways, counting
+the SQL statements executed:
+  - one write-behind batch (apply_submissions) of all S submissions,
+  - regrading all S responses after the answer keys change (regrade_activity),
+  - rebuilding the per-question tallies from scratch (rebuild_tallies).
+The statement counts must not depend on the number of questions, and the incrementally
+kept tallies must match the rebuilt ones.
+
+Usage (from the src directory):
+    python -m benchmarks.quiz_grading --students 400 --questions 30
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity, ActivityTally
+from app.ingest import apply_submissions
+from app.grading import set_answer_keys, regrade_activity
+from app.aggregates import rebuild_tallies
+
+OPTIONS = ['A', 'B', 'C', 'D']
+
+
+def build_app(workdir, students, questions):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, f'grading-{students}x{questions}.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        lecturer = User(username='lecturer', role='lecturer', password_hash='x')
+        db.session.add(lecturer)
+        db.session.flush()
+        course = Course(code='BENCH', name='Bench', lecturer_id=lecturer.id)
+        db.session.add(course)
+        db.session.flush()
+        db.session.execute(db.insert(User), [
+            {'username': f'student{i:06d}', 'role': 'student', 'student_id': f'S{i:07d}', 'password_hash': 'x'}
+            for i in range(students)])
+        student_ids = [row[0] for row in db.session.query(User.id).filter(User.role == 'student')]
+        db.session.execute(db.insert(Enrollment), [{'course_id': course.id, 'student_id': sid} for sid in student_ids])
+        quizzes = {}
+        for count in (1, questions):
+            content = {'questions': [{'question': f'Q{n}', 'options': OPTIONS, 'correct_answer': 'A'}
+                                     for n in range(count)]}
+            if count == 1:
+                content = content['questions'][0]
+            quiz = Activity(course_id=course.id, creator_id=lecturer.id, title=f'{count} questions', type='quiz',
+                            content=json.dumps(content), is_active=True)
+            db.session.add(quiz)
+            db.session.flush()
+            quizzes[count] = quiz.id
+        db.session.commit()
+    return app, student_ids, quizzes
+
+
+class StatementCounter(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+
+def tallies(activity_id):
+    return sorted((metric, key, count) for metric, key, count in
+                  db.session.query(ActivityTally.metric, ActivityTally.key, ActivityTally.count).
+                  filter(ActivityTally.activity_id == activity_id, ActivityTally.count != 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=400)
+    parser.add_argument('--questions', type=int, default=30)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        app, student_ids, quizzes = build_app(workdir, args.students, args.questions)
+        with app.app_context():
+            for count, quiz_id in quizzes.items():
+                if count == 1:
+                    payload = lambda: {'type': 'quiz', 'answer': rng.choice(OPTIONS)}
+                else:
+                    payload = lambda: {'type': 'quiz', 'answers': [rng.choice(OPTIONS) for _ in range(count)]}
+                batch = [{'activity_id': quiz_id, 'responder_id': sid, 'response_data': payload(),
+                          'submitted_at': datetime.utcnow().isoformat()} for sid in student_ids]
+
+                with StatementCounter(db.engine) as submit:
+                    started = time.perf_counter()
+                    apply_submissions(batch)
+                    db.session.commit()
+                    submit_seconds = time.perf_counter() - started
+
+                quiz = db.session.get(Activity, quiz_id)
+                with StatementCounter(db.engine) as regrade:
+                    started = time.perf_counter()
+                    set_answer_keys(quiz, ['B'] * count)
+                    db.session.flush()
+                    regraded = regrade_activity(quiz)
+                    db.session.commit()
+                    regrade_seconds = time.perf_counter() - started
+
+                kept = tallies(quiz_id)
+                with StatementCounter(db.engine) as rebuild:
+                    started = time.perf_counter()
+                    rebuild_tallies([quiz_id])
+                    db.session.commit()
+                    rebuild_seconds = time.perf_counter() - started
+                assert tallies(quiz_id) == kept, 'incremental tallies differ from the rebuilt ones'
+
+                print(f'{count:3d} question(s) x {len(student_ids)} students: '
+                      f'batch submit {submit_seconds * 1000:.0f} ms / {submit.count} statements, '
+                      f'regrade {regrade_seconds * 1000:.0f} ms / {regrade.count} statements ({regraded} changed), '
+                      f'tally rebuild {rebuild_seconds * 1000:.0f} ms / {rebuild.count} statements')
+
+
+if __name__ == '__main__':
+    main()
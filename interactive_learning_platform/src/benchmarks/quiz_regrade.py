@@ -0,0 +1,81 @@
+"""
+Benchmark: regrading every response of a quiz after its answer key changes.
+
+Seeds a throwaway SQLite database with one quiz answered by N students (options A-D,
+graded against key A), then changes the key to B and regrades with regrade_activity:
+one UPDATE for the marks, a set-based tally rebuild and leaderboard deltas, all in one
+transaction. Reports the total time (including the commit) and how many marks changed,
+then checks the stored marks against the new key.
+
+Usage (from the src directory):
+    python -m benchmarks.quiz_regrade --responses 10000 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity, Response
+from app.grading import set_answer_keys, regrade_activity
+from app.leaderboard import rebuild_leaderboards
+
+
+def build_app(workdir, responses):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, f'regrade-{responses}.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        lecturer = User(username='lecturer', role='lecturer', password_hash='x')
+        db.session.add(lecturer)
+        db.session.flush()
+        course = Course(code='BENCH', name='Bench', lecturer_id=lecturer.id)
+        db.session.add(course)
+        db.session.flush()
+        db.session.execute(db.insert(User), [
+            {'username': f'student{i:06d}', 'role': 'student', 'student_id': f'S{i:07d}', 'password_hash': 'x'}
+            for i in range(responses)])
+        student_ids = [row[0] for row in db.session.query(User.id).filter(User.role == 'student')]
+        db.session.execute(db.insert(Enrollment), [{'course_id': course.id, 'student_id': sid} for sid in student_ids])
+        quiz = Activity(course_id=course.id, creator_id=lecturer.id, title='Quiz', type='quiz',
+                        content=json.dumps({'question': 'Q', 'options': ['A', 'B', 'C', 'D'], 'correct_answer': 'A'}))
+        db.session.add(quiz)
+        db.session.flush()
+        db.session.execute(db.insert(Response), [
+            {'activity_id': quiz.id, 'responder_id': sid, 'response_data': json.dumps({'answer': 'ABCD'[sid % 4]}),
+             'selected_option': 'ABCD'[sid % 4], 'is_correct': sid % 4 == 0, 'score': float(sid % 4 == 0)}
+            for sid in student_ids])
+        rebuild_leaderboards()
+        db.session.commit()
+        return app, quiz.id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--responses', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for responses in args.responses:
+            app, quiz_id = build_app(workdir, responses)
+            with app.app_context():
+                quiz = db.session.get(Activity, quiz_id)
+                started = time.perf_counter()
+                set_answer_keys(quiz, ['B'])
+                db.session.flush()
+                regraded = regrade_activity(quiz)
+                db.session.commit()
+                elapsed = time.perf_counter() - started
+                wrong = Response.query.filter(Response.activity_id == quiz_id,
+                                              Response.is_correct != (Response.selected_option == 'B')).count()
+                assert wrong == 0, f'{wrong} responses carry a stale mark'
+            print(f'{responses:7d} responses: regraded {regraded} marks in {elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
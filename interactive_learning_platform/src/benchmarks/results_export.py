@@ -0,0 +1,111 @@
+"""
+Benchmark: streaming CSV/XLSX export time and memory, small vs. large course.
+
+Seeds a throwaway SQLite database with a course of S enrolled students and A activities,
+each answered by every student (S x A course rows), then downloads the course export in
+both formats through the test client, reading the streamed body chunk by chunk. Reports
+time and size per export, and the Python heap peak (tracemalloc, measured in a second,
+untimed download since tracing slows Python down): the peak should not grow with the
+row count.
+
+Usage (from the src directory):
+    python -m benchmarks.results_export --sizes 10x10 1000x100
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity, Response
+
+
+def build_app(workdir, students, activities):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, f'export-{students}x{activities}.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        lecturer = User(username='lecturer', role='lecturer')
+        lecturer.set_password('pw')
+        db.session.add(lecturer)
+        db.session.flush()
+        course = Course(code='BENCH', name='Bench', lecturer_id=lecturer.id)
+        db.session.add(course)
+        db.session.flush()
+        db.session.execute(db.insert(User), [
+            {'username': f'student{i:06d}', 'role': 'student', 'student_id': f'S{i:07d}', 'password_hash': 'x'}
+            for i in range(students)])
+        student_ids = [row[0] for row in db.session.query(User.id).filter(User.role == 'student')]
+        db.session.execute(db.insert(Enrollment), [{'course_id': course.id, 'student_id': sid} for sid in student_ids])
+        content = json.dumps({'question': 'Q', 'options': ['A', 'B', 'C', 'D'], 'correct_answer': 'A'})
+        db.session.execute(db.insert(Activity), [
+            {'course_id': course.id, 'creator_id': lecturer.id, 'title': f'Quiz {j}', 'type': 'quiz', 'content': content}
+            for j in range(activities)])
+        activity_ids = [row[0] for row in db.session.query(Activity.id)]
+        for activity_id in activity_ids:
+            db.session.execute(db.insert(Response), [
+                {'activity_id': activity_id, 'responder_id': sid, 'response_data': json.dumps({'answer': 'ABCD'[sid % 4]}),
+                 'selected_option': 'ABCD'[sid % 4], 'is_correct': sid % 4 == 0, 'score': float(sid % 4 == 0)}
+                for sid in student_ids])
+        db.session.commit()
+        return app, course.id
+
+
+def export(app, course_id, fmt, trace=False):
+    client = app.test_client()
+    client.post('/login', data={'username': 'lecturer', 'password': 'pw'})
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(f'/lecturer/course/{course_id}/export.{fmt}', buffered=False)
+    size = 0
+    first_chunk_at = None
+    sample = io.BytesIO()
+    for chunk in response.response:
+        if first_chunk_at is None:
+            first_chunk_at = time.perf_counter() - started
+        size += len(chunk)
+        if fmt == 'xlsx' or sample.tell() < 4096:
+            sample.write(chunk)
+    response.close()
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if fmt == 'xlsx':
+        with zipfile.ZipFile(sample) as workbook:
+            rows = workbook.read('xl/worksheets/sheet1.xml').count(b'<row>')
+    else:
+        rows = None
+    return elapsed, first_chunk_at, size, peak, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['10x10', '1000x100'],
+                        help='Course sizes as STUDENTSxACTIVITIES')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            students, activities = (int(n) for n in size.split('x'))
+            app, course_id = build_app(workdir, students, activities)
+            for fmt in ('csv', 'xlsx'):
+                elapsed, first_chunk, nbytes, _, rows = export(app, course_id, fmt)
+                peak = export(app, course_id, fmt, trace=True)[3]
+                print(f"{students * activities:7d} rows [{fmt:4s}] {elapsed:6.2f}s (first chunk {first_chunk * 1000:.0f} ms), "
+                      f"{nbytes / 2**20:6.2f} MiB, heap peak {peak / 2**20:5.2f} MiB"
+                      + (f", {rows - 1} data rows in workbook" if rows is not None else ''))
+
+
+if __name__ == '__main__':
+    main()
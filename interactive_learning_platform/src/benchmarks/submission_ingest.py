@@ -0,0 +1,100 @@
+"""
+Benchmark: submit_response throughput, direct commits vs. write-behind batching.
+
+Seeds a throwaway SQLite database with one active poll and N enrolled students, then has
+them all submit at once from a pool of threads (a lecture hall pressing "submit"), once per
+ingestion mode. Reports request throughput, acknowledgement latency and, for write-behind,
+the flush batches and their latency.
+
+Usage (from the src directory):
+    python -m benchmarks.submission_ingest --students 600 --threads 16
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity, Response
+from app.ingest import ingestor
+
+
+def build_app(mode, workdir, students):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, f'{mode}.db')
+        INGEST_MODE = mode
+        INGEST_JOURNAL_DIR = os.path.join(workdir, f'{mode}-journal')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1' # Logins are not what is measured here
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        lecturer = User(username='lecturer', role='lecturer', password_hash='x')
+        db.session.add(lecturer)
+        db.session.flush()
+        course = Course(code='BENCH', name='Bench', lecturer_id=lecturer.id)
+        db.session.add(course)
+        db.session.flush()
+        db.session.add(Activity(course_id=course.id, creator_id=lecturer.id, title='Poll', type='poll',
+                                content=json.dumps({'question': 'Q', 'options': ['A', 'B', 'C', 'D']}), is_active=True))
+        for i in range(students):
+            student = User(username=f'student{i}', role='student', student_id=f'S{i:06d}')
+            student.set_password('pw')
+            db.session.add(student)
+            db.session.flush()
+            db.session.add(Enrollment(course_id=course.id, student_id=student.id))
+        db.session.commit()
+    return app
+
+
+def run(mode, workdir, students, threads):
+    app = build_app(mode, workdir, students)
+    clients = []
+    for i in range(students):
+        client = app.test_client()
+        client.post('/login', data={'username': f'student{i}', 'password': 'pw'})
+        clients.append(client)
+
+    def submit(i):
+        started = time.perf_counter()
+        response = clients[i].post('/api/response/1', json={'response_data': {'selected_option': 'ABCD'[i % 4]}})
+        assert response.status_code in (200, 202), response.status_code
+        return time.perf_counter() - started
+
+    ingestor.reset_stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(submit, range(students)))
+    elapsed = time.perf_counter() - started
+
+    if mode == 'write_behind':
+        while ingestor.stats()['queued'] or ingestor.stats()['flushed'] < students:
+            time.sleep(0.05)
+    drained = time.perf_counter() - started
+    with app.app_context():
+        stored = Response.query.count()
+
+    print(f"[{mode}] {students} submissions in {elapsed:.2f}s -> {students / elapsed:.0f} req/s; "
+          f"ack p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms; "
+          f"all stored after {drained:.2f}s ({stored} rows)")
+    if mode == 'write_behind':
+        stats = ingestor.stats()
+        print(f"[{mode}] {stats['flushes']} flushes, mean batch {stats['mean_batch']}, "
+              f"flush p50 {stats['flush_p50_ms']} ms, p95 {stats['flush_p95_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=600)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ('direct', 'write_behind'):
+            run(mode, workdir, args.students, args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,21 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'instance', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # SQLite engine profile: 'production' applies SQLITE_PRAGMAS to every connection, sends
+    # reports and admin lists to a read-only 'reports' bind, and checkpoints the WAL every
+    # SQLITE_MAINTENANCE_INTERVAL seconds (ANALYZE every SQLITE_ANALYZE_INTERVAL); 'default' does none of it
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KIB', 64 * 1024)), # Negative: KiB rather than pages
+        'temp_store': 'MEMORY',
+    }
+    SQLITE_MAINTENANCE_INTERVAL = int(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', 600))
+    SQLITE_ANALYZE_INTERVAL = int(os.environ.get('SQLITE_ANALYZE_INTERVAL', 6 * 3600))
     
     # Flask-Login configuration
     REMEMBER_COOKIE_DURATION = timedelta(days=7)
@@ -18,7 +33,110 @@ class Config(object):
     # GenAI Configuration
     # The actual API key is in the environment variable. We will use the model slug.
     GENAI_MODEL = 'gpt-4.1-mini'
+    # USD per million (prompt, completion) tokens, for the estimated cost of each GenAI task
+    GENAI_PRICING = {
+        'gpt-4.1': (2.00, 8.00),
+        'gpt-4.1-mini': (0.40, 1.60),
+        'gpt-4.1-nano': (0.10, 0.40),
+    }
+    # 'openai' calls the API; 'stub' answers locally (after GENAI_STUB_LATENCY seconds) for offline use
+    GENAI_PROVIDER = os.environ.get('GENAI_PROVIDER', 'openai')
+    GENAI_STUB_LATENCY = float(os.environ.get('GENAI_STUB_LATENCY', 0.0))
+    GENAI_STUB_SECONDS_PER_1K_TOKENS = float(os.environ.get('GENAI_STUB_SECONDS_PER_1K_TOKENS', 0.0))
+    GENAI_STUB_ERROR_RATE = float(os.environ.get('GENAI_STUB_ERROR_RATE', 0.0))
+    # GenAI calls: seconds one call may take, and a whole task's calls (0 = no task limit; keep it
+    # under GENAI_TASK_LEASE); retries of transient errors, with exponential backoff from
+    # GENAI_RETRY_BASE_DELAY up to GENAI_RETRY_MAX_DELAY seconds (full jitter); calls in flight at
+    # once across all processes using the database, and seconds a call may wait for one to finish
+    GENAI_TIMEOUT = float(os.environ.get('GENAI_TIMEOUT', 60.0))
+    GENAI_TASK_TIMEOUT = float(os.environ.get('GENAI_TASK_TIMEOUT', 300.0))
+    GENAI_MAX_RETRIES = int(os.environ.get('GENAI_MAX_RETRIES', 3))
+    GENAI_RETRY_BASE_DELAY = float(os.environ.get('GENAI_RETRY_BASE_DELAY', 0.5))
+    GENAI_RETRY_MAX_DELAY = float(os.environ.get('GENAI_RETRY_MAX_DELAY', 8.0))
+    GENAI_MAX_CONCURRENCY = int(os.environ.get('GENAI_MAX_CONCURRENCY', 8))
+    GENAI_QUEUE_TIMEOUT = float(os.environ.get('GENAI_QUEUE_TIMEOUT', 30.0))
+    # GenAI task queue: worker threads per process (0 = only enqueue; run `flask genai-worker`),
+    # seconds between polls for pending tasks, seconds a claimed task may run before it is
+    # re-queued, and how many times a task is claimed before it is marked failed
+    GENAI_WORKERS = int(os.environ.get('GENAI_WORKERS', 2))
+    GENAI_POLL_INTERVAL = float(os.environ.get('GENAI_POLL_INTERVAL', 2.0))
+    GENAI_TASK_LEASE = int(os.environ.get('GENAI_TASK_LEASE', 600))
+    GENAI_MAX_ATTEMPTS = int(os.environ.get('GENAI_MAX_ATTEMPTS', 3))
+    # GenAI output cache: seconds an entry lives (0 disables the cache) and the total size of the
+    # stored outputs, past which the least recently used are evicted
+    GENAI_CACHE_TTL = int(os.environ.get('GENAI_CACHE_TTL', 7 * 24 * 3600))
+    GENAI_CACHE_MAX_BYTES = int(os.environ.get('GENAI_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    # Short-answer grouping: 'genai' sends every answer to the model, 'precluster' clusters them
+    # locally first and sends one representative per cluster, 'local' never calls the model
+    # (the local clustering, which needs NumPy/SciPy, is also the fallback when the model fails)
+    GENAI_GROUPING_BACKEND = os.environ.get('GENAI_GROUPING_BACKEND', 'genai')
+    GROUPING_MAX_GROUPS = int(os.environ.get('GROUPING_MAX_GROUPS', 8))
+    GROUPING_PRECLUSTERS = int(os.environ.get('GROUPING_PRECLUSTERS', 150))
+    # Answer lists longer than GROUPING_BATCH_TOKENS (estimated prompt tokens; 0 = never) are grouped
+    # map-reduce style: in batches, at most GROUPING_CONCURRENCY at once, then the labels are merged
+    GROUPING_BATCH_TOKENS = int(os.environ.get('GROUPING_BATCH_TOKENS', 8000))
+    GROUPING_CONCURRENCY = int(os.environ.get('GROUPING_CONCURRENCY', 4))
     
     # CORS Configuration
     CORS_HEADERS = 'Content-Type' 
 
+    # Password hashing: werkzeug method spec (including cost), worker threads, and how many
+    # extra requests may wait for a worker before logins are turned away as busy.
+    # Hashes made with other settings are upgraded on the user's next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+    PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 64))
+
+    # Identity cache for Flask-Login's user_loader: max cached users and seconds an entry lives.
+    # Each worker process has its own cache, so the TTL bounds how stale another worker can be.
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 4096))
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+
+    # Responses per page of an activity report (?stream=1 streams them all instead)
+    REPORT_PAGE_SIZE = int(os.environ.get('REPORT_PAGE_SIZE', 200))
+
+    # Parsed activity content cache: max compiled activities kept per worker process
+    ACTIVITY_CACHE_SIZE = int(os.environ.get('ACTIVITY_CACHE_SIZE', 1024))
+
+    # Live activity results (SSE): seconds between frames (submissions in between are
+    # coalesced into one delta), keepalive period, and max viewers per activity per process.
+    # Each open stream holds one of the worker's GUNICORN_THREADS (as in the Procfile), so all
+    # streams in a process are capped well below it; viewers past a cap poll every
+    # LIVE_RESULTS_POLL_INTERVAL seconds instead
+    LIVE_RESULTS_INTERVAL = float(os.environ.get('LIVE_RESULTS_INTERVAL', 1.0))
+    LIVE_RESULTS_HEARTBEAT = 15
+    LIVE_RESULTS_MAX_STREAMS = int(os.environ.get('LIVE_RESULTS_MAX_STREAMS', 50))
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 32))
+    LIVE_RESULTS_MAX_STREAMS_PER_PROCESS = int(os.environ.get('LIVE_RESULTS_MAX_STREAMS_PER_PROCESS',
+                                                              max(1, GUNICORN_THREADS // 4)))
+    LIVE_RESULTS_POLL_INTERVAL = 5
+
+    # Activity notification gateway (python -m app.gateway): where Flask publishes
+    # start/stop events, the URL browsers connect to, and the shared publish secret
+    GATEWAY_PUBLISH_URL = os.environ.get('GATEWAY_PUBLISH_URL') # e.g. 'http://127.0.0.1:8765'
+    GATEWAY_PUBLIC_URL = os.environ.get('GATEWAY_PUBLIC_URL') or GATEWAY_PUBLISH_URL
+    GATEWAY_SECRET = os.environ.get('GATEWAY_SECRET') or SECRET_KEY
+    GATEWAY_PUBLISH_TIMEOUT = 1.0
+
+    # Response ingestion: 'direct' commits each submit_response call; 'write_behind' journals it
+    # to INGEST_JOURNAL_DIR, acknowledges, and writes batches every N ms or M records
+    INGEST_MODE = os.environ.get('INGEST_MODE', 'direct')
+    INGEST_JOURNAL_DIR = os.environ.get('INGEST_JOURNAL_DIR') or os.path.join(basedir, 'instance', 'ingest')
+    INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('INGEST_FLUSH_INTERVAL_MS', 200))
+    INGEST_FLUSH_MAX_RECORDS = int(os.environ.get('INGEST_FLUSH_MAX_RECORDS', 500))
+    INGEST_FSYNC = True
+
+    # Which answer counts when a student submits to the same activity again, per activity type:
+    # 'first' keeps the original answer, 'last' replaces it
+    RESPONSE_POLICY = {'quiz': 'first', 'default': 'last'}
+
+    # Leaderboards: months in which a term starts (for the 'this term' window), and rows shown
+    LEADERBOARD_TERM_START_MONTHS = (2, 9)
+    LEADERBOARD_TOP_K = int(os.environ.get('LEADERBOARD_TOP_K', 20))
+
+    # Roster import: rows resolved per set-based batch, and the process pool used to hash
+    # new users' passwords (smaller imports are hashed inline)
+    ROSTER_IMPORT_BATCH_SIZE = int(os.environ.get('ROSTER_IMPORT_BATCH_SIZE', 1000))
+    ROSTER_IMPORT_HASH_WORKERS = int(os.environ.get('ROSTER_IMPORT_HASH_WORKERS', os.cpu_count() or 2))
+    ROSTER_IMPORT_POOL_THRESHOLD = 8
+
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from config import Config
+from app import create_app, db
+from app.models import User, Course, Enrollment, Activity, LeaderboardScore, LeaderboardBucket
+from app.aggregates import read_results, rebuild_tallies
+from app.leaderboard import rebuild_leaderboards
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1'
+        SQLITE_MAINTENANCE_INTERVAL = 0
+        GENAI_WORKERS = 0
+        INGEST_JOURNAL_DIR = str(tmp_path / 'ingest')
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def app_context(app):
+    """An app context for tests that work on the database directly (requests push their own)."""
+    with app.app_context():
+        yield
+        db.session.remove()
+
+
+def add_user(username, role, student_id=None):
+    user = User(username=username, role=role, student_id=student_id)
+    user.set_password('pw')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+@pytest.fixture
+def course(app_context):
+    """A lecturer's course with three enrolled students."""
+    lecturer = add_user('lecturer', 'lecturer')
+    course = Course(code='C0001', name='Course', lecturer_id=lecturer.id)
+    db.session.add(course)
+    db.session.flush()
+    for i in range(3):
+        db.session.add(Enrollment(course_id=course.id, student_id=add_user(f's{i}', 'student', f'S{i:06d}').id))
+    db.session.commit()
+    return course
+
+
+@pytest.fixture
+def students(course):
+    """The course's students, in username order."""
+    return User.query.join(Enrollment, Enrollment.student_id == User.id).\
+        filter(Enrollment.course_id == course.id).order_by(User.username).all()
+
+
+@pytest.fixture
+def make_activity(course):
+    """Adds an active activity with the given type and content (a dict) to the course."""
+    def make(activity_type, content):
+        activity = Activity(course_id=course.id, creator_id=course.lecturer_id, title=activity_type,
+                            type=activity_type, content=json.dumps(content), is_active=True)
+        db.session.add(activity)
+        db.session.commit()
+        return activity
+    return make
+
+
+def assert_tallies_match_rebuild(activity_id):
+    """Asserts an activity's incrementally kept tallies equal a recount from its responses."""
+    kept = read_results(activity_id)
+    rebuild_tallies([activity_id])
+    assert read_results(activity_id) == kept
+
+
+def _leaderboards():
+    # Rows left at zero by taken-back answers are off the board, as if never written
+    scores = {(row.course_id, row.period, row.user_id): (row.score, row.answered)
+              for row in LeaderboardScore.query if row.answered}
+    buckets = {(row.course_id, row.period, row.score): row.users for row in LeaderboardBucket.query if row.users}
+    return scores, buckets
+
+
+def assert_leaderboards_match_rebuild():
+    """Asserts the incrementally kept leaderboards equal a recount from the graded responses."""
+    kept = _leaderboards()
+    rebuild_leaderboards()
+    assert _leaderboards() == kept
@@ -0,0 +1,49 @@
+from app import db
+from app.aggregates import read_results, KEY_LENGTH
+from app.submissions import save_response
+from tests.conftest import assert_tallies_match_rebuild
+
+LONG_OPTION = 'x' * 300
+MULTI_QUIZ = {'questions': [{'question': 'Q1', 'options': ['A', 'B'], 'correct_answer': 'A'},
+                            {'question': 'Q2', 'options': ['C', 'D'], 'correct_answer': 'D'},
+                            {'question': 'Q3', 'options': ['E', 'F']}]}
+
+
+def submit_all(activity, students, payloads):
+    for student, response_data in zip(students, payloads):
+        save_response(activity, student.id, response_data)
+    db.session.commit()
+
+
+def test_poll_tallies_count_long_options_under_their_key(make_activity, students):
+    poll = make_activity('poll', {'question': 'Pick one', 'options': [LONG_OPTION, 'B']})
+    submit_all(poll, students, [{'type': 'poll', 'selected_option': option}
+                                for option in (LONG_OPTION, LONG_OPTION, 'B')])
+
+    results = read_results(poll.id)
+    assert results['responses'] == 3
+    assert results['options'] == {LONG_OPTION[:KEY_LENGTH]: 2, 'B': 1}
+    assert_tallies_match_rebuild(poll.id)
+
+
+def test_single_question_quiz_tallies(make_activity, students):
+    quiz = make_activity('quiz', {'question': '1 + 1?', 'options': ['1', '2'], 'correct_answer': '2'})
+    submit_all(quiz, students, [{'type': 'quiz', 'answer': answer} for answer in ('2', '1', '2')])
+
+    results = read_results(quiz.id)
+    assert results['options'] == {'2': 2, '1': 1}
+    assert results['quiz'] == {'correct': 2, 'incorrect': 1}
+    assert_tallies_match_rebuild(quiz.id)
+
+
+def test_multi_question_quiz_tallies(make_activity, students):
+    quiz = make_activity('quiz', MULTI_QUIZ)
+    submit_all(quiz, students, [{'type': 'quiz', 'answers': answers}
+                                for answers in (['A', 'D', 'E'], ['A', 'C', 'F'], ['B', 'D', 'E'])])
+
+    results = read_results(quiz.id)
+    assert results['quiz'] == {'correct': 1, 'incorrect': 2}
+    assert results['questions'][0] == {'options': {'A': 2, 'B': 1}, 'correct': 2}
+    assert results['questions'][1] == {'options': {'D': 2, 'C': 1}, 'correct': 2}
+    assert results['questions'][2] == {'options': {'E': 2, 'F': 1}, 'correct': 0}
+    assert_tallies_match_rebuild(quiz.id)
@@ -0,0 +1,47 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db
+from app.models import Course, Enrollment, Activity
+from tests.conftest import add_user
+
+
+def seed(courses, name):
+    """A lecturer teaching `courses` courses with three activities each, all taken by one student."""
+    lecturer = add_user(f'{name}-lecturer', 'lecturer')
+    student = add_user(f'{name}-student', 'student', f'{name}-S1')
+    for i in range(courses):
+        course = Course(code=f'{name}{i:03d}', name=f'Course {i}', lecturer_id=lecturer.id)
+        db.session.add(course)
+        db.session.flush()
+        db.session.add(Enrollment(course_id=course.id, student_id=student.id))
+        db.session.add_all(Activity(course_id=course.id, creator_id=lecturer.id, title=f'A{j}', type='poll',
+                                    content='{}') for j in range(3))
+    db.session.commit()
+    return lecturer.username, student.username
+
+
+def count_statements(app, username, url):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'pw'})
+    client.get(url) # Warms the identity and activity caches, as any earlier request would
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_dashboard_statements_do_not_grow_with_courses(app):
+    with app.app_context():
+        few = seed(1, 'F')
+        many = seed(12, 'M')
+    for role, url in ((0, '/lecturer/dashboard'), (1, '/student/dashboard')):
+        assert count_statements(app, few[role], url) == count_statements(app, many[role], url), url
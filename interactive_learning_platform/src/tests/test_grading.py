@@ -0,0 +1,50 @@
+from app import db
+from app.models import Response
+from app.grading import set_answer_keys, regrade_activity
+from app.submissions import save_response
+from tests.conftest import assert_tallies_match_rebuild, assert_leaderboards_match_rebuild
+
+LONG_OPTION = 'y' * 300
+
+
+def marks(activity):
+    return [(response.is_correct, response.score) for response in
+            Response.query.filter_by(activity_id=activity.id).order_by(Response.responder_id)]
+
+
+def regrade(activity, answer_keys):
+    set_answer_keys(activity, answer_keys)
+    db.session.flush()
+    regraded = regrade_activity(activity)
+    db.session.commit()
+    return regraded
+
+
+def test_regrade_single_question_quiz(make_activity, students):
+    quiz = make_activity('quiz', {'question': 'Pick', 'options': [LONG_OPTION, 'B'], 'correct_answer': 'B'})
+    for student, answer in zip(students, (LONG_OPTION, 'B', LONG_OPTION)):
+        save_response(quiz, student.id, {'type': 'quiz', 'answer': answer})
+    db.session.commit()
+    assert marks(quiz) == [(False, 0.0), (True, 1.0), (False, 0.0)]
+
+    # The long option is stored cut to the column's length, and must still match its key
+    assert regrade(quiz, [LONG_OPTION]) == 3
+    assert marks(quiz) == [(True, 1.0), (False, 0.0), (True, 1.0)]
+    assert_tallies_match_rebuild(quiz.id)
+    assert_leaderboards_match_rebuild()
+
+
+def test_regrade_multi_question_quiz(make_activity, students):
+    quiz = make_activity('quiz', {'questions': [{'question': 'Q1', 'options': ['A', 'B'], 'correct_answer': 'A'},
+                                                {'question': 'Q2', 'options': ['C', 'D'], 'correct_answer': 'D'}]})
+    for student, answers in zip(students, (['A', 'D'], ['A', 'C'], ['B', 'C'])):
+        save_response(quiz, student.id, {'type': 'quiz', 'answers': answers})
+    db.session.commit()
+    assert marks(quiz) == [(True, 2.0), (False, 1.0), (False, 0.0)]
+
+    assert regrade(quiz, ['A', 'C']) == 3
+    assert marks(quiz) == [(False, 1.0), (True, 2.0), (False, 1.0)]
+    # Unchanged keys change nothing
+    assert regrade(quiz, ['A', 'C']) == 0
+    assert_tallies_match_rebuild(quiz.id)
+    assert_leaderboards_match_rebuild()
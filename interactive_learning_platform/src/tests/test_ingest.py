@@ -0,0 +1,101 @@
+import fcntl
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Response
+from app.aggregates import read_results
+from app.ingest import WriteBehindIngestor
+from tests.conftest import assert_tallies_match_rebuild, assert_leaderboards_match_rebuild
+
+POLL = {'question': 'Favourite?', 'options': ['A', 'B']}
+
+
+@pytest.fixture
+def ingestor(app, app_context):
+    # Not the app's write-behind singleton: no flusher thread, replays only when told to
+    ingestor = WriteBehindIngestor()
+    ingestor.init_app(app)
+    os.makedirs(ingestor.directory, exist_ok=True)
+    return ingestor
+
+
+def write_segment(ingestor, name, records):
+    """Leaves a journal segment behind, as a worker that died before flushing it would."""
+    path = os.path.join(ingestor.directory, f'journal-{name}.log')
+    with open(path, 'w') as segment:
+        for activity, student, response_data, submitted_at in records:
+            segment.write(json.dumps({'activity_id': activity.id, 'responder_id': student.id,
+                                      'response_data': response_data, 'submitted_at': submitted_at.isoformat()}) + '\n')
+    return path
+
+
+def answers(activity):
+    db.session.expire_all()
+    return {response.responder_id: response.selected_option
+            for response in Response.query.filter_by(activity_id=activity.id)}
+
+
+def test_replay_writes_orphaned_submissions(ingestor, make_activity, students):
+    poll = make_activity('poll', POLL)
+    quiz = make_activity('quiz', {'question': '1 + 1?', 'options': ['1', '2'], 'correct_answer': '2'})
+    now = datetime.utcnow()
+    path = write_segment(ingestor, '1-1', [
+        (poll, students[0], {'type': 'poll', 'selected_option': 'A'}, now),
+        (poll, students[1], {'type': 'poll', 'selected_option': 'B'}, now),
+        (poll, students[0], {'type': 'poll', 'selected_option': 'B'}, now + timedelta(seconds=1)),
+        (quiz, students[0], {'type': 'quiz', 'answer': '2'}, now),
+    ])
+    with open(path, 'a') as segment:
+        segment.write('{"activity_id": ') # A torn final line: never acknowledged
+
+    assert ingestor.replay_orphans() == 4
+    assert not os.path.exists(path)
+    assert answers(poll) == {students[0].id: 'B', students[1].id: 'B'}
+    assert read_results(poll.id)['options'] == {'B': 2}
+    assert_tallies_match_rebuild(poll.id)
+    assert_tallies_match_rebuild(quiz.id)
+    assert_leaderboards_match_rebuild()
+
+
+def test_replay_is_idempotent(ingestor, make_activity, students):
+    poll = make_activity('poll', POLL)
+    now = datetime.utcnow()
+    records = [(poll, student, {'type': 'poll', 'selected_option': 'A'}, now) for student in students]
+    write_segment(ingestor, '1-1', records)
+    ingestor.replay_orphans()
+    # The same submissions again, e.g. a segment whose flush committed before its process died
+    write_segment(ingestor, '1-2', records)
+    ingestor.replay_orphans()
+
+    assert Response.query.filter_by(activity_id=poll.id).count() == 3
+    assert read_results(poll.id)['options'] == {'A': 3}
+    assert_tallies_match_rebuild(poll.id)
+
+
+def test_replay_keeps_newer_stored_answers(ingestor, make_activity, students):
+    poll = make_activity('poll', POLL)
+    now = datetime.utcnow()
+    write_segment(ingestor, '1-1', [(poll, students[0], {'type': 'poll', 'selected_option': 'B'}, now)])
+    ingestor.replay_orphans()
+    write_segment(ingestor, '1-2', [(poll, students[0], {'type': 'poll', 'selected_option': 'A'},
+                                     now - timedelta(minutes=1))])
+    ingestor.replay_orphans()
+
+    assert answers(poll) == {students[0].id: 'B'}
+    assert_tallies_match_rebuild(poll.id)
+
+
+def test_replay_skips_segments_of_live_processes(ingestor, make_activity, students):
+    poll = make_activity('poll', POLL)
+    path = write_segment(ingestor, '1-1', [(poll, students[0], {'type': 'poll', 'selected_option': 'A'},
+                                            datetime.utcnow())])
+    with open(path, 'ab') as owned:
+        fcntl.flock(owned.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB) # As the process writing it holds it
+        assert ingestor.replay_orphans() == 0
+    assert os.path.exists(path)
+    assert ingestor.replay_orphans() == 1
+    assert answers(poll) == {students[0].id: 'A'}
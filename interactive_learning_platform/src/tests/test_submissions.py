@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from app import db
+from app.models import Activity, Response, LeaderboardScore
+from app.aggregates import read_results
+from app.leaderboard import GLOBAL, ALL_TIME
+from app.submissions import save_response
+from tests.conftest import assert_tallies_match_rebuild, assert_leaderboards_match_rebuild
+
+POLL = {'question': 'Favourite?', 'options': ['A', 'B']}
+QUIZ = {'question': '1 + 1?', 'options': ['1', '2'], 'correct_answer': '2'}
+
+
+def submit(activity, student, response_data):
+    status = save_response(activity, student.id, response_data)
+    db.session.commit()
+    return status
+
+
+def stored(activity, student):
+    return Response.query.filter_by(activity_id=activity.id, responder_id=student.id).all()
+
+
+def test_first_answer_wins_keeps_the_first(make_activity, students):
+    quiz = make_activity('quiz', QUIZ)
+    assert submit(quiz, students[0], {'type': 'quiz', 'answer': '2'}) == 'created'
+    assert submit(quiz, students[0], {'type': 'quiz', 'answer': '1'}) == 'kept'
+
+    [response] = stored(quiz, students[0])
+    assert (response.selected_option, response.is_correct, response.score) == ('2', True, 1.0)
+    assert_tallies_match_rebuild(quiz.id)
+    assert_leaderboards_match_rebuild()
+
+
+def test_last_answer_wins_replaces_the_answer_and_its_tallies(make_activity, students):
+    poll = make_activity('poll', POLL)
+    assert submit(poll, students[0], {'type': 'poll', 'selected_option': 'A'}) == 'created'
+    assert submit(poll, students[1], {'type': 'poll', 'selected_option': 'A'}) == 'created'
+    assert submit(poll, students[0], {'type': 'poll', 'selected_option': 'B'}) == 'updated'
+
+    [response] = stored(poll, students[0])
+    assert response.selected_option == 'B'
+    assert read_results(poll.id)['options'] == {'A': 1, 'B': 1}
+    assert_tallies_match_rebuild(poll.id)
+
+
+def test_replaced_quiz_answer_moves_the_leaderboard(app, make_activity, students):
+    app.config['RESPONSE_POLICY'] = {'default': 'last'}
+    quiz = make_activity('quiz', QUIZ)
+    submit(quiz, students[0], {'type': 'quiz', 'answer': '1'})
+    assert submit(quiz, students[0], {'type': 'quiz', 'answer': '2'}) == 'updated'
+
+    [response] = stored(quiz, students[0])
+    assert (response.is_correct, response.score) == (True, 1.0)
+    board = db.session.get(LeaderboardScore, (GLOBAL, ALL_TIME, students[0].id))
+    assert (board.score, board.answered) == (1, 1)
+    assert_tallies_match_rebuild(quiz.id)
+    assert_leaderboards_match_rebuild()
+
+
+@pytest.mark.parametrize('policy, replaced', [('first', 'kept'), ('last', 'updated')])
+def test_concurrent_submissions_leave_one_response(app, make_activity, students, policy, replaced):
+    # Double-clicks from separate workers: each request races the others to INSERT ... ON CONFLICT
+    app.config['RESPONSE_POLICY'] = {'default': policy}
+    poll = make_activity('poll', POLL)
+    poll_id, student_id = poll.id, students[0].id
+    statuses = []
+    start = threading.Barrier(8)
+
+    def double_click(option):
+        with app.app_context():
+            activity = db.session.get(Activity, poll_id)
+            start.wait()
+            statuses.append(save_response(activity, student_id, {'type': 'poll', 'selected_option': option}))
+            db.session.commit()
+            db.session.remove()
+
+    threads = [threading.Thread(target=double_click, args=('AB'[i % 2],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == sorted(['created'] + [replaced] * 7)
+    db.session.expire_all()
+    assert len(stored(poll, students[0])) == 1
+    assert_tallies_match_rebuild(poll_id)